@@ -0,0 +1,159 @@
+import argparse
+import asyncio
+import time
+import bot
+import bot.video_metadata
+from bot.handlers.get_res import ResHandler
+from bot.handlers.url import UrlHandler
+from bot.metrics import LatencyStats
+from bot.types import STATE
+
+# Бенчмарк проверки ссылок: время до первой клавиатуры (выбор разрешения)
+# и до второй (выбор типа видео). yt_dlp заменен на задержку probe-delay,
+# база данных и Telegram - на заглушки в памяти.
+# "Было" повторяет старый порядок вызовов: две проверки до первой клавиатуры и еще одна до второй.
+#
+# Запуск: python -m benchmarks.bench_probe --videos 20 --probe-delay 0.5
+
+_RECORDED_INFO = {
+    "title": "Benchmark video",
+    "uploader": "Benchmark",
+    "duration": 95,
+    # Селектору форматов yt_dlp нужны format_id, url, ext и protocol, как в настоящем info
+    "formats": [
+        {
+            "format_id": format_id,
+            "url": f"https://cdn.example.com/{format_id}",
+            "ext": ext,
+            "protocol": "https",
+            **codecs,
+        }
+        for format_id, ext, codecs in (
+            ("18", "mp4", {"height": 360, "vcodec": "avc1", "acodec": "mp4a"}),
+            ("136", "mp4", {"height": 720, "vcodec": "avc1", "acodec": "none"}),
+            ("137", "mp4", {"height": 1080, "vcodec": "avc1", "acodec": "none"}),
+            ("140", "m4a", {"vcodec": "none", "acodec": "mp4a"}),
+        )
+    ],
+}
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.users = {}
+
+    async def ensure_user(self, telegram_id: int) -> dict:
+        return self.users.setdefault(telegram_id, {"state": None, "url": None})
+
+    async def update_user(self, telegram_id: int, **fields) -> dict:
+        user = self.users.setdefault(telegram_id, {})
+        for field, value in fields.items():
+            user[field] = value.value if isinstance(value, STATE) else value
+        return dict(user)
+
+    async def update_user_state(self, telegram_id: int, state: STATE) -> None:
+        self.users[telegram_id]["state"] = state.value
+
+    async def get_video_metadata(self, video_key: str) -> None:
+        return None
+
+    async def save_video_metadata(self, video_key: str, metadata: dict, ttl) -> None:
+        pass
+
+
+class FakeTelegram:
+    async def send_message(self, chat_id: int, text: str, **kwargs) -> dict:
+        return {"message_id": 1}
+
+    async def edit_message_text(self, chat_id: int, message_id: int, text: str, **kw):
+        return {"message_id": message_id}
+
+    async def answer_callback_query(self, callback_query_id: str) -> dict:
+        return {}
+
+
+def _message(telegram_id: int, url: str) -> dict:
+    return {
+        "update_id": 1,
+        "message": {
+            "from": {"id": telegram_id},
+            "chat": {"id": telegram_id},
+            "text": url,
+        },
+    }
+
+
+def _callback(telegram_id: int) -> dict:
+    return {
+        "update_id": 2,
+        "callback_query": {
+            "id": "callback",
+            "from": {"id": telegram_id},
+            "data": "res_720p",
+            "message": {"chat": {"id": telegram_id}, "message_id": 1},
+        },
+    }
+
+
+async def _legacy_first_keyboard(url: str) -> None:
+    # Как было: _validate_video и _get_avaliable_resolutions - две отдельные проверки
+    await bot.video_metadata._probe(url)
+    await bot.database_client.update_user(1, url=url, state=STATE.WAIT_FOR_RESOLUTION)
+    await bot.video_metadata._probe(url)
+    await bot.telegram_api_client.send_message(chat_id=1, text="keyboard")
+
+
+async def _legacy_second_keyboard(url: str) -> None:
+    # Как было: _check_available_types проверяет видео еще раз
+    await bot.database_client.update_user(1, video_res="720p")
+    await bot.video_metadata._probe(url)
+    await bot.database_client.update_user_state(1, STATE.WAIT_FOR_AUDIO)
+    await bot.telegram_api_client.edit_message_text(1, 1, "keyboard")
+
+
+async def main(videos: int, probe_delay: float) -> None:
+    def extract_info(url: str) -> dict:
+        time.sleep(probe_delay)
+        return _RECORDED_INFO
+
+    bot.video_metadata._extract_info = extract_info
+    bot.database_client = FakeDatabase()
+    bot.telegram_api_client = FakeTelegram()
+    url_handler = UrlHandler()
+    res_handler = ResHandler()
+
+    results = {}
+    for run, name in enumerate(("before", "after"), start=1):
+        first, second = LatencyStats(), LatencyStats()
+        for number in range(videos):
+            # У каждого прогона своя ссылка, чтобы кэш метаданных не помогал
+            url = f"https://vkvideo.ru/video{run}{number:04d}_456239073"
+            started = time.perf_counter()
+            if name == "before":
+                await _legacy_first_keyboard(url)
+            else:
+                await url_handler.handle(_message(1, url), STATE.WAIT_FOR_ID.value)
+            first.observe(time.perf_counter() - started)
+
+            started = time.perf_counter()
+            if name == "before":
+                await _legacy_second_keyboard(url)
+            else:
+                await res_handler.handle(_callback(1), STATE.WAIT_FOR_RESOLUTION.value)
+            second.observe(time.perf_counter() - started)
+        results[name] = (first.snapshot(), second.snapshot())
+
+    print(f"videos={videos} probe delay={probe_delay * 1000:.0f} ms")
+    for name, (first, second) in results.items():
+        print(
+            f"{name:7} first keyboard p50 {first['p50'] * 1000:8.1f} ms   "
+            f"second keyboard p50 {second['p50'] * 1000:8.1f} ms"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--videos", type=int, default=20)
+    parser.add_argument("--probe-delay", type=float, default=0.5)
+    args = parser.parse_args()
+    asyncio.run(main(args.videos, args.probe_delay))
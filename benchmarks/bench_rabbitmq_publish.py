@@ -0,0 +1,81 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+import aio_pika
+from bot.metrics import LatencyStats
+from bot.rabbitmq_publisher import RabbitMQPublisher
+
+# Бенчмарк отправки заданий в RabbitMQ: новое соединение на каждое задание (как раньше
+# делал DownloadUtils._send_to_rabbitmq) против общего соединения с пулом каналов и
+# publisher confirms (RabbitMQPublisher). Нужен запущенный RabbitMQ (RABBITMQ_HOST),
+# задания пишутся в отдельную очередь, которая удаляется в конце.
+#
+# Запуск: RABBITMQ_HOST=localhost python -m benchmarks.bench_rabbitmq_publish --tasks 200 --concurrency 10
+
+_QUEUE = "bench_rabbitmq_publish"
+
+
+async def _publish_with_new_connection(task: dict) -> None:
+    connection = await aio_pika.connect_robust(host=os.getenv("RABBITMQ_HOST"))
+    async with connection:
+        channel = await connection.channel()
+        queue = await channel.declare_queue(_QUEUE, durable=True)
+        await channel.default_exchange.publish(
+            aio_pika.Message(
+                body=json.dumps(task).encode(),
+                delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
+            ),
+            routing_key=queue.name,
+        )
+
+
+async def _run(publish, tasks: int, concurrency: int) -> tuple[float, dict]:
+    latency = LatencyStats(window=tasks)
+    slots = asyncio.Semaphore(concurrency)
+
+    async def one(number: int) -> None:
+        async with slots:
+            started = time.perf_counter()
+            await publish({"chat_id": number, "url": f"https://example.com/{number}"})
+            latency.observe(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(number) for number in range(tasks)))
+    return time.perf_counter() - started, latency.snapshot()
+
+
+async def main(tasks: int, concurrency: int) -> None:
+    publisher = RabbitMQPublisher(
+        os.getenv("RABBITMQ_HOST"), [_QUEUE], channels=2, timeout=10, max_retries=3
+    )
+    try:
+        results = {
+            "new connection": await _run(
+                _publish_with_new_connection, tasks, concurrency
+            ),
+            "publisher": await _run(
+                lambda task: publisher.publish(task, _QUEUE), tasks, concurrency
+            ),
+        }
+    finally:
+        await publisher.close()
+        connection = await aio_pika.connect_robust(host=os.getenv("RABBITMQ_HOST"))
+        async with connection:
+            channel = await connection.channel()
+            await channel.queue_delete(_QUEUE)
+
+    for name, (elapsed, latency) in results.items():
+        print(
+            f"{name:15} {tasks / elapsed:8.1f} tasks/s   latency ms "
+            f"p50 {latency['p50'] * 1000:7.2f}  p99 {latency['p99'] * 1000:7.2f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tasks", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=10)
+    args = parser.parse_args()
+    asyncio.run(main(args.tasks, args.concurrency))
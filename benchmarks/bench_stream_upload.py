@@ -0,0 +1,164 @@
+import argparse
+import asyncio
+import hashlib
+import os
+import tempfile
+import time
+from aiohttp import web
+import bot
+import bot.telegram_api_client
+from bot.worker import DownloadWorker
+
+# Бенчмарк времени доставки файла из одного куска: скачивание с фейкового медиасервера
+# настоящим yt_dlp и загрузка в фейковый Bot API, оба с ограниченной скоростью.
+# Сравнивает последовательную загрузку (скачали, потом отправили) с потоковой,
+# когда отправка идет параллельно со скачиванием (WORKER_STREAM_UPLOAD).
+#
+# Запуск: python -m benchmarks.bench_stream_upload --size-mb 20 --download-mbps 10 --upload-mbps 10
+
+_BLOCK = 64 * 1024
+
+
+class FakeDatabase:
+    async def get_cached_file(self, video_key: str, ydl_format: str) -> None:
+        return None
+
+    async def save_cached_file(self, video_key, ydl_format, file_id, title) -> None:
+        pass
+
+    async def claim_download(
+        self, video_key, ydl_format, owner, stale_after, take_over=False
+    ) -> bool:
+        return True
+
+    async def touch_download(self, video_key, ydl_format, owner) -> bool:
+        return True
+
+    async def finish_download(self, video_key, ydl_format, owner, take_waiters=True):
+        return []
+
+
+async def _throttle(started: float, sent: int, rate: float) -> None:
+    delay = started + sent / rate - time.monotonic()
+    if delay > 0:
+        await asyncio.sleep(delay)
+
+
+def _media_handler(data: bytes, rate: float):
+    async def handler(request: web.Request) -> web.StreamResponse:
+        response = web.StreamResponse(
+            headers={"Content-Type": "video/mp4", "Content-Length": str(len(data))}
+        )
+        await response.prepare(request)
+        if request.method == "HEAD":
+            return response
+        started = time.monotonic()
+        try:
+            for offset in range(0, len(data), _BLOCK):
+                await response.write(data[offset : offset + _BLOCK])
+                await _throttle(started, offset + _BLOCK, rate)
+            await response.write_eof()
+        except ConnectionResetError:
+            # Экстрактор yt_dlp читает только начало файла и закрывает соединение
+            pass
+        return response
+
+    return handler
+
+
+def _bot_api_handler(rate: float, received: list):
+    async def handler(request: web.Request) -> web.Response:
+        # Читаем документ с ограниченной скоростью, как медленный канал до Telegram
+        started = time.monotonic()
+        digest = hashlib.sha256()
+        size = 0
+        async for part in await request.multipart():
+            if part.name != "document":
+                await part.read()
+                continue
+            while True:
+                chunk = await part.read_chunk(_BLOCK)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                size += len(chunk)
+                await _throttle(started, size, rate)
+        received.append((size, digest.hexdigest()))
+        return web.json_response(
+            {"ok": True, "result": {"document": {"file_id": f"file-{len(received)}"}}}
+        )
+
+    return handler
+
+
+async def _start_server(app: web.Application) -> tuple[web.AppRunner, str]:
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}"
+
+
+async def main(size_mb: float, download_mbps: float, upload_mbps: float) -> None:
+    data = os.urandom(int(size_mb * 1024 * 1024))
+    received = []
+    media_app = web.Application()
+    media_app.router.add_route(
+        "*", "/video.mp4", _media_handler(data, download_mbps * 1024 * 1024)
+    )
+    api_app = web.Application()
+    api_app.router.add_post(
+        "/{token}/{method}", _bot_api_handler(upload_mbps * 1024 * 1024, received)
+    )
+    media_runner, media_url = await _start_server(media_app)
+    api_runner, api_url = await _start_server(api_app)
+
+    os.environ["TELEGRAM_API_URL"] = api_url
+    os.environ["TELEGRAM_MAX_FILE_SIZE_MB"] = str(int(size_mb) + 10)
+    os.environ["MEDIA_CACHE_SIZE_MB"] = "0"
+    # Лимиты отправки Telegram здесь не нужны: измеряем скачивание и загрузку, а не токен-бакет
+    for name in ("GLOBAL", "CHAT"):
+        os.environ[f"TELEGRAM_{name}_RATE"] = "1000000"
+        os.environ[f"TELEGRAM_{name}_BURST"] = "1000000"
+    bot.database_client = FakeDatabase()
+
+    results = {}
+    try:
+        for chat_id, (name, stream) in enumerate(
+            (("sequential", "0"), ("streaming", "1")), start=1
+        ):
+            os.environ["WORKER_STREAM_UPLOAD"] = stream
+            worker = DownloadWorker()
+            started = time.perf_counter()
+            success, _ = await worker._download_and_send_file(
+                chat_id, chat_id, f"{media_url}/video.mp4", "best", f"bench:{name}"
+            )
+            results[name] = (time.perf_counter() - started, success, received[-1])
+    finally:
+        await bot.telegram_api_client.close_session()
+        await media_runner.cleanup()
+        await api_runner.cleanup()
+
+    download_time = size_mb / download_mbps
+    upload_time = size_mb / upload_mbps
+    print(
+        f"file {size_mb:.0f} Mb, download {download_time:.1f} s, upload {upload_time:.1f} s"
+    )
+    expected = hashlib.sha256(data).hexdigest()
+    for name, (elapsed, success, (size, digest)) in results.items():
+        print(
+            f"{name:10} time to delivery {elapsed:6.2f} s   ok={success} "
+            f"uploaded {size / (1024 * 1024):.1f} Mb, same bytes={digest == expected}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size-mb", type=float, default=20)
+    parser.add_argument("--download-mbps", type=float, default=10)
+    parser.add_argument("--upload-mbps", type=float, default=10)
+    args = parser.parse_args()
+    # Папки заданий воркера создаются во временной папке
+    os.chdir(tempfile.mkdtemp())
+    asyncio.run(main(args.size_mb, args.download_mbps, args.upload_mbps))
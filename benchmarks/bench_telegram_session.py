@@ -0,0 +1,85 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+import aiohttp
+from aiohttp import web
+import bot.telegram_api_client
+
+# Бенчмарк клиента Telegram API против локального фейкового Bot API сервера.
+# Сравнивает старое поведение (новая ClientSession на каждый запрос)
+# с общей сессией из пула keep-alive соединений.
+#
+# Запуск: python -m benchmarks.bench_telegram_session --requests 2000 --concurrency 50
+
+
+async def _fake_bot_api(request: web.Request) -> web.Response:
+    await request.read()
+    return web.json_response({"ok": True, "result": {"message_id": 1}})
+
+
+async def _start_fake_server() -> tuple[web.AppRunner, str]:
+    app = web.Application()
+    app.router.add_post("/{token}/{method}", _fake_bot_api)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}"
+
+
+async def _send_message_new_session(chat_id: int, text: str) -> dict:
+    # Так make_request работал до общей сессии
+    url = bot.telegram_api_client._get_method_url("sendMessage")
+    async with aiohttp.ClientSession() as session:
+        async with session.post(
+            url,
+            data=json.dumps({"chat_id": chat_id, "text": text}).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+        ) as response:
+            response_json = json.loads(await response.text())
+            assert response_json["ok"]
+            return response_json["result"]
+
+
+async def _run(send, total: int, concurrency: int) -> float:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i: int):
+        async with semaphore:
+            await send(chat_id=i, text="benchmark")
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(total)))
+    return total / (time.perf_counter() - started)
+
+
+async def main(total: int, concurrency: int) -> None:
+    runner, api_url = await _start_fake_server()
+    os.environ["TELEGRAM_API_URL"] = api_url
+    os.environ.setdefault("TELEGRAM_TOKEN", "benchmark")
+    # Лимиты отправки Telegram здесь не нужны: измеряем пул соединений, а не токен-бакет
+    for name in ("GLOBAL", "CHAT"):
+        os.environ[f"TELEGRAM_{name}_RATE"] = "1000000"
+        os.environ[f"TELEGRAM_{name}_BURST"] = "1000000"
+    try:
+        before = await _run(_send_message_new_session, total, concurrency)
+        after = await _run(bot.telegram_api_client.send_message, total, concurrency)
+        await bot.telegram_api_client.close_session()
+    finally:
+        await runner.cleanup()
+
+    print(f"requests={total} concurrency={concurrency}")
+    print(f"session per request: {before:10.1f} req/s")
+    print(f"pooled session:      {after:10.1f} req/s")
+    print(f"speedup:             {after / before:10.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args()
+    asyncio.run(main(args.requests, args.concurrency))
@@ -0,0 +1,93 @@
+import argparse
+import asyncio
+import time
+import aiohttp
+from aiohttp import web
+from bot.dispatcher import Dispatcher
+from bot.metrics import LatencyStats
+from bot.update_scheduler import UpdateScheduler
+from bot.webhook import SECRET_TOKEN_HEADER, create_webhook_app
+
+# Бенчмарк webhook-сервера: записанные updates отправляются POST-запросами,
+# dispatch имитирует работу хэндлеров задержкой.
+#
+# Запуск: python -m benchmarks.bench_webhook --updates 5000 --concurrency 100 --users 500
+
+
+class SleepingDispatcher(Dispatcher):
+    def __init__(self, handler_delay: float):
+        super().__init__()
+        self.handler_delay = handler_delay
+        self.dispatched = 0
+
+    async def dispatch(self, update: dict) -> None:
+        await asyncio.sleep(self.handler_delay)
+        self.dispatched += 1
+
+
+def _recorded_update(update_id: int, telegram_id: int) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "from": {"id": telegram_id, "is_bot": False, "first_name": "Test"},
+            "chat": {"id": telegram_id, "type": "private"},
+            "date": 1640995200,
+            "text": "https://vkvideo.ru/video837424820_456239073",
+        },
+    }
+
+
+async def main(total: int, concurrency: int, users: int, handler_delay: float) -> None:
+    dispatcher = SleepingDispatcher(handler_delay)
+    scheduler = UpdateScheduler(
+        dispatcher, max_concurrent_users=users, max_pending_updates=total
+    )
+    runner = web.AppRunner(
+        create_webhook_app(scheduler, "secret", "/webhook"), access_log=None
+    )
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    url = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}/webhook"
+
+    ack_latency = LatencyStats(window=total)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with aiohttp.ClientSession() as session:
+
+        async def post(update_id: int):
+            async with semaphore:
+                started = time.perf_counter()
+                async with session.post(
+                    url,
+                    json=_recorded_update(update_id, update_id % users),
+                    headers={SECRET_TOKEN_HEADER: "secret"},
+                ) as response:
+                    assert response.status == 200
+                ack_latency.observe(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(post(update_id) for update_id in range(total)))
+        acked = time.perf_counter() - started
+        await scheduler.join()
+        processed = time.perf_counter() - started
+
+    await runner.cleanup()
+    stats = ack_latency.snapshot()
+    print(f"updates={total} concurrency={concurrency} users={users}")
+    print(f"handler delay:      {handler_delay * 1000:8.1f} ms")
+    print(f"acked:              {total / acked:8.1f} updates/s")
+    print(f"processed:          {dispatcher.dispatched / processed:8.1f} updates/s")
+    print(f"ack latency p50:    {stats['p50'] * 1000:8.2f} ms")
+    print(f"ack latency p99:    {stats['p99'] * 1000:8.2f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--updates", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--handler-delay", type=float, default=0.05)
+    args = parser.parse_args()
+    asyncio.run(main(args.updates, args.concurrency, args.users, args.handler_delay))
@@ -0,0 +1,120 @@
+import argparse
+import asyncio
+import multiprocessing
+import os
+import tempfile
+import time
+from aiohttp import web
+import bot
+import bot.telegram_api_client
+from benchmarks.bench_stream_upload import (
+    FakeDatabase,
+    _bot_api_handler,
+    _media_handler,
+    _start_server,
+)
+from bot.worker import DownloadWorker
+
+# Бенчмарк задержки event loop воркера во время скачиваний: несколько заданий подряд
+# качают файлы настоящим yt_dlp с фейкового медиасервера (в отдельном процессе, чтобы
+# он не делил GIL с воркером) и загружают их в фейковый Bot API в event loop воркера.
+# Сравнивает yt_dlp в потоках воркера (WORKER_DOWNLOAD_MODE=thread) и в дочерних
+# процессах (process) по перцентилям LoopLagMonitor и общему времени.
+#
+# Запуск: python -m benchmarks.bench_worker_loop_lag --jobs 4 --size-mb 50 --download-mbps 200
+
+
+def _serve_media(size_mb: float, rate: float, ready) -> None:
+    async def serve():
+        app = web.Application()
+        data = os.urandom(int(size_mb * 1024 * 1024))
+        app.router.add_route("*", "/{name}", _media_handler(data, rate))
+        _, url = await _start_server(app)
+        ready.send(url)
+        await asyncio.Event().wait()
+
+    asyncio.run(serve())
+
+
+async def _run_jobs(mode: str, jobs: int, media_url: str) -> tuple[float, dict, int]:
+    os.environ["WORKER_DOWNLOAD_MODE"] = mode
+    os.environ["WORKER_CONCURRENCY"] = str(jobs)
+    # Запасные процессы запускаются заранее, как при старте воркера
+    os.environ["WORKER_SPARE_PROCESSES"] = str(jobs)
+    worker = DownloadWorker()
+    if mode == "process":
+        worker._child_processes.warm_up()
+        await asyncio.sleep(3)
+    worker.loop_lag.start()
+    started = time.perf_counter()
+    results = await asyncio.gather(
+        *(
+            worker._download_and_send_file(
+                number,
+                number,
+                f"{media_url}/{mode}-{number}.mp4",
+                "best",
+                f"bench:{mode}:{number}",
+            )
+            for number in range(jobs)
+        )
+    )
+    elapsed = time.perf_counter() - started
+    await worker.loop_lag.stop()
+    worker._executor.shutdown()
+    worker._child_processes.close()
+    delivered = sum(1 for success, _ in results if success)
+    return elapsed, worker.loop_lag.lag.snapshot(), delivered
+
+
+async def main(jobs: int, media_url: str, size_mb: float) -> None:
+    received = []
+    api_app = web.Application()
+    api_app.router.add_post(
+        "/{token}/{method}", _bot_api_handler(1024 * 1024 * 1024, received)
+    )
+    api_runner, api_url = await _start_server(api_app)
+
+    os.environ["TELEGRAM_API_URL"] = api_url
+    os.environ["TELEGRAM_MAX_FILE_SIZE_MB"] = str(int(size_mb) + 10)
+    os.environ["MEDIA_CACHE_SIZE_MB"] = "0"
+    os.environ["WORKER_STREAM_UPLOAD"] = "0"
+    # Лимиты отправки Telegram здесь не нужны: измеряем скачивание и загрузку, а не токен-бакет
+    for name in ("GLOBAL", "CHAT"):
+        os.environ[f"TELEGRAM_{name}_RATE"] = "1000000"
+        os.environ[f"TELEGRAM_{name}_BURST"] = "1000000"
+    bot.database_client = FakeDatabase()
+
+    try:
+        for mode in ("thread", "process"):
+            elapsed, lag, delivered = await _run_jobs(mode, jobs, media_url)
+            print(
+                f"{mode:8} {jobs} jobs x {size_mb:.0f} Mb: {elapsed:6.2f} s, "
+                f"delivered {delivered}, loop lag ms "
+                f"p50 {lag['p50'] * 1000:6.1f}  p99 {lag['p99'] * 1000:6.1f}  "
+                f"max {lag['max'] * 1000:6.1f}"
+            )
+    finally:
+        await bot.telegram_api_client.close_session()
+        await api_runner.cleanup()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--jobs", type=int, default=4)
+    parser.add_argument("--size-mb", type=float, default=50)
+    parser.add_argument("--download-mbps", type=float, default=200)
+    args = parser.parse_args()
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    server = multiprocessing.Process(
+        target=_serve_media,
+        args=(args.size_mb, args.download_mbps * 1024 * 1024, sender),
+        daemon=True,
+    )
+    server.start()
+    # Папки заданий воркера создаются во временной папке
+    os.chdir(tempfile.mkdtemp())
+    try:
+        asyncio.run(main(args.jobs, receiver.recv(), args.size_mb))
+    finally:
+        server.terminate()
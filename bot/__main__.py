@@ -1,16 +1,37 @@
 import bot.long_polling
+import bot.webhook
+import bot.telegram_api_client
+import bot.database_client
+import bot.video_metadata
 from bot.dispatcher import Dispatcher
+from bot.download_utils import DownloadUtils
 from bot.handlers import get_handlers
+from bot.rabbitmq_publisher import close_publisher
+from bot.update_log_buffer import close_update_log_buffer
 import asyncio
+import os
 
 
 async def main() -> None:
     try:
         dispatcher = Dispatcher()
         dispatcher.add_handlers(*get_handlers())
-        await bot.long_polling.start_long_polling(dispatcher)
+        await bot.database_client.start_user_cache_listener()
+        await asyncio.to_thread(DownloadUtils._warm_up_extractors)
+        # BOT_MODE: polling - бот сам опрашивает Telegram, webhook - Telegram присылает updates
+        if os.getenv("BOT_MODE", "polling") == "webhook":
+            await bot.webhook.start_webhook(dispatcher)
+        else:
+            await bot.long_polling.start_long_polling(dispatcher)
     except KeyboardInterrupt:
         print("\nBot stopped working.")
+    finally:
+        await close_update_log_buffer()
+        await bot.database_client.close_user_cache_listener()
+        await bot.video_metadata.close_probe_executor()
+        await close_publisher()
+        await bot.database_client.close_pool()
+        await bot.telegram_api_client.close_session()
 
 
 if __name__ == "__main__":
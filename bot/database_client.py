@@ -1,5 +1,9 @@
+import asyncio
 import os
 import json
+import traceback
+import uuid
+from bot.ttl_cache import TTLCache
 from bot.types import STATE
 from dotenv import load_dotenv
 import asyncpg
@@ -7,36 +11,51 @@ import asyncpg
 load_dotenv()
 
 _pool = None
+_user_cache = None
+_user_cache_listener = None
+# Кэшу можно верить, только пока есть подписка на изменения из других процессов
+_user_cache_synced = False
+_user_cache_generation = 0
+
+USER_CHANGES_CHANNEL = "user_changed"
+# По этому id процесс узнает (и пропускает) уведомления о собственных изменениях
+_PROCESS_ID = uuid.uuid4().hex
+
+
+def _get_connection_params() -> dict:
+    host = os.getenv("POSTGRES_HOST")
+    port = os.getenv("POSTGRES_PORT")
+    user = os.getenv("POSTGRES_USER")
+    password = os.getenv("POSTGRES_PASSWORD")
+    database = os.getenv("POSTGRES_DATABASE")
+
+    if host is None:
+        raise ValueError("POSTGRES_HOST environment variable is not set")
+    if port is None:
+        raise ValueError("POSTGRES_PORT environment variable is not set")
+    if user is None:
+        raise ValueError("POSTGRES_USER environment variable is not set")
+    if password is None:
+        raise ValueError("POSTGRES_PASSWORD environment variable is not set")
+    if database is None:
+        raise ValueError("POSTGRES_DATABASE environment variable is not set")
+
+    return {
+        "host": host,
+        "port": int(port),
+        "user": user,
+        "password": password,
+        "database": database,
+    }
 
 
 async def get_pool() -> asyncpg.Pool:
     global _pool
     if _pool is None:
-        host = os.getenv("POSTGRES_HOST")
-        port = os.getenv("POSTGRES_PORT")
-        user = os.getenv("POSTGRES_USER")
-        password = os.getenv("POSTGRES_PASSWORD")
-        database = os.getenv("POSTGRES_DATABASE")
-
-        if host is None:
-            raise ValueError("POSTGRES_HOST environment variable is not set")
-        if port is None:
-            raise ValueError("POSTGRES_PORT environment variable is not set")
-        if user is None:
-            raise ValueError("POSTGRES_USER environment variable is not set")
-        if password is None:
-            raise ValueError("POSTGRES_PASSWORD environment variable is not set")
-        if database is None:
-            raise ValueError("POSTGRES_DATABASE environment variable is not set")
-
         _pool = await asyncpg.create_pool(
-            host=host,
-            port=int(port),
-            user=user,
-            password=password,
-            database=database,
+            **_get_connection_params(),
             min_size=1,
-            max_size=10,
+            max_size=int(os.getenv("POSTGRES_POOL_SIZE", "10")),
         )
     return _pool
 
@@ -69,10 +88,67 @@ async def create_database() -> None:
             state TEXT DEFAULT NULL,
             url TEXT DEFAULT NULL,
             video_res TEXT DEFAULT NULL,
-            video_type TEXT DEFAULT NULL
+            video_type TEXT DEFAULT NULL,
+            video_info TEXT DEFAULT NULL
+            )
+            """,
+        )
+        await connection.execute(
+            "ALTER TABLE users ADD COLUMN IF NOT EXISTS video_info TEXT DEFAULT NULL"
+        )
+        await connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS telegram_files
+            (
+            video_key TEXT NOT NULL,
+            ydl_format TEXT NOT NULL,
+            file_id TEXT NOT NULL,
+            title TEXT DEFAULT NULL,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            PRIMARY KEY (video_key, ydl_format)
+            )
+            """,
+        )
+        await connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS video_metadata
+            (
+            video_key TEXT PRIMARY KEY,
+            metadata TEXT NOT NULL,
+            expires_at TIMESTAMPTZ NOT NULL
+            )
+            """,
+        )
+        await connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS download_flights
+            (
+            video_key TEXT NOT NULL,
+            ydl_format TEXT NOT NULL,
+            owner TEXT NOT NULL,
+            started_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            PRIMARY KEY (video_key, ydl_format)
             )
             """,
         )
+        await connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS download_waiters
+            (
+            id SERIAL PRIMARY KEY,
+            video_key TEXT NOT NULL,
+            ydl_format TEXT NOT NULL,
+            chat_id BIGINT NOT NULL,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+            )
+            """,
+        )
+        await connection.execute(
+            """
+            CREATE INDEX IF NOT EXISTS download_waiters_video_idx
+            ON download_waiters (video_key, ydl_format)
+            """,
+        )
 
 
 async def delete_database() -> None:
@@ -81,103 +157,403 @@ async def delete_database() -> None:
         async with connection.transaction():
             await connection.execute("DROP TABLE IF EXISTS telegram_updates")
             await connection.execute("DROP TABLE IF EXISTS users")
+            await connection.execute("DROP TABLE IF EXISTS telegram_files")
+            await connection.execute("DROP TABLE IF EXISTS video_metadata")
+            await connection.execute("DROP TABLE IF EXISTS download_flights")
+            await connection.execute("DROP TABLE IF EXISTS download_waiters")
 
 
-async def persist_updates(updates: dict) -> None:
-    payload = json.dumps(updates, ensure_ascii=False, indent=2)
+async def persist_updates_batch(updates: list[dict]) -> None:
+    # Пачка updates одной командой COPY вместо INSERT на каждый update
+    records = [(json.dumps(update, ensure_ascii=False),) for update in updates]
     pool = await get_pool()
     async with pool.acquire() as connection:
-        async with connection.transaction():
-            await connection.execute(
-                "INSERT INTO telegram_updates (payload) VALUES ($1)", payload
+        await connection.copy_records_to_table(
+            "telegram_updates", records=records, columns=["payload"]
+        )
+
+
+_USER_COLUMNS = "id, telegram_id, state, url, video_res, video_type, video_info"
+_USER_UPDATABLE_FIELDS = ("state", "url", "video_res", "video_type", "video_info")
+
+
+def _user_from_row(row) -> dict:
+    return {
+        "id": row[0],
+        "telegram_id": row[1],
+        "state": row[2],
+        "url": row[3],
+        "video_res": row[4],
+        "video_type": row[5],
+        # Краткие метаданные видео, полученные при проверке ссылки (JSON)
+        "video_info": json.loads(row[6]) if row[6] else None,
+    }
+
+
+def get_user_cache() -> TTLCache:
+    global _user_cache
+    if _user_cache is None:
+        _user_cache = TTLCache(
+            max_size=int(os.getenv("BOT_USER_CACHE_SIZE", "10000")),
+            ttl=float(os.getenv("BOT_USER_CACHE_TTL", "300")),
+        )
+    return _user_cache
+
+
+def _get_cached_user(telegram_id: int) -> dict | None:
+    if not _user_cache_synced:
+        return None
+    user = get_user_cache().get(telegram_id)
+    # Отдаем копию, чтобы хэндлеры не могли случайно поменять строку в кэше
+    return dict(user) if user else None
+
+
+def _cache_user(telegram_id: int, user: dict | None, generation: int) -> None:
+    if not _user_cache_synced:
+        return
+    # Если пока шел запрос пришло уведомление об изменении из другого процесса,
+    # прочитанная строка могла устареть - такую не кэшируем
+    if user is None or generation != _user_cache_generation:
+        get_user_cache().invalidate(telegram_id)
+    else:
+        get_user_cache().set(telegram_id, dict(user))
+
+
+def _on_user_changed(connection, pid, channel, payload: str) -> None:
+    global _user_cache_generation
+    process_id, _, telegram_id = payload.partition(":")
+    if process_id == _PROCESS_ID:
+        return
+    _user_cache_generation += 1
+    get_user_cache().invalidate(int(telegram_id))
+
+
+async def _listen_user_changes() -> None:
+    global _user_cache_synced
+    while True:
+        connection = None
+        try:
+            connection = await asyncpg.connect(**_get_connection_params())
+            closed = asyncio.Event()
+            connection.add_termination_listener(lambda _, closed=closed: closed.set())
+            await connection.add_listener(USER_CHANGES_CHANNEL, _on_user_changed)
+            # Пока подписки не было, уведомления могли потеряться - начинаем с пустого кэша
+            get_user_cache().clear()
+            _user_cache_synced = True
+            await closed.wait()
+        except Exception:
+            traceback.print_exc()
+        finally:
+            _user_cache_synced = False
+            get_user_cache().clear()
+            if connection is not None and not connection.is_closed():
+                await connection.close()
+        await asyncio.sleep(1)
+
+
+async def start_user_cache_listener() -> None:
+    # Подписка на изменения users из воркера и других процессов бота (LISTEN/NOTIFY)
+    global _user_cache_listener
+    if _user_cache_listener is None:
+        _user_cache_listener = asyncio.create_task(_listen_user_changes())
+
+
+async def close_user_cache_listener() -> None:
+    global _user_cache_listener
+    if _user_cache_listener:
+        _user_cache_listener.cancel()
+        try:
+            await _user_cache_listener
+        except asyncio.CancelledError:
+            pass
+        _user_cache_listener = None
+
+
+async def _update_user_row(telegram_id: int, assignments: str, *values) -> dict | None:
+    # UPDATE и уведомление остальных процессов (pg_notify) - одним запросом.
+    # Новая строка сразу кладется в кэш этого процесса
+    number = len(values) + 1
+    generation = _user_cache_generation
+    pool = await get_pool()
+    async with pool.acquire() as connection:
+        result = await connection.fetchrow(
+            f"""
+            WITH updated AS (
+                UPDATE users SET {assignments} WHERE telegram_id = ${number}
+                RETURNING {_USER_COLUMNS}
             )
+            SELECT {_USER_COLUMNS},
+                pg_notify(${number + 1}::text, ${number + 2}::text || ':' || telegram_id)
+            FROM updated
+            """,
+            *values,
+            telegram_id,
+            USER_CHANGES_CHANNEL,
+            _PROCESS_ID,
+        )
+    user = _user_from_row(result) if result else None
+    _cache_user(telegram_id, user, generation)
+    return user
+
+
+async def clear_user_video_and_set_state(telegram_id: int) -> dict | None:
+    return await _update_user_row(
+        telegram_id,
+        "state = $1, url = NULL, video_res = NULL, video_type = NULL, video_info = NULL",
+        STATE.WAIT_FOR_ID.value,
+    )
+
+
+async def update_user_state(telegram_id: int, state: STATE) -> dict | None:
+    return await _update_user_row(telegram_id, "state = $1", state.value)
 
 
-async def ensure_user_exists(telegram_id: int) -> None:
+async def get_user(telegram_id: int) -> dict:
+    user = _get_cached_user(telegram_id)
+    if user:
+        return user
+    generation = _user_cache_generation
     pool = await get_pool()
     async with pool.acquire() as connection:
-        async with connection.transaction():
+        result = await connection.fetchrow(
+            f"SELECT {_USER_COLUMNS} FROM users WHERE telegram_id = $1",
+            telegram_id,
+        )
+    user = _user_from_row(result) if result else None
+    _cache_user(telegram_id, user, generation)
+    return user
+
+
+async def ensure_user(telegram_id: int) -> dict:
+    # Чаще всего пользователь уже в кэше, и запроса к базе нет совсем
+    user = _get_cached_user(telegram_id)
+    if user:
+        return user
+    # Иначе создаем пользователя, если его еще нет, и возвращаем его строку - одним запросом.
+    # SELECT из users не видит строку, вставленную в этом же запросе, поэтому строк не больше одной.
+    # Если того же пользователя одновременно вставляет другой запрос, INSERT ничего не вернет,
+    # а SELECT со снимком до его коммита тоже - тогда читаем строку отдельным запросом
+    generation = _user_cache_generation
+    pool = await get_pool()
+    async with pool.acquire() as connection:
+        result = await connection.fetchrow(
+            f"""
+            WITH inserted AS (
+                INSERT INTO users (telegram_id) VALUES ($1)
+                ON CONFLICT (telegram_id) DO NOTHING
+                RETURNING {_USER_COLUMNS}
+            )
+            SELECT {_USER_COLUMNS} FROM inserted
+            UNION ALL
+            SELECT {_USER_COLUMNS} FROM users WHERE telegram_id = $1
+            LIMIT 1
+            """,
+            telegram_id,
+        )
+        if result is None:
             result = await connection.fetchrow(
-                "SELECT 1 FROM users WHERE telegram_id = $1",
+                f"SELECT {_USER_COLUMNS} FROM users WHERE telegram_id = $1",
                 telegram_id,
             )
-            if result is None:
-                await connection.execute(
-                    "INSERT INTO users (telegram_id) VALUES ($1)",
-                    telegram_id,
-                )
+    user = _user_from_row(result)
+    _cache_user(telegram_id, user, generation)
+    return user
+
+
+def _to_user_column(field: str, value):
+    if isinstance(value, STATE):
+        return value.value
+    if field == "video_info" and value is not None:
+        return json.dumps(value, ensure_ascii=False)
+    return value
+
 
+async def update_user(telegram_id: int, **fields) -> dict | None:
+    # Обновляет сразу несколько полей (state, url, video_res, video_type, video_info)
+    # и возвращает обновленную строку пользователя - одним запросом
+    if not fields:
+        raise ValueError("No user fields to update")
+    for field in fields:
+        if field not in _USER_UPDATABLE_FIELDS:
+            raise ValueError(f"Unknown user field: {field}")
+    values = [_to_user_column(field, value) for field, value in fields.items()]
+    assignments = ", ".join(
+        f"{field} = ${number}" for number, field in enumerate(fields, start=1)
+    )
+    return await _update_user_row(telegram_id, assignments, *values)
 
-async def clear_user_video_and_set_state(telegram_id: int) -> None:
+
+async def get_cached_file(video_key: str, ydl_format: str) -> dict | None:
     pool = await get_pool()
     async with pool.acquire() as connection:
-        async with connection.transaction():
-            await connection.execute(
-                "UPDATE users SET state = $1, url = NULL, video_res = NULL, video_type = NULL WHERE telegram_id = $2",
-                STATE.WAIT_FOR_ID.value,
-                telegram_id,
-            )
+        result = await connection.fetchrow(
+            "SELECT file_id, title FROM telegram_files WHERE video_key = $1 AND ydl_format = $2",
+            video_key,
+            ydl_format,
+        )
+        if result:
+            return {"file_id": result[0], "title": result[1]}
+        return None
 
 
-async def update_user_state(telegram_id: int, state: STATE) -> None:
+async def save_cached_file(
+    video_key: str, ydl_format: str, file_id: str, title: str
+) -> None:
     pool = await get_pool()
     async with pool.acquire() as connection:
-        async with connection.transaction():
-            await connection.execute(
-                "UPDATE users SET state = $1 WHERE telegram_id = $2",
-                state.value,
-                telegram_id,
-            )
+        await connection.execute(
+            """
+            INSERT INTO telegram_files (video_key, ydl_format, file_id, title)
+            VALUES ($1, $2, $3, $4)
+            ON CONFLICT (video_key, ydl_format)
+            DO UPDATE SET file_id = EXCLUDED.file_id, title = EXCLUDED.title, created_at = now()
+            """,
+            video_key,
+            ydl_format,
+            file_id,
+            title,
+        )
 
 
-async def get_user(telegram_id: int) -> dict:
+async def delete_cached_file(video_key: str, ydl_format: str, file_id: str) -> None:
+    # Удаляет только устаревший file_id, не трогая уже перезаписанный другим воркером
     pool = await get_pool()
     async with pool.acquire() as connection:
-        async with connection.transaction():
-            result = await connection.fetchrow(
-                "SELECT id, telegram_id, state, url, video_res, video_type FROM users WHERE telegram_id = $1",
-                telegram_id,
-            )
-            if result:
-                return {
-                    "id": result[0],
-                    "telegram_id": result[1],
-                    "state": result[2],
-                    "url": result[3],
-                    "video_res": result[4],
-                    "video_type": result[5],
-                }
-            return None
-
-
-async def update_user_video(telegram_id: int, video: str) -> None:
+        await connection.execute(
+            "DELETE FROM telegram_files WHERE video_key = $1 AND ydl_format = $2 AND file_id = $3",
+            video_key,
+            ydl_format,
+            file_id,
+        )
+
+
+async def get_video_metadata(video_key: str) -> dict | None:
     pool = await get_pool()
     async with pool.acquire() as connection:
-        async with connection.transaction():
-            await connection.execute(
-                "UPDATE users SET url = $1 WHERE telegram_id = $2",
-                video,
-                telegram_id,
-            )
+        result = await connection.fetchrow(
+            "SELECT metadata FROM video_metadata WHERE video_key = $1 AND expires_at > now()",
+            video_key,
+        )
+        if result:
+            return json.loads(result[0])
+        return None
 
 
-async def update_user_video_res(telegram_id: int, video_res: str) -> None:
+async def save_video_metadata(video_key: str, metadata: dict, ttl: float) -> None:
     pool = await get_pool()
     async with pool.acquire() as connection:
-        async with connection.transaction():
-            await connection.execute(
-                "UPDATE users SET video_res = $1 WHERE telegram_id = $2",
-                video_res,
-                telegram_id,
+        await connection.execute(
+            """
+            INSERT INTO video_metadata (video_key, metadata, expires_at)
+            VALUES ($1, $2, now() + make_interval(secs => $3))
+            ON CONFLICT (video_key)
+            DO UPDATE SET metadata = EXCLUDED.metadata, expires_at = EXCLUDED.expires_at
+            """,
+            video_key,
+            json.dumps(metadata, ensure_ascii=False),
+            float(ttl),
+        )
+
+
+async def claim_download(
+    video_key: str,
+    ydl_format: str,
+    owner: str,
+    stale_after: float,
+    take_over: bool = False,
+) -> bool:
+    # Становимся единственным воркером, который скачивает это видео в этом формате.
+    # Запись упавшего воркера (владелец не обновлял started_at дольше stale_after секунд)
+    # перехватывается. take_over - перехватить запись в любом случае: так повторно
+    # доставленное задание забирает скачивание, которое начало оно же до падения воркера
+    pool = await get_pool()
+    async with pool.acquire() as connection:
+        result = await connection.fetchval(
+            """
+            INSERT INTO download_flights (video_key, ydl_format, owner)
+            VALUES ($1, $2, $3)
+            ON CONFLICT (video_key, ydl_format)
+            DO UPDATE SET owner = EXCLUDED.owner, started_at = now()
+            WHERE $5 OR download_flights.started_at < now() - make_interval(secs => $4)
+            RETURNING owner
+            """,
+            video_key,
+            ydl_format,
+            owner,
+            float(stale_after),
+            take_over,
+        )
+        return result == owner
+
+
+async def touch_download(video_key: str, ydl_format: str, owner: str) -> bool:
+    # Пульс владельца скачивания. False - запись уже перехватил другой воркер
+    pool = await get_pool()
+    async with pool.acquire() as connection:
+        result = await connection.fetchval(
+            """
+            UPDATE download_flights SET started_at = now()
+            WHERE video_key = $1 AND ydl_format = $2 AND owner = $3
+            RETURNING owner
+            """,
+            video_key,
+            ydl_format,
+            owner,
+        )
+        return result is not None
+
+
+async def add_download_waiter(video_key: str, ydl_format: str, chat_id: int) -> bool:
+    # Встаем в очередь ожидающих, только если скачивание еще идет.
+    # FOR SHARE не дает завершить скачивание, пока ожидающий не записан
+    pool = await get_pool()
+    async with pool.acquire() as connection:
+        result = await connection.fetchval(
+            """
+            WITH flight AS (
+                SELECT 1 FROM download_flights
+                WHERE video_key = $1 AND ydl_format = $2
+                FOR SHARE
             )
+            INSERT INTO download_waiters (video_key, ydl_format, chat_id)
+            SELECT $1, $2, $3 FROM flight
+            RETURNING id
+            """,
+            video_key,
+            ydl_format,
+            chat_id,
+        )
+        return result is not None
 
 
-async def update_user_video_type(telegram_id: int, video_type: str) -> None:
+async def finish_download(
+    video_key: str, ydl_format: str, owner: str, take_waiters: bool = True
+) -> list[int]:
+    # Снимает запись о скачивании и забирает chat_id ожидающих.
+    # Если запись уже перехватил другой воркер, ожидающие остаются ему.
+    # Ожидающих читаем отдельным запросом: он видит всех, кто успел записаться до удаления
     pool = await get_pool()
     async with pool.acquire() as connection:
         async with connection.transaction():
-            await connection.execute(
-                "UPDATE users SET video_type = $1 WHERE telegram_id = $2",
-                video_type,
-                telegram_id,
+            deleted = await connection.fetchval(
+                """
+                DELETE FROM download_flights
+                WHERE video_key = $1 AND ydl_format = $2 AND owner = $3
+                RETURNING owner
+                """,
+                video_key,
+                ydl_format,
+                owner,
+            )
+            if deleted is None or not take_waiters:
+                return []
+            rows = await connection.fetch(
+                """
+                DELETE FROM download_waiters
+                WHERE video_key = $1 AND ydl_format = $2
+                RETURNING chat_id
+                """,
+                video_key,
+                ydl_format,
             )
+            return [row[0] for row in rows]
@@ -1,15 +1,39 @@
+import time
 from bot.handlers.handler import Handler
 import bot.database_client
+from bot.metrics import LatencyStats
 from bot.types import STATUS
 
+# Ключ индекса для хэндлеров, которым подходит любое значение поля
+_ANY = "*"
+
 
 class Dispatcher:
     def __init__(self):
         self._handlers: list[Handler] = []
+        self._middlewares: list[Handler] = []
+        self._index: dict[tuple, list[tuple[int, Handler]]] = {}
+        self._routes: dict[tuple, list[Handler]] = {}
+        self._handler_stats: dict[str, LatencyStats] = {}
 
     def add_handlers(self, *handlers: list[Handler]) -> None:
         for handler in handlers:
+            order = len(self._handlers)
             self._handlers.append(handler)
+            self._handler_stats.setdefault(type(handler).__name__, LatencyStats())
+            if handler.middleware:
+                self._middlewares.append(handler)
+                continue
+            kind = handler.update_kind or _ANY
+            prefix = handler.callback_prefix or _ANY
+            states = (
+                [state.value for state in handler.states] if handler.states else [_ANY]
+            )
+            for state in states:
+                self._index.setdefault((kind, state, prefix), []).append(
+                    (order, handler)
+                )
+        self._routes.clear()
 
     def _get_telegram_id_from_update(self, update: dict) -> int:
         if "message" in update:
@@ -18,12 +42,61 @@ class Dispatcher:
             return update["callback_query"]["from"]["id"]
         return None
 
+    def _get_route_key(self, update: dict, user_state) -> tuple:
+        # Разбираем update один раз: тип, состояние пользователя и префикс callback_data
+        if "message" in update:
+            return ("message", user_state, None)
+        if "callback_query" in update:
+            data = update["callback_query"].get("data") or ""
+            separator = data.find("_")
+            prefix = data[: separator + 1] if separator != -1 else None
+            return ("callback_query", user_state, prefix)
+        return (None, user_state, None)
+
+    def _get_candidates(self, route_key: tuple) -> list[Handler]:
+        # Кандидаты для сочетания (тип, состояние, префикс) собираются один раз
+        # и дальше берутся из словаря за O(1)
+        candidates = self._routes.get(route_key)
+        if candidates is None:
+            kind, state, prefix = route_key
+            found = []
+            for kind_key in {kind, _ANY}:
+                for state_key in {state, _ANY}:
+                    for prefix_key in {prefix, _ANY}:
+                        found.extend(
+                            self._index.get((kind_key, state_key, prefix_key), [])
+                        )
+            candidates = [handler for _, handler in sorted(found, key=lambda x: x[0])]
+            self._routes[route_key] = candidates
+        return candidates
+
+    async def _run_handler(self, handler: Handler, update: dict, user_state) -> STATUS:
+        started = time.perf_counter()
+        try:
+            return await handler.handle(update, user_state)
+        finally:
+            self._handler_stats[type(handler).__name__].observe(
+                time.perf_counter() - started
+            )
+
+    def get_handler_stats(self) -> dict:
+        return {name: stats.snapshot() for name, stats in self._handler_stats.items()}
+
     async def dispatch(self, update: dict) -> None:
         telegram_id = self._get_telegram_id_from_update(update)
-        user = await bot.database_client.get_user(telegram_id) if telegram_id else None
+        # Пользователь создается при первом обращении и сразу возвращается одним запросом
+        user = (
+            await bot.database_client.ensure_user(telegram_id) if telegram_id else None
+        )
         user_state = user.get("state") if user else None
 
-        for handler in self._handlers:
+        for handler in self._middlewares:
+            if handler.can_handle(update, user_state):
+                if await self._run_handler(handler, update, user_state) == STATUS.STOP:
+                    return
+
+        route_key = self._get_route_key(update, user_state)
+        for handler in self._get_candidates(route_key):
             if handler.can_handle(update, user_state):
-                if await handler.handle(update, user_state) == STATUS.STOP:
+                if await self._run_handler(handler, update, user_state) == STATUS.STOP:
                     break
@@ -0,0 +1,116 @@
+import json
+import sys
+import time
+from bot.download_utils import DownloadUtils
+from bot.yt_download import FileTooLarge, run_download
+
+# Процесс скачивания одного задания (DownloadProcess в режиме process): читает задание
+# из stdin (JSON-строка), скачивает его и пишет события в stdout по одной JSON-строке.
+# Весь остальной вывод yt_dlp уходит в stderr
+
+# Промежуточный прогресс отправляется не чаще раза в столько секунд
+_PROGRESS_INTERVAL = 0.05
+
+
+class _PipeEvents:
+    def __init__(self, protocol, commands):
+        self._protocol = protocol
+        self._commands = commands
+        self._last_progress = 0.0
+
+    def _send(self, message: dict) -> None:
+        self._protocol.write(json.dumps(message, ensure_ascii=False) + "\n")
+        self._protocol.flush()
+
+    def on_selected(self, info: dict) -> None:
+        self._send(
+            {
+                "event": "selected",
+                "info": {
+                    "protocol": info.get("protocol"),
+                    "requested_formats": bool(info.get("requested_formats")),
+                },
+            }
+        )
+
+    def progress_hook(self, progress: dict) -> None:
+        now = time.monotonic()
+        if progress["status"] == "downloading":
+            if now - self._last_progress < _PROGRESS_INTERVAL:
+                return
+            self._last_progress = now
+        info = progress.get("info_dict") or {}
+        self._send(
+            {
+                "event": "progress",
+                "progress": {
+                    "status": progress["status"],
+                    "downloaded_bytes": progress.get("downloaded_bytes"),
+                    "total_bytes": progress.get("total_bytes"),
+                    "total_bytes_estimate": progress.get("total_bytes_estimate"),
+                    "tmpfilename": progress.get("tmpfilename"),
+                    "filename": progress.get("filename"),
+                    "info_dict": {
+                        "title": info.get("title"),
+                        "format_id": info.get("format_id"),
+                    },
+                },
+            }
+        )
+
+    def postprocessor_hook(self, progress: dict) -> None:
+        self._send(
+            {
+                "event": "postprocessor",
+                "progress": {
+                    "status": progress["status"],
+                    "postprocessor": progress["postprocessor"],
+                },
+            }
+        )
+        if progress["status"] == "started":
+            # Постпроцессор (ffmpeg) начинается, только когда воркер выделит ему слот
+            self._commands.readline()
+
+
+def main() -> int:
+    protocol = sys.stdout
+    sys.stdout = sys.stderr
+    # Запасной процесс компилирует регулярные выражения экстракторов, пока ждет задание,
+    # а не во время скачивания
+    DownloadUtils._warm_up_extractors()
+    line = sys.stdin.readline()
+    if not line:
+        # stdin закрыт без задания: воркер остановился, пока процесс был запасным
+        return 0
+    job = json.loads(line)
+    events = _PipeEvents(protocol, sys.stdin)
+    try:
+        file_path, result = run_download(job, events)
+    except FileTooLarge as e:
+        events._send(
+            {
+                "event": "error",
+                "kind": "too_large",
+                "size": e.size,
+                "approximate": e.approximate,
+            }
+        )
+    except Exception as e:
+        events._send({"event": "error", "kind": "download_error", "message": str(e)})
+    else:
+        events._send(
+            {
+                "event": "result",
+                "file_path": file_path,
+                "result": {
+                    field: result.get(field)
+                    for field in ("title", "filesize", "filesize_approx")
+                },
+            }
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,155 @@
+import json
+import os
+import subprocess
+import sys
+import threading
+import yt_dlp
+from bot.yt_download import FileTooLarge
+
+# Папка, из которой импортируется пакет bot: воркер может работать из другой текущей папки
+_PACKAGE_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class DownloadProcessError(Exception):
+    pass
+
+
+class ChildProcesses:
+    # Запускает процессы скачивания (python -m bot.download_child) и держит spare процессов
+    # наготове: процесс импортирует yt_dlp (около секунды) заранее и ждет задание в stdin.
+    # Каждый процесс выполняет одно задание и завершается
+    def __init__(self, command: list[str] | None = None, spare: int = 1):
+        self._command = command or [sys.executable, "-m", "bot.download_child"]
+        self.spare = spare
+        self._spares: list[subprocess.Popen] = []
+        self._lock = threading.Lock()
+        self._closed = False
+        self.started = 0
+        self.spare_hits = 0
+
+    def _spawn(self) -> subprocess.Popen:
+        python_path = os.environ.get("PYTHONPATH")
+        env = dict(
+            os.environ,
+            PYTHONPATH=(
+                _PACKAGE_ROOT + os.pathsep + python_path
+                if python_path
+                else _PACKAGE_ROOT
+            ),
+        )
+        self.started += 1
+        return subprocess.Popen(
+            self._command,
+            env=env,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            text=True,
+            encoding="utf-8",
+        )
+
+    def take(self) -> subprocess.Popen:
+        # Вызывается из потока воркера
+        with self._lock:
+            process = None
+            while self._spares and process is None:
+                candidate = self._spares.pop()
+                if candidate.poll() is None:
+                    process = candidate
+                    self.spare_hits += 1
+                else:
+                    _discard(candidate)
+            return process if process is not None else self._spawn()
+
+    def warm_up(self) -> None:
+        # Запасные процессы запускаются после задания, а не вместе с ним: импорт yt_dlp
+        # в новом процессе не отнимает процессор у только что начатого скачивания
+        with self._lock:
+            while not self._closed and len(self._spares) < self.spare:
+                self._spares.append(self._spawn())
+
+    def get_stats(self) -> dict:
+        return {"started": self.started, "spare_hits": self.spare_hits}
+
+    def close(self) -> None:
+        with self._lock:
+            self._closed = True
+            for process in self._spares:
+                process.kill()
+                _discard(process)
+            self._spares.clear()
+
+
+def _discard(process: subprocess.Popen) -> None:
+    process.stdin.close()
+    process.stdout.close()
+    process.wait()
+
+
+class DownloadProcess:
+    # Скачивание одного задания в отдельном процессе из processes.
+    # yt_dlp и ffmpeg не делят GIL с event loop воркера, а зависшее скачивание можно убить.
+    # run выполняется в потоке воркера и передает события процесса в events
+    # так же, как их передал бы yt_dlp в этом процессе. kill можно вызывать из event loop
+    def __init__(self, job: dict, processes: ChildProcesses):
+        self.job = job
+        self._processes = processes
+        self._process = None
+        self._lock = threading.Lock()
+        self.killed = False
+
+    def _start(self) -> subprocess.Popen:
+        with self._lock:
+            if self.killed:
+                raise DownloadProcessError("Download process was killed")
+            self._process = self._processes.take()
+            return self._process
+
+    def _write(self, line: str) -> None:
+        self._process.stdin.write(line + "\n")
+        self._process.stdin.flush()
+
+    def run(self, events) -> tuple[str, dict]:
+        process = self._start()
+        try:
+            self._write(json.dumps(self.job, ensure_ascii=False))
+            for line in process.stdout:
+                message = json.loads(line)
+                event = message["event"]
+                if event == "selected":
+                    events.on_selected(message["info"])
+                elif event == "progress":
+                    events.progress_hook(message["progress"])
+                elif event == "postprocessor":
+                    events.postprocessor_hook(message["progress"])
+                    if message["progress"]["status"] == "started":
+                        self._write("continue")
+                elif event == "result":
+                    return message["file_path"], message["result"]
+                elif event == "error":
+                    if message["kind"] == "too_large":
+                        raise FileTooLarge(message["size"], message["approximate"])
+                    raise yt_dlp.utils.DownloadError(message["message"])
+            if self.killed:
+                raise DownloadProcessError("Download process was killed")
+            raise DownloadProcessError(
+                f"Download process exited with code {process.wait()}"
+            )
+        finally:
+            try:
+                process.stdin.close()
+            except OSError:
+                pass
+            try:
+                process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+            process.stdout.close()
+            if not self.killed:
+                self._processes.warm_up()
+
+    def kill(self) -> None:
+        with self._lock:
+            self.killed = True
+            if self._process is not None and self._process.poll() is None:
+                self._process.kill()
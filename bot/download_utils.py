@@ -1,7 +1,19 @@
+import asyncio
 import os
-import json
-import aio_pika
+import time
+import functools
+import urllib.parse
+import yt_dlp
 import bot.telegram_api_client
+import bot.database_client
+from bot.rabbitmq_publisher import get_publisher
+from bot.task_lanes import choose_lane, get_lane_queue
+from bot.telegram_api_client import TelegramAPIError
+
+
+@functools.cache
+def _get_extractor_classes() -> list:
+    return list(yt_dlp.extractor.gen_extractor_classes())
 
 
 class DownloadUtils:
@@ -21,23 +33,186 @@ class DownloadUtils:
         return "best"
 
     @staticmethod
-    async def _send_to_rabbitmq(download_task: dict):
-        # Отправляет задачку в очередь RabbitMQ
-        connection = await aio_pika.connect_robust(host=os.getenv("RABBITMQ_HOST"))
-        async with connection:
-            channel = await connection.channel()
+    @functools.lru_cache(maxsize=4096)
+    def _canonical_video_key(url: str) -> str:
+        # Один и тот же ролик может прийти разными ссылками (youtu.be, shorts, video-id).
+        # Ключ строится без обращения к сети: экстрактор yt_dlp + id видео
+        for extractor in _get_extractor_classes():
+            if extractor.suitable(url):
+                video_id = extractor.get_temp_id(url)
+                if video_id:
+                    return f"{extractor.ie_key()}:{video_id}"
+                return f"{extractor.ie_key()}:{DownloadUtils._normalize_url(url)}"
+        return DownloadUtils._normalize_url(url)
 
-            queue = await channel.declare_queue(
-                os.getenv("RABBITMQ_QUEUE_NAME"), durable=True
-            )
+    @staticmethod
+    async def _get_video_key(url: str) -> str:
+        # Подбор экстрактора перебирает регулярные выражения всех экстракторов yt_dlp
+        # (для Generic-ссылки это около 10 мс), поэтому ключ считается в потоке
+        return await asyncio.to_thread(DownloadUtils._canonical_video_key, url)
+
+    @staticmethod
+    def _warm_up_extractors() -> None:
+        # Первый подбор экстрактора компилирует регулярные выражения всех экстракторов
+        # (около секунды процессора). Вызывается при запуске, а не на первой ссылке
+        for extractor in _get_extractor_classes():
+            extractor.suitable("https://example.com/")
+
+    @staticmethod
+    def _normalize_url(url: str) -> str:
+        # Убирает из ссылки то, что не влияет на само видео
+        if "://" not in url:
+            url = f"https://{url}"
+        parts = urllib.parse.urlsplit(url)
+        host = parts.netloc.lower()
+        for prefix in ("www.", "m."):
+            if host.startswith(prefix):
+                host = host[len(prefix) :]
+        query = sorted(
+            (k, v)
+            for k, v in urllib.parse.parse_qsl(parts.query)
+            if not k.startswith("utm_")
+        )
+        path = parts.path.rstrip("/")
+        return f"{host}{path}?{urllib.parse.urlencode(query)}".rstrip("?")
+
+    @staticmethod
+    def _get_max_file_size() -> int:
+        # Локальный Bot API сервер позволяет отправлять файлы до 2000Mb
+        return int(os.getenv("TELEGRAM_MAX_FILE_SIZE_MB", "50")) * 1024 * 1024
+
+    @staticmethod
+    def _estimate_size(format: dict, duration) -> tuple[int | None, bool]:
+        # Размер выбранного формата (для "137+140" - сумма частей): точный filesize,
+        # примерный filesize_approx или битрейт * длительность
+        total = 0
+        exact = True
+        for part in format.get("requested_formats") or [format]:
+            if part.get("filesize"):
+                total += part["filesize"]
+            elif part.get("filesize_approx"):
+                total += part["filesize_approx"]
+                exact = False
+            elif part.get("tbr") and duration:
+                total += part["tbr"] * 1000 / 8 * duration
+                exact = False
+            else:
+                return None, False
+        return int(total), exact
+
+    @staticmethod
+    def _with_size_filter(ydl_format: str, max_size: int) -> str:
+        # Каждой части формата добавляет фильтр по размеру: yt_dlp выберет лучший формат,
+        # который помещается в лимит. Форматы с неизвестным размером проходят (<?).
+        # Если подходящих нет, остается исходный формат - его отсечет проверка размера воркера
+        size_filter = f"[filesize<?{max_size}][filesize_approx<?{max_size}]"
+        filtered = "/".join(
+            "+".join(part + size_filter for part in alternative.split("+"))
+            for alternative in ydl_format.split("/")
+        )
+        return f"{filtered}/{ydl_format}"
 
-            await channel.default_exchange.publish(
-                aio_pika.Message(
-                    body=json.dumps(download_task).encode(),
-                    delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
-                ),
-                routing_key=queue.name,
+    @staticmethod
+    def _get_size_estimate(
+        video_info: dict | None, resolution: str, video_type: str
+    ) -> dict | None:
+        # Оценка размера файла, посчитанная при проверке ссылки: {"size": байты, "exact": bool}
+        if not video_info:
+            return None
+        ydl_format = DownloadUtils._generate_ydl_format(resolution, video_type)
+        return (video_info.get("sizes") or {}).get(ydl_format)
+
+    @staticmethod
+    def _get_cost_hints(video_info: dict | None, ydl_format: str) -> dict:
+        # Оценка размера и длительность из проверки ссылки: по ним задание попадает
+        # в полосу очереди (task_lanes.choose_lane)
+        if not video_info:
+            return {}
+        estimate = (video_info.get("sizes") or {}).get(ydl_format)
+        return {
+            "estimated_size": estimate["size"] if estimate else None,
+            "duration": video_info.get("duration"),
+        }
+
+    @staticmethod
+    def _is_too_large(estimate: dict | None) -> bool:
+        # Точно не поместится: размер известен точно и он больше лимита Telegram
+        return (
+            bool(estimate)
+            and estimate["exact"]
+            and estimate["size"] > DownloadUtils._get_max_file_size()
+        )
+
+    @staticmethod
+    def _format_size_label(text: str, estimate: dict | None) -> str:
+        # "720p ~34 Mb". Если по примерной оценке файл больше лимита - с пометкой
+        if not estimate:
+            return text
+        size_mb = estimate["size"] / (1024 * 1024)
+        label = f"{text} {'' if estimate['exact'] else '~'}{size_mb:.0f} Mb"
+        if estimate["size"] > DownloadUtils._get_max_file_size():
+            label += " ⚠️"
+        return label
+
+    @staticmethod
+    def _get_prepared_download(video_info: dict | None, ydl_format: str) -> dict:
+        # Форматы, выбранные ботом при проверке ссылки. С ними воркер начинает
+        # скачивание сразу, без повторного extract_info
+        if not video_info:
+            return {}
+        format_id = (video_info.get("format_ids") or {}).get(ydl_format)
+        download_info = video_info.get("download_info")
+        if not format_id or not download_info:
+            return {}
+        format_ids = set(format_id.split("+"))
+        info = dict(download_info["info"])
+        info["formats"] = [
+            format for format in info["formats"] if format["format_id"] in format_ids
+        ]
+        return {
+            "format_id": format_id,
+            "info": info,
+            "probed_at": download_info["probed_at"],
+        }
+
+    @staticmethod
+    async def _send_cached_file(chat_id: int, video_key: str, ydl_format: str) -> bool:
+        # Пересылает уже загруженный в Telegram файл по file_id без скачивания.
+        # Если Telegram больше не принимает file_id, запись удаляется из кэша
+        cached_file = await bot.database_client.get_cached_file(video_key, ydl_format)
+        if cached_file is None:
+            return False
+        try:
+            await bot.telegram_api_client.send_cached_document(
+                chat_id, cached_file["file_id"], cached_file["title"] or ""
             )
+            return True
+        except TelegramAPIError as e:
+            if e.error_code == 400:
+                await bot.database_client.delete_cached_file(
+                    video_key, ydl_format, cached_file["file_id"]
+                )
+            print(f"Не удалось отправить file_id из кэша: {e}")
+            return False
+
+    @staticmethod
+    def _get_file_id(message: dict) -> str | None:
+        # Достает file_id из ответа sendDocument
+        if not isinstance(message, dict):
+            return None
+        for key in ("document", "video", "audio", "animation"):
+            if key in message:
+                return message[key]["file_id"]
+        return None
+
+    @staticmethod
+    async def _send_to_rabbitmq(download_task: dict):
+        # Отправляет задачку в очередь RabbitMQ через общее соединение бота.
+        # Очередь выбирается по оценке стоимости задания, enqueued_at нужен воркеру
+        # для времени ожидания в полосе
+        lane = choose_lane(download_task)
+        download_task = {**download_task, "lane": lane, "enqueued_at": time.time()}
+        await get_publisher().publish(download_task, get_lane_queue(lane))
 
     @staticmethod
     async def _show_download_started(chat_id: int, user_data: dict):
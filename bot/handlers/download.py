@@ -7,6 +7,10 @@ from bot.types import STATE, STATUS
 
 
 class DownloadHandler(Handler):
+    update_kind = "callback_query"
+    states = (STATE.WAIT_FOR_AUDIO,)
+    callback_prefix = "type_"
+
     def can_handle(self, update: dict, state: STATE) -> bool:
         return (
             "callback_query" in update
@@ -22,12 +26,9 @@ class DownloadHandler(Handler):
         callback_data = callback_query["data"]
         type = callback_data.replace("type_", "")
 
-        await bot.database_client.update_user_video_type(telegram_id, type)
-        await bot.database_client.update_user_state(
-            telegram_id, STATE.WAIT_FOR_START_DOWNLOADING
+        user_data = await bot.database_client.update_user(
+            telegram_id, video_type=type, state=STATE.WAIT_FOR_START_DOWNLOADING
         )
-
-        user_data = await bot.database_client.get_user(telegram_id)
         await bot.telegram_api_client.delete_message(chat_id, message_id)
 
         await self._start_download_process(chat_id, telegram_id, user_data)
@@ -41,6 +42,7 @@ class DownloadHandler(Handler):
             user_data["video_res"], user_data["video_type"]
         )
 
+        video_key = await DownloadUtils._get_video_key(user_data["url"])
         download_task = {
             "telegram_id": telegram_id,
             "chat_id": chat_id,
@@ -48,9 +50,20 @@ class DownloadHandler(Handler):
             "resolution": user_data["video_res"],
             "type": user_data["video_type"],
             "ydl_format": ydl_format,
+            "video_key": video_key,
+            "max_filesize": DownloadUtils._get_max_file_size(),
+            **DownloadUtils._get_prepared_download(
+                user_data.get("video_info"), ydl_format
+            ),
+            **DownloadUtils._get_cost_hints(user_data.get("video_info"), ydl_format),
         }
 
         try:
+            # Видео уже есть в Telegram - отправляем сразу, минуя очередь
+            if await DownloadUtils._send_cached_file(chat_id, video_key, ydl_format):
+                await bot.database_client.clear_user_video_and_set_state(telegram_id)
+                return
+
             await DownloadUtils._send_to_rabbitmq(download_task)
             await DownloadUtils._show_download_started(chat_id, user_data)
 
@@ -1,13 +1,16 @@
 import bot.telegram_api_client
 import bot.database_client
+import bot.video_metadata
 from bot.handlers.handler import Handler
 from bot.types import STATE, STATUS
-import asyncio
-import yt_dlp
 from bot.download_utils import DownloadUtils
 
 
 class ResHandler(Handler):
+    update_kind = "callback_query"
+    states = (STATE.WAIT_FOR_RESOLUTION,)
+    callback_prefix = "res_"
+
     def can_handle(self, update: dict, state: STATE) -> bool:
         return (
             "callback_query" in update
@@ -23,22 +26,38 @@ class ResHandler(Handler):
         callback_data = callback_query["data"]
         resolution = callback_data.replace("res_", "")
 
-        await bot.database_client.update_user_video_res(telegram_id, resolution)
-        user_data = await bot.database_client.get_user(telegram_id)
-        user_url = user_data["url"]
-        avaliable_types = await self._check_available_types(user_url)
+        user_data = await bot.database_client.update_user(
+            telegram_id, video_res=resolution
+        )
+        avaliable_types = await self._check_available_types(user_data)
 
         types_map = {
             "video_with_audio": ("Видео со звуком", "type_video_with_audio"),
             "video_no_audio": ("Видео без звука", "type_video_no_audio"),
             "only_audio": ("Только звук", "type_only_audio"),
         }
+        # Типы, которые точно не поместятся в лимит Telegram, не показываем
+        # (если не помещается ни один - показываем все с пометкой)
         keyboard = []
+        too_large = []
         for key, (display_text, _callback_data) in types_map.items():
             if avaliable_types.get(key, False):
-                keyboard.append(
-                    [{"text": display_text, "callback_data": _callback_data}]
+                estimate = DownloadUtils._get_size_estimate(
+                    user_data.get("video_info"), resolution, key
                 )
+                button = [
+                    {
+                        "text": DownloadUtils._format_size_label(
+                            display_text, estimate
+                        ),
+                        "callback_data": _callback_data,
+                    }
+                ]
+                if DownloadUtils._is_too_large(estimate):
+                    too_large.append(button)
+                else:
+                    keyboard.append(button)
+        keyboard = keyboard or too_large
 
         if len(keyboard) == 1:
             video_type = keyboard[0][0]["callback_data"].replace("type_", "")
@@ -62,69 +81,31 @@ class ResHandler(Handler):
         await bot.telegram_api_client.answer_callback_query(callback_query["id"])
         return STATUS.STOP
 
-    async def _check_available_types(self, url: str) -> dict:
-        # Получает информацию о возможных типах видео
-        loop = asyncio.get_event_loop()
-        try:
-
-            def _check():
-                ydl_opts = {
-                    "quiet": True,
-                    "no_warnings": True,
-                    "skip_download": True,
-                }
-                available_types = {
-                    "video_with_audio": False,
-                    "video_no_audio": False,
-                    "only_audio": False,
-                }
-                try:
-                    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                        info = ydl.extract_info(url, download=False)
-                        formats = info.get("formats", [])
-                        for format in formats:
-                            vcodec = format.get("vcodec", "none")
-                            acodec = format.get("acodec", "none")
-                            flag = (vcodec != "none" and acodec != "none") or (
-                                vcodec == "none" and acodec == "none"
-                            )
-                            if flag:
-                                available_types["video_with_audio"] = True
-                            elif vcodec != "none" and acodec == "none":
-                                available_types["video_no_audio"] = True
-                            elif vcodec == "none" and acodec != "none":
-                                available_types["only_audio"] = True
-
-                        return available_types
-                except Exception:
-                    return {
-                        "video_with_audio": True,
-                        "video_no_audio": False,
-                        "only_audio": False,
-                    }
-
-            available_types = await loop.run_in_executor(None, _check)
-            return available_types
-
-        except Exception:
+    async def _check_available_types(self, user_data: dict) -> dict:
+        # Получает информацию о возможных типах видео. Обычно они уже сохранены
+        # вместе с пользователем после проверки ссылки, и yt_dlp не нужен
+        metadata = user_data.get("video_info")
+        if not metadata:
+            metadata = await bot.video_metadata.get_video_metadata(user_data["url"])
+        if not metadata["success"]:
             return {
                 "video_with_audio": True,
                 "video_no_audio": False,
                 "only_audio": False,
             }
+        return metadata["types"]
 
     async def _start_download_process(
         self, telegram_id: int, chat_id: int, message_id: int, video_type: str
     ):
         # Запускает скачивание в том случае, если из доступных типов видео - только одно
-        await bot.database_client.update_user_video_type(telegram_id, video_type)
-        await bot.database_client.update_user_state(
-            telegram_id, STATE.WAIT_FOR_START_DOWNLOADING
+        user_data = await bot.database_client.update_user(
+            telegram_id, video_type=video_type, state=STATE.WAIT_FOR_START_DOWNLOADING
         )
-        user_data = await bot.database_client.get_user(telegram_id)
         ydl_format = DownloadUtils._generate_ydl_format(
             user_data["video_res"], user_data["video_type"]
         )
+        video_key = await DownloadUtils._get_video_key(user_data["url"])
         download_task = {
             "telegram_id": telegram_id,
             "chat_id": chat_id,
@@ -132,8 +113,19 @@ class ResHandler(Handler):
             "resolution": user_data["video_res"],
             "video_type": user_data["video_type"],
             "ydl_format": ydl_format,
+            "video_key": video_key,
+            "max_filesize": DownloadUtils._get_max_file_size(),
+            **DownloadUtils._get_prepared_download(
+                user_data.get("video_info"), ydl_format
+            ),
+            **DownloadUtils._get_cost_hints(user_data.get("video_info"), ydl_format),
         }
         try:
+            # Видео уже есть в Telegram - отправляем сразу, минуя очередь
+            if await DownloadUtils._send_cached_file(chat_id, video_key, ydl_format):
+                await bot.database_client.clear_user_video_and_set_state(telegram_id)
+                return
+
             await DownloadUtils._send_to_rabbitmq(download_task)
             await DownloadUtils._show_download_started(chat_id, user_data)
         except Exception:
@@ -3,6 +3,16 @@ from bot.types import STATE, STATUS
 
 
 class Handler(ABC):
+    # По этим полям Dispatcher строит индекс хэндлеров. None - подходит любое значение.
+    # update_kind - "message" или "callback_query"
+    update_kind: str | None = None
+    # состояния пользователя, в которых хэндлер работает
+    states: tuple[STATE, ...] | None = None
+    # префикс callback_data кнопки, например "res_"
+    callback_prefix: str | None = None
+    # промежуточные хэндлеры (логирование и т.п.) выполняются до основных для каждого update
+    middleware: bool = False
+
     @abstractmethod
     def can_handle(self, update: dict, state: STATE) -> bool: ...
 
@@ -6,6 +6,8 @@ from bot.types import STATE, STATUS
 
 
 class MessageStart(Handler):
+    update_kind = "message"
+
     def can_handle(self, update: dict, state: STATE) -> bool:
         return (
             "message" in update
@@ -1,12 +1,15 @@
-import bot.database_client
 from bot.handlers.handler import Handler
 from bot.types import STATE, STATUS
+from bot.update_log_buffer import get_update_log_buffer
 
 
 class UpdateDatabaseLogger(Handler):
+    middleware = True
+
     def can_handle(self, update: dict, state: STATE) -> bool:
         return True
 
     async def handle(self, update: dict, state: STATE) -> STATUS:
-        await bot.database_client.persist_updates(update)
+        # Запись в базу идет в фоне пачками, обработка update ее не ждет
+        get_update_log_buffer().put(update)
         return STATUS.CONTINUE
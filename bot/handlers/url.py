@@ -1,13 +1,16 @@
 import bot.telegram_api_client
 import bot.database_client
+import bot.video_metadata
 import re
-import yt_dlp
+from bot.download_utils import DownloadUtils
 from bot.handlers.handler import Handler
 from bot.types import STATE, STATUS
-import asyncio
 
 
 class UrlHandler(Handler):
+    update_kind = "message"
+    states = (STATE.WAIT_FOR_ID,)
+
     def can_handle(self, update: dict, state: STATE) -> bool:
         return (
             "message" in update
@@ -40,31 +43,40 @@ class UrlHandler(Handler):
             )
             return STATUS.STOP
 
-        validation_result = await self._validate_video(processed_url)
-        if not validation_result["success"]:
-            error_message = self._get_user_friendly_error(validation_result["error"])
+        # Одна проверка yt_dlp на весь диалог: сводка сохраняется вместе с пользователем,
+        # и следующие шаги берут разрешения и типы видео из нее
+        video_info = await self._probe_video(processed_url)
+        if not video_info["success"]:
+            error_message = self._get_user_friendly_error(video_info["error"])
             await bot.telegram_api_client.send_message(
                 chat_id=chat_id, text=error_message
             )
             return STATUS.STOP
 
-        await bot.database_client.update_user_video(telegram_id, text)
-        await bot.database_client.update_user_state(
-            telegram_id, STATE.WAIT_FOR_RESOLUTION
+        available_resolutions = video_info["resolutions"][:5]
+        keyboard = self._get_resolution_keyboard(video_info, available_resolutions)
+        if available_resolutions and not keyboard:
+            max_size_mb = DownloadUtils._get_max_file_size() // (1024 * 1024)
+            await bot.telegram_api_client.send_message(
+                chat_id=chat_id,
+                text=f"Все варианты этого видео больше {max_size_mb}Mb и не могут быть отправлены.",
+            )
+            return STATUS.STOP
+
+        await bot.database_client.update_user(
+            telegram_id,
+            url=text,
+            state=STATE.WAIT_FOR_RESOLUTION,
+            video_info=video_info,
         )
 
-        available_resolutions = await self._get_avaliable_resolutions(processed_url)
         message_text = (
             f"Видео найдено!\n"
-            f"Название: {validation_result['title']}\n"
-            f"Автор: {validation_result['uploader']}\n"
-            f"Длительность: {self._format_duration(validation_result['duration'])}\n"
+            f"Название: {video_info['title']}\n"
+            f"Автор: {video_info['uploader']}\n"
+            f"Длительность: {self._format_duration(video_info['duration'])}\n"
             f"Выберите качество видео: "
         )
-        keyboard = []
-        for res in available_resolutions:
-            keyboard.append([{"text": f"{res}", "callback_data": f"res_{res}"}])
-
         reply_markup = {"inline_keyboard": keyboard}
 
         await bot.telegram_api_client.send_message(
@@ -98,41 +110,10 @@ class UrlHandler(Handler):
                 return True
         return False
 
-    async def _validate_video(self, url: str) -> dict:
-        # Валидирует видео через yt_dlp
-        try:
-            ydl_opts = {
-                "quiet": True,
-                "no_warnings": True,
-            }
-            loop = asyncio.get_event_loop()
-
-            def extract_info():
-                with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                    return ydl.extract_info(url, download=False)
-
-            info = await loop.run_in_executor(None, extract_info)
-            return {
-                "success": True,
-                "title": info.get("title", "Неизвестное название"),
-                "uploader": info.get("uploader", "Неизвестный автор"),
-                "duration": info.get("duration", 0),
-            }
-
-        except yt_dlp.utils.DownloadError as e:
-            error_message = str(e)
-            if "Private video" in error_message:
-                return {"success": False, "error": "private"}
-            elif "Video unavailable" in error_message:
-                return {"success": False, "error": "unavailable"}
-            elif "Sign in to confirm" in error_message:
-                return {"success": False, "error": "age_restricted"}
-            elif "Unsupported URL" in error_message:
-                return {"success": False, "error": "unsupported_url"}
-            else:
-                return {"success": False, "error": "download_error"}
-        except Exception as e:
-            return {"success": False, "error": f"unexpected: {str(e)}"}
+    async def _probe_video(self, url: str) -> dict:
+        # Проверяет видео через yt_dlp (или берет результат из кэша метаданных):
+        # валидность, описание, разрешения и типы видео - за одну проверку
+        return await bot.video_metadata.get_video_metadata(url)
 
     def _get_user_friendly_error(self, error: str) -> str:
         # Возвращает пользователю понятное сообщение об ошибке
@@ -142,37 +123,33 @@ class UrlHandler(Handler):
             "age_restricted": "Это видео имеет возрастные ограничения и недоступно.",
             "unsupported_url": "Данная ссылка не поддерживается.",
             "download_error": "Произошла ошибка при проверке видео.",
+            "timeout": "Проверка видео заняла слишком много времени. Попробуйте позже.",
             "unexpected": "Неожиданная ошибка. Попробуйте позже.",
         }
         return error_messages.get(error, "Произошла неизвестная ошибка")
 
-    async def _get_avaliable_resolutions(self, url: str) -> list:
-        # Из yt_dlp получаем возможные разрешения для данного видео
-        ydl_opts = {
-            "quiet": True,
-            "no_warnings": True,
-        }
-        try:
-            loop = asyncio.get_event_loop()
-
-            def extract_formats():
-                with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                    info = ydl.extract_info(url, download=False)
-                    return info.get("formats", [])
-
-            formats = await loop.run_in_executor(None, extract_formats)
-            resolutions = set()
-            for format in formats:
-                if format.get("height"):
-                    resolution = f"{format['height']}p"
-                    resolutions.add(resolution)
-
-            sorted_res = sorted(
-                resolutions, key=lambda x: int(x.replace("p", "")), reverse=True
+    def _get_resolution_keyboard(self, video_info: dict, resolutions: list) -> list:
+        # На кнопке - примерный размер файла. Разрешения, у которых ни один тип видео
+        # точно не поместится в лимит Telegram, не показываются
+        keyboard = []
+        for res in resolutions:
+            estimates = [
+                DownloadUtils._get_size_estimate(video_info, res, video_type)
+                for video_type, available in video_info["types"].items()
+                if available
+            ]
+            if estimates and all(DownloadUtils._is_too_large(e) for e in estimates):
+                continue
+            estimate = next((e for e in estimates if e), None)
+            keyboard.append(
+                [
+                    {
+                        "text": DownloadUtils._format_size_label(res, estimate),
+                        "callback_data": f"res_{res}",
+                    }
+                ]
             )
-            return sorted_res[:5]
-        except Exception:
-            return []
+        return keyboard
 
     def _format_duration(self, seconds: int) -> str:
         # Форматирует длительность видео в понятный пользователю вид
@@ -1,16 +1,68 @@
+import asyncio
+import os
+import aiohttp
 from bot.dispatcher import Dispatcher
+from bot.update_scheduler import create_update_scheduler_from_env
 import bot.telegram_api_client
 
+# Хэндлеры работают только с сообщениями и нажатиями inline-клавиатуры
+ALLOWED_UPDATES = ["message", "callback_query"]
+
+_stats = {"polls": 0, "empty_polls": 0, "updates": 0, "errors": 0}
+
+
+def get_polling_stats() -> dict:
+    polls = _stats["polls"]
+    return {
+        **_stats,
+        "updates_per_poll": _stats["updates"] / polls if polls else 0.0,
+    }
+
 
 async def start_long_polling(dispatcher: Dispatcher) -> None:
-    next_update_offset = 0
-    while True:
-        updates = await bot.telegram_api_client.get_updates(offset=next_update_offset)
-        for update in updates:
-            next_update_offset = max(next_update_offset, update["update_id"] + 1)
-            await dispatcher.dispatch(update)
+    poll_timeout = int(os.getenv("TELEGRAM_POLL_TIMEOUT", "30"))
+    poll_limit = int(os.getenv("TELEGRAM_POLL_LIMIT", "100"))
+    lag_interval = float(os.getenv("BOT_POLL_LAG_INTERVAL", "0.5"))
+    scheduler = create_update_scheduler_from_env(dispatcher)
+    # getUpdates не работает, пока у бота установлен webhook
+    await bot.telegram_api_client.delete_webhook()
+    try:
+        while True:
+            # offset подтверждает только уже обработанные updates: если бот упадет,
+            # Telegram пришлет необработанные еще раз
             try:
-                telegram_id = update["message"]["from"]["id"]
-            except Exception:
-                telegram_id = update["callback_query"]["from"]["id"]
-            print(f"Update from {telegram_id} \n", end="", flush=True)
+                updates = await bot.telegram_api_client.get_updates(
+                    offset=scheduler.committed_offset,
+                    timeout=poll_timeout,
+                    limit=poll_limit,
+                    allowed_updates=ALLOWED_UPDATES,
+                )
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                _stats["errors"] += 1
+                print(f"Ошибка getUpdates: {e!r}", flush=True)
+                await asyncio.sleep(1)
+                continue
+
+            _stats["polls"] += 1
+            _stats["updates"] += len(updates)
+            if not updates:
+                _stats["empty_polls"] += 1
+
+            new_updates = 0
+            for update in updates:
+                if scheduler.is_known(update["update_id"]):
+                    continue
+                new_updates += 1
+                await scheduler.submit(update)
+                try:
+                    telegram_id = update["message"]["from"]["id"]
+                except Exception:
+                    telegram_id = update["callback_query"]["from"]["id"]
+                print(f"Update from {telegram_id} \n", end="", flush=True)
+
+            # Пришли только уже принятые в работу updates: Telegram будет отвечать
+            # ими сразу, пока они не обработаются, поэтому не крутимся вхолостую
+            if updates and not new_updates:
+                await scheduler.wait_for_progress(lag_interval)
+    finally:
+        await scheduler.join(timeout=float(os.getenv("BOT_SHUTDOWN_TIMEOUT", "10")))
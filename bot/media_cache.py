@@ -0,0 +1,150 @@
+import fcntl
+import hashlib
+import json
+import os
+import time
+import uuid
+
+_media_cache = None
+
+# Временные файлы упавших процессов старше этого срока удаляются при вытеснении
+_STALE_TEMP_AGE = 3600
+
+
+class MediaCache:
+    # Кэш скачанных файлов на диске воркера (общий том videos), ключ - видео и ydl_format.
+    # Файлы публикуются атомарно (временный файл + rename), вытесняются по LRU (mtime
+    # обновляется при попадании), общий бюджет max_bytes. Публикация и вытеснение идут
+    # под flock, поэтому кэш можно делить между несколькими процессами на одной машине
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def _path(self, video_key: str, ydl_format: str) -> str:
+        digest = hashlib.sha256(f"{video_key}\n{ydl_format}".encode()).hexdigest()
+        return os.path.join(self.directory, digest)
+
+    def get(
+        self, video_key: str, ydl_format: str, target_dir: str
+    ) -> tuple[str, str] | None:
+        # Попадание - жесткая ссылка на файл кэша в папке задания: если файл вытеснят
+        # во время отправки, ссылка задания останется целой. Возвращает (путь, название)
+        if not self.enabled:
+            return None
+        path = self._path(video_key, ydl_format)
+        try:
+            with open(path + ".json", encoding="utf-8") as file:
+                meta = json.load(file)
+            target = os.path.join(target_dir, meta["filename"])
+            os.link(path, target)
+            os.utime(path)
+            size = os.stat(target).st_size
+        except (OSError, ValueError, KeyError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.bytes_saved += size
+        return target, meta["title"]
+
+    def put(self, video_key: str, ydl_format: str, file_path: str, title: str) -> None:
+        # Файл задания остается на месте (в кэш попадает жесткая ссылка на него)
+        if not self.enabled:
+            return
+        size = os.stat(file_path).st_size
+        if size > self.max_bytes:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(video_key, ydl_format)
+        temp = f"{path}.{uuid.uuid4().hex}.tmp"
+        meta = {"filename": os.path.basename(file_path), "title": title}
+        with self._lock():
+            try:
+                # Сначала описание, потом сам файл: get не увидит файл без описания
+                with open(temp, "w", encoding="utf-8") as file:
+                    json.dump(meta, file, ensure_ascii=False)
+                os.replace(temp, path + ".json")
+                os.link(file_path, temp)
+                os.replace(temp, path)
+            finally:
+                if os.path.lexists(temp):
+                    os.remove(temp)
+            self._evict()
+
+    def _lock(self):
+        return _FileLock(os.path.join(self.directory, ".lock"))
+
+    def _evict(self) -> None:
+        # Удаляем самые давно использованные файлы, пока кэш не уложится в бюджет
+        entries = []
+        total = 0
+        now = time.time()
+        for entry in os.scandir(self.directory):
+            name = entry.name
+            if name.startswith(".") or name.endswith(".json"):
+                continue
+            stat = entry.stat()
+            if name.endswith(".tmp"):
+                if now - stat.st_mtime > _STALE_TEMP_AGE:
+                    _remove(entry.path)
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total += stat.st_size
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            _remove(path)
+            _remove(path + ".json")
+            total -= size
+            self.evictions += 1
+
+    def get_stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "bytes_saved": self.bytes_saved,
+            "evictions": self.evictions,
+        }
+
+
+class _FileLock:
+    # Эксклюзивная блокировка между процессами через flock
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+
+    def __enter__(self):
+        self._file = open(self.path, "a")
+        fcntl.flock(self._file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        fcntl.flock(self._file, fcntl.LOCK_UN)
+        self._file.close()
+
+
+def _remove(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def get_media_cache() -> MediaCache:
+    global _media_cache
+    if _media_cache is None:
+        _media_cache = MediaCache(
+            directory=os.getenv("MEDIA_CACHE_DIR", os.path.join("videos", "cache")),
+            max_bytes=int(os.getenv("MEDIA_CACHE_SIZE_MB", "2048")) * 1024 * 1024,
+        )
+    return _media_cache
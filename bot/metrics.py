@@ -0,0 +1,62 @@
+import asyncio
+import math
+import time
+from collections import deque
+
+
+class LatencyStats:
+    # Хранит последние window замеров (в секундах) и считает по ним перцентили
+    def __init__(self, window: int = 1000):
+        self._samples = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float) -> None:
+        self._samples.append(seconds)
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, percent: float) -> float:
+        if not self._samples:
+            return 0.0
+        samples = sorted(self._samples)
+        index = max(0, math.ceil(len(samples) * percent / 100) - 1)
+        return samples[index]
+
+    def snapshot(self) -> dict:
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else 0.0,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+            "max": self.max,
+        }
+
+
+class LoopLagMonitor:
+    # Измеряет задержку event loop: на сколько позже заказанного просыпается sleep(interval).
+    # Большая задержка значит, что что-то держит GIL или блокирует loop (например, yt_dlp
+    # в соседнем потоке), и сообщения из очереди и ответы Telegram обрабатываются с опозданием
+    def __init__(self, interval: float = 0.1):
+        self.interval = interval
+        self.lag = LatencyStats()
+        self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            self.lag.observe(max(0.0, time.monotonic() - started - self.interval))
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
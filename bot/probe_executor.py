@@ -0,0 +1,149 @@
+import asyncio
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from bot.metrics import LatencyStats
+
+
+class ProbeExecutor:
+    # Отдельный ограниченный исполнитель для проверок yt_dlp, чтобы медленные сайты
+    # не занимали общий пул потоков event loop'а.
+    # thread - проверка в своем пуле потоков (зависший поток нельзя остановить, только бросить);
+    # process - проверка в долгоживущих процессах-помощниках, зависший процесс убивается
+    def __init__(
+        self,
+        function,
+        mode: str,
+        max_workers: int,
+        timeout: float,
+        command: list[str] | None = None,
+    ):
+        if mode not in ("thread", "process"):
+            raise ValueError(f"Unknown probe executor mode: {mode}")
+        self._function = function
+        self.mode = mode
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self._command = command
+        self._slots = asyncio.Semaphore(max_workers)
+        self._threads = (
+            ThreadPoolExecutor(max_workers, thread_name_prefix="probe")
+            if mode == "thread"
+            else None
+        )
+        self._idle_processes: list[asyncio.subprocess.Process] = []
+        self.queued = 0
+        self.running = 0
+        self.timeouts = 0
+        self.killed = 0
+        self.wait_time = LatencyStats()
+        self.probe_time = LatencyStats()
+
+    async def run(self, argument: str):
+        # Срок timeout общий на ожидание в очереди и саму проверку:
+        # пользователь получает ответ не позже чем через timeout секунд
+        try:
+            return await asyncio.wait_for(self._run(argument), self.timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise
+
+    async def _run(self, argument: str):
+        submitted_at = time.monotonic()
+        self.queued += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.queued -= 1
+        started = time.monotonic()
+        self.wait_time.observe(started - submitted_at)
+        if self.mode == "thread":
+            return await self._run_in_thread(argument, started)
+        try:
+            self.running += 1
+            return await self._run_in_process(argument)
+        finally:
+            self.running -= 1
+            self._slots.release()
+            self.probe_time.observe(time.monotonic() - started)
+
+    async def _run_in_thread(self, argument: str, started: float):
+        loop = asyncio.get_running_loop()
+        self.running += 1
+
+        def finished(_):
+            # Слот освобождается, только когда поток действительно закончил работу
+            self.running -= 1
+            self._slots.release()
+            self.probe_time.observe(time.monotonic() - started)
+
+        future = self._threads.submit(self._function, argument)
+        future.add_done_callback(lambda f: loop.call_soon_threadsafe(finished, f))
+        return await asyncio.wrap_future(future)
+
+    async def _get_process(self) -> asyncio.subprocess.Process:
+        while self._idle_processes:
+            process = self._idle_processes.pop()
+            if process.returncode is None:
+                return process
+        return await asyncio.create_subprocess_exec(
+            *self._command,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            limit=16 * 1024 * 1024,
+        )
+
+    async def _run_in_process(self, argument: str):
+        process = await self._get_process()
+        try:
+            process.stdin.write(json.dumps(argument).encode() + b"\n")
+            await process.stdin.drain()
+            line = await process.stdout.readline()
+        except BaseException:
+            # Отмена (в том числе по timeout) или сломанный процесс - убиваем его
+            self._kill(process)
+            raise
+        if not line:
+            self._kill(process)
+            raise RuntimeError(f"Probe process exited with code {process.returncode}")
+        self._idle_processes.append(process)
+        return json.loads(line)
+
+    def _kill(self, process: asyncio.subprocess.Process) -> None:
+        if process.returncode is None:
+            process.kill()
+            self.killed += 1
+
+    async def close(self) -> None:
+        if self._threads is not None:
+            self._threads.shutdown(wait=False, cancel_futures=True)
+        for process in self._idle_processes:
+            if process.returncode is None:
+                process.stdin.close()
+                process.kill()
+                await process.wait()
+        self._idle_processes.clear()
+
+    def get_stats(self) -> dict:
+        return {
+            "mode": self.mode,
+            "queued": self.queued,
+            "running": self.running,
+            "timeouts": self.timeouts,
+            "killed": self.killed,
+            "wait_time": self.wait_time.snapshot(),
+            "probe_time": self.probe_time.snapshot(),
+        }
+
+
+def create_probe_executor_from_env(function, worker_module: str) -> ProbeExecutor:
+    # В режиме process каждый процесс-помощник - это python -m worker_module
+    return ProbeExecutor(
+        function,
+        mode=os.getenv("BOT_PROBE_MODE", "thread"),
+        max_workers=int(os.getenv("BOT_PROBE_CONCURRENCY", "4")),
+        timeout=float(os.getenv("BOT_PROBE_TIMEOUT", "30")),
+        command=[sys.executable, "-m", worker_module],
+    )
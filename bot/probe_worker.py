@@ -0,0 +1,19 @@
+import json
+import sys
+from bot.video_metadata import _probe_sync
+
+# Процесс-помощник ProbeExecutor в режиме process: читает из stdin ссылки (по одной JSON-строке)
+# и пишет в stdout сводку по каждой. Весь остальной вывод yt_dlp уходит в stderr
+
+
+def main() -> None:
+    protocol = sys.stdout
+    sys.stdout = sys.stderr
+    for line in sys.stdin:
+        summary = _probe_sync(json.loads(line))
+        protocol.write(json.dumps(summary, ensure_ascii=False) + "\n")
+        protocol.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+import asyncio
+import json
+import os
+import time
+import aio_pika
+from bot.metrics import LatencyStats
+from bot.task_lanes import LANES, get_lane_queue
+
+_publisher = None
+
+# Ошибки, после которых сообщение точно не сохранено брокером и его можно отправить снова:
+# обрыв соединения, закрытый канал, nack брокера
+_RETRY_EXCEPTIONS = aio_pika.exceptions.CONNECTION_EXCEPTIONS
+_RETRY_DELAY = 0.2
+
+
+class RabbitMQPublisher:
+    # Долгоживущее соединение бота с RabbitMQ (connect_robust само переподключается
+    # и восстанавливает каналы) и channels каналов с publisher confirms, которые
+    # используются по очереди. publish возвращается, только когда брокер подтвердил,
+    # что сохранил задание. Задания, отправленные одновременно (publish_many или
+    # параллельные нажатия кнопок), идут по одному каналу без ожидания друг друга,
+    # и брокер подтверждает их пачкой (ack с multiple). При подключении объявляются
+    # все очереди queue_names (полосы заданий)
+    def __init__(
+        self,
+        host: str | None,
+        queue_names: list[str],
+        channels: int,
+        timeout: float,
+        max_retries: int,
+    ):
+        self.host = host
+        self.queue_names = queue_names
+        self.channels = channels
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self._connection = None
+        self._channels = []
+        self._next_channel = 0
+        self._connect_lock = asyncio.Lock()
+        self.published = 0
+        self.retries = 0
+        self.failed = 0
+        self.reconnects = 0
+        self.publish_time = LatencyStats()
+
+    def _is_ready(self) -> bool:
+        return (
+            self._connection is not None
+            and not self._connection.is_closed
+            and len(self._channels) == self.channels
+            and not any(channel.is_closed for channel in self._channels)
+        )
+
+    async def _connect(self) -> None:
+        async with self._connect_lock:
+            if self._connection is None or self._connection.is_closed:
+                self._connection = await aio_pika.connect_robust(host=self.host)
+                self._connection.reconnect_callbacks.add(self._on_reconnect)
+                self._channels = []
+            # Канал, закрытый брокером после ошибки, заменяем новым
+            self._channels = [
+                channel for channel in self._channels if not channel.is_closed
+            ]
+            while len(self._channels) < self.channels:
+                channel = await self._connection.channel(publisher_confirms=True)
+                for queue_name in self.queue_names:
+                    await channel.declare_queue(queue_name, durable=True)
+                self._channels.append(channel)
+
+    def _on_reconnect(self, *args) -> None:
+        self.reconnects += 1
+
+    async def _get_channel(self):
+        if not self._is_ready():
+            await self._connect()
+        channel = self._channels[self._next_channel % len(self._channels)]
+        self._next_channel += 1
+        return channel
+
+    async def publish(self, task: dict, queue_name: str) -> None:
+        await self.publish_many([task], queue_name)
+
+    async def publish_many(self, tasks: list[dict], queue_name: str) -> None:
+        # Не подтвержденные брокером сообщения отправляются повторно, подтвержденные - нет
+        started = time.perf_counter()
+        pending = [
+            aio_pika.Message(
+                body=json.dumps(task).encode(),
+                delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
+            )
+            for task in tasks
+        ]
+        for attempt in range(self.max_retries + 1):
+            try:
+                channel = await self._get_channel()
+            except _RETRY_EXCEPTIONS as e:
+                error = e
+            else:
+                results = await asyncio.gather(
+                    *(
+                        channel.default_exchange.publish(
+                            message, routing_key=queue_name, timeout=self.timeout
+                        )
+                        for message in pending
+                    ),
+                    return_exceptions=True,
+                )
+                for result in results:
+                    # Таймаут: неизвестно, сохранил ли брокер сообщение - не повторяем,
+                    # чтобы не скачать видео дважды
+                    if isinstance(result, asyncio.TimeoutError):
+                        self.failed += len(pending)
+                        raise result
+                failed = [
+                    message
+                    for message, result in zip(pending, results)
+                    if isinstance(result, BaseException)
+                ]
+                self.published += len(pending) - len(failed)
+                if not failed:
+                    self.publish_time.observe(time.perf_counter() - started)
+                    return
+                error = next(
+                    result for result in results if isinstance(result, BaseException)
+                )
+                pending = failed
+            if attempt == self.max_retries or not isinstance(error, _RETRY_EXCEPTIONS):
+                self.failed += len(pending)
+                raise error
+            self.retries += 1
+            await asyncio.sleep(_RETRY_DELAY * 2**attempt)
+
+    async def close(self) -> None:
+        if self._connection is not None:
+            await self._connection.close()
+            self._connection = None
+            self._channels = []
+
+    def get_stats(self) -> dict:
+        return {
+            "published": self.published,
+            "retries": self.retries,
+            "failed": self.failed,
+            "reconnects": self.reconnects,
+            "publish_time": self.publish_time.snapshot(),
+        }
+
+
+def get_publisher() -> RabbitMQPublisher:
+    global _publisher
+    if _publisher is None:
+        _publisher = RabbitMQPublisher(
+            host=os.getenv("RABBITMQ_HOST"),
+            queue_names=[get_lane_queue(lane) for lane in LANES],
+            channels=int(os.getenv("RABBITMQ_PUBLISH_CHANNELS", "2")),
+            timeout=float(os.getenv("RABBITMQ_PUBLISH_TIMEOUT", "10")),
+            max_retries=int(os.getenv("RABBITMQ_PUBLISH_RETRIES", "3")),
+        )
+    return _publisher
+
+
+async def close_publisher() -> None:
+    global _publisher
+    if _publisher:
+        await _publisher.close()
+        _publisher = None
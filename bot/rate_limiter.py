@@ -0,0 +1,109 @@
+import asyncio
+import os
+import time
+from bot.metrics import LatencyStats
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(
+            self.capacity, self._tokens + (now - self._updated) * self.rate
+        )
+        self._updated = now
+
+    def reserve(self) -> float:
+        # Забирает один токен (баланс может уйти в минус - это очередь)
+        # и возвращает, сколько секунд нужно подождать до отправки
+        now = time.monotonic()
+        self._refill(now)
+        self._tokens -= 1
+        delay = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        return max(delay, self._blocked_until - now)
+
+    def pause(self, seconds: float) -> None:
+        # Telegram попросил подождать retry_after секунд
+        self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+    def is_idle(self) -> bool:
+        self._refill(time.monotonic())
+        return self._tokens >= self.capacity and time.monotonic() >= self._blocked_until
+
+
+class RateLimiter:
+    # Общий лимит на все исходящие сообщения бота + отдельный лимит на каждый чат
+    def __init__(
+        self,
+        global_rate: float,
+        global_burst: float,
+        chat_rate: float,
+        chat_burst: float,
+        max_chats: int = 10000,
+    ):
+        self._global = TokenBucket(global_rate, global_burst)
+        self._chat_rate = chat_rate
+        self._chat_burst = chat_burst
+        self._max_chats = max_chats
+        self._chats: dict[int | str, TokenBucket] = {}
+        self.queue_delay = LatencyStats()
+        self.throttled = 0
+        self.retries = 0
+
+    def _get_chat_bucket(self, chat_id: int | str) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= self._max_chats:
+                self._chats = {
+                    key: value
+                    for key, value in self._chats.items()
+                    if not value.is_idle()
+                }
+            bucket = TokenBucket(self._chat_rate, self._chat_burst)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    async def acquire(self, chat_id: int | str | None = None) -> float:
+        # Сначала ждем очереди в чате, потом в общем лимите,
+        # чтобы не сжигать общие токены, пока ждем свой чат
+        started = time.monotonic()
+        if chat_id is not None:
+            delay = self._get_chat_bucket(chat_id).reserve()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        delay = self._global.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        waited = time.monotonic() - started
+        self.queue_delay.observe(waited)
+        return waited
+
+    def retry_after(self, chat_id: int | str | None, seconds: float) -> None:
+        # Ответ 429: останавливаем отправку в этот чат (или всю отправку, если чата нет)
+        self.throttled += 1
+        if chat_id is not None:
+            self._get_chat_bucket(chat_id).pause(seconds)
+        else:
+            self._global.pause(seconds)
+
+    def get_stats(self) -> dict:
+        return {
+            "queue_delay": self.queue_delay.snapshot(),
+            "throttled": self.throttled,
+            "retries": self.retries,
+            "chats": len(self._chats),
+        }
+
+
+def create_rate_limiter_from_env() -> RateLimiter:
+    return RateLimiter(
+        global_rate=float(os.getenv("TELEGRAM_GLOBAL_RATE", "30")),
+        global_burst=float(os.getenv("TELEGRAM_GLOBAL_BURST", "30")),
+        chat_rate=float(os.getenv("TELEGRAM_CHAT_RATE", "1")),
+        chat_burst=float(os.getenv("TELEGRAM_CHAT_BURST", "3")),
+    )
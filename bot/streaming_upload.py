@@ -0,0 +1,160 @@
+import asyncio
+import os
+import aiofiles
+
+# Протоколы, при которых yt_dlp пишет один файл подряд от начала до конца
+_STREAMABLE_PROTOCOLS = ("http", "https")
+# Постпроцессоры, которые не меняют содержимое файла
+_SAFE_POSTPROCESSORS = ("MoveFiles",)
+
+
+class StreamAborted(Exception):
+    pass
+
+
+class GrowingFileStream:
+    # Отдает на загрузку в Telegram байты файла, который yt_dlp еще скачивает (.part).
+    # Подходят только форматы из одного файла без склейки, у которых заранее известен размер.
+    # Методы on_selected и хуки вызываются из потока скачивания и передают события в event loop.
+    # Последний байт отдается только после complete: запрос в Telegram не завершится,
+    # пока воркер не убедился, что файл скачан целиком и не изменен постпроцессорами
+    def __init__(self, loop: asyncio.AbstractEventLoop, chunk_size: int):
+        self._loop = loop
+        self.chunk_size = chunk_size
+        self.size = None
+        self.filename = None
+        self.title = None
+        self._streamable = None
+        self._paths = []
+        self._written = 0
+        self._completed = False
+        self._aborted = None
+        self._changed = asyncio.Event()
+        self._ready = loop.create_future()
+
+    # Поток скачивания
+
+    def on_selected(self, info: dict) -> None:
+        streamable = (
+            not info.get("requested_formats")
+            and info.get("protocol") in _STREAMABLE_PROTOCOLS
+        )
+        self._loop.call_soon_threadsafe(self._on_selected, streamable)
+
+    def progress_hook(self, progress: dict) -> None:
+        self._loop.call_soon_threadsafe(
+            self._on_progress,
+            progress["status"],
+            progress.get("downloaded_bytes") or 0,
+            progress.get("total_bytes"),
+            [progress.get("tmpfilename"), progress.get("filename")],
+            progress.get("info_dict", {}).get("title"),
+        )
+
+    def postprocessor_hook(self, progress: dict) -> None:
+        if (
+            progress["status"] == "started"
+            and progress["postprocessor"] not in _SAFE_POSTPROCESSORS
+        ):
+            self._loop.call_soon_threadsafe(
+                self.abort, f"postprocessor {progress['postprocessor']}"
+            )
+
+    # Event loop
+
+    def _on_selected(self, streamable: bool) -> None:
+        if self.size is not None:
+            # yt_dlp начал скачивание заново (например, после устаревших форматов)
+            self.abort("download restarted")
+        elif not streamable:
+            self._set_not_streamable()
+        else:
+            self._streamable = True
+
+    def _set_not_streamable(self) -> None:
+        self._streamable = False
+        if not self._ready.done():
+            self._ready.set_result(False)
+
+    def _on_progress(
+        self, status: str, downloaded: int, total, paths: list, title
+    ) -> None:
+        if not self._streamable or self._aborted:
+            return
+        if status == "downloading":
+            if self.size is None:
+                if not total:
+                    self._set_not_streamable()
+                    return
+                self.size = total
+                self.filename = os.path.basename(paths[1] or paths[0])
+                self.title = title
+                self._paths = [path for path in paths if path]
+                self._ready.set_result(True)
+            elif total != self.size or downloaded < self._written:
+                self.abort("download restarted")
+                return
+            self._written = downloaded
+        elif status == "error":
+            self.abort("download error")
+        self._changed.set()
+
+    async def wait_ready(self) -> bool:
+        # True - можно начинать загрузку, False - этот файл загружается обычным способом
+        return await self._ready
+
+    def complete(self, file_path: str) -> None:
+        # Вызывается, когда поток скачивания закончил работу
+        if self.size is not None and not self._aborted:
+            if os.path.getsize(file_path) == self.size:
+                self._completed = True
+            else:
+                self.abort("file size changed")
+        if not self._ready.done():
+            self._ready.set_result(False)
+        self._changed.set()
+
+    def abort(self, reason: str) -> None:
+        if self._completed or self._aborted:
+            return
+        self._aborted = reason
+        if not self._ready.done():
+            self._ready.set_result(False)
+        self._changed.set()
+
+    async def _open(self):
+        # .part после окончания скачивания переименовывается; открытый файл остается тем же
+        for path in self._paths:
+            try:
+                return await aiofiles.open(path, "rb")
+            except FileNotFoundError:
+                continue
+        return None
+
+    async def chunks(self):
+        # Читает файл кусками не больше chunk_size, ожидая новые байты от yt_dlp
+        file = None
+        offset = 0
+        try:
+            while offset < self.size:
+                self._changed.clear()
+                if self._aborted:
+                    raise StreamAborted(self._aborted)
+                limit = (
+                    self.size if self._completed else min(self._written, self.size - 1)
+                )
+                if offset < limit:
+                    if file is None:
+                        file = await self._open()
+                    if file is not None:
+                        chunk = await file.read(min(self.chunk_size, limit - offset))
+                        if chunk:
+                            offset += len(chunk)
+                            yield chunk
+                            continue
+                    if self._completed:
+                        raise StreamAborted("file is shorter than expected")
+                await self._changed.wait()
+        finally:
+            if file is not None:
+                await file.close()
@@ -0,0 +1,99 @@
+import asyncio
+import os
+import signal
+import time
+
+# Процесс, проработавший дольше этого, считается здоровым: задержка перезапуска сбрасывается
+_HEALTHY_UPTIME = 60
+_MAX_RESTART_DELAY = 30
+# Сколько секунд сверх drain_timeout ждать процессы воркера перед SIGKILL
+_KILL_GRACE = 10
+
+
+def get_default_processes() -> int:
+    # Ядра, доступные процессу (учитывает cpuset контейнера)
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+class WorkerSupervisor:
+    # Запускает processes процессов воркера (command) и перезапускает упавшие.
+    # Каждому процессу передаются WORKER_PROCESSES=1 и его номер WORKER_ID. Процессы делят
+    # папку videos: кэш файлов рассчитан на несколько процессов, а папки заданий уникальны.
+    # stop пересылает процессам SIGTERM: они перестают брать задания из очереди и доделывают
+    # текущие; процессы, не завершившиеся за drain_timeout, убиваются
+    def __init__(self, command: list[str], processes: int, drain_timeout: float):
+        self.command = command
+        self.processes = processes
+        self.drain_timeout = drain_timeout
+        self._children: dict[int, asyncio.subprocess.Process] = {}
+        self._stopping = asyncio.Event()
+        self.restarts = 0
+
+    async def _spawn(self, index: int) -> asyncio.subprocess.Process:
+        env = dict(os.environ, WORKER_PROCESSES="1", WORKER_ID=str(index))
+        process = await asyncio.create_subprocess_exec(*self.command, env=env)
+        self._children[index] = process
+        if self._stopping.is_set():
+            process.send_signal(signal.SIGTERM)
+        return process
+
+    async def _supervise(self, index: int) -> None:
+        delay = 1
+        while not self._stopping.is_set():
+            started = time.monotonic()
+            process = await self._spawn(index)
+            code = await process.wait()
+            if self._stopping.is_set():
+                return
+            self.restarts += 1
+            if time.monotonic() - started > _HEALTHY_UPTIME:
+                delay = 1
+            print(
+                f"Воркер {index} (pid {process.pid}) завершился с кодом {code}, "
+                f"перезапуск через {delay} с"
+            )
+            try:
+                await asyncio.wait_for(self._stopping.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+            delay = min(delay * 2, _MAX_RESTART_DELAY)
+
+    def stop(self) -> None:
+        if self._stopping.is_set():
+            return
+        print(f"Супервизор останавливает воркеры: {len(self._children)}")
+        self._stopping.set()
+        for process in self._children.values():
+            if process.returncode is None:
+                process.send_signal(signal.SIGTERM)
+
+    async def run(self) -> None:
+        print(f"Супервизор запускает воркеры: {self.processes}")
+        tasks = [
+            asyncio.create_task(self._supervise(index))
+            for index in range(self.processes)
+        ]
+        try:
+            await self._stopping.wait()
+            _, pending = await asyncio.wait(
+                tasks, timeout=self.drain_timeout + _KILL_GRACE
+            )
+            if pending:
+                print(f"Воркеры не остановились вовремя, убиваем: {len(pending)}")
+        finally:
+            for process in self._children.values():
+                if process.returncode is None:
+                    process.kill()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def get_stats(self) -> dict:
+        return {
+            "processes": self.processes,
+            "running": sum(
+                1 for process in self._children.values() if process.returncode is None
+            ),
+            "restarts": self.restarts,
+        }
@@ -0,0 +1,90 @@
+import os
+
+# Полосы очереди заданий по оценке стоимости скачивания. У каждой полосы своя очередь
+# RabbitMQ, а у быстрой - закрепленные слоты в воркере, поэтому короткие задания
+# не стоят за длинными
+FAST = "fast"
+NORMAL = "normal"
+SLOW = "slow"
+LANES = (FAST, NORMAL, SLOW)
+
+# Типичный битрейт (байт/с) для оценки по длительности, если размер формата неизвестен
+_AUDIO_BYTES_PER_SECOND = 160 * 1000 / 8
+_VIDEO_BYTES_PER_SECOND = 2500 * 1000 / 8
+# Склейка видео и звука ffmpeg еще раз читает и пишет весь файл
+_MERGE_FACTOR = 1.5
+# Пороги полос по умолчанию - доли лимита размера файла: больше лимита бот не скачивает
+_FAST_LANE_SHARE = 0.2
+_SLOW_LANE_SHARE = 0.5
+
+
+def get_lane_queue(lane: str) -> str:
+    # Обычная полоса - прежняя очередь RABBITMQ_QUEUE_NAME: задания, отправленные
+    # до обновления, не теряются
+    queue_name = os.getenv("RABBITMQ_QUEUE_NAME")
+    return queue_name if lane == NORMAL else f"{queue_name}.{lane}"
+
+
+def estimate_cost(task: dict) -> float | None:
+    # Стоимость задания в байтах: размер из проверки ссылки (filesize или битрейт *
+    # длительность) либо длительность * типичный битрейт типа. None - оценить нечем
+    video_type = task.get("video_type") or task.get("type")
+    size = task.get("estimated_size")
+    if size is None:
+        duration = task.get("duration")
+        if not duration:
+            return None
+        if video_type == "only_audio":
+            size = duration * _AUDIO_BYTES_PER_SECOND
+        else:
+            size = duration * _VIDEO_BYTES_PER_SECOND
+    if video_type == "video_with_audio":
+        size *= _MERGE_FACTOR
+    return size
+
+
+def _get_threshold(name: str, max_size: int, share: float) -> float:
+    value = os.getenv(name)
+    return float(value) * 1024 * 1024 if value else max_size * share
+
+
+def choose_lane(task: dict) -> str:
+    cost = estimate_cost(task)
+    if cost is None:
+        return NORMAL
+    max_size = (
+        task.get("max_filesize")
+        or int(os.getenv("TELEGRAM_MAX_FILE_SIZE_MB", "50")) * 1024 * 1024
+    )
+    if cost <= _get_threshold("RABBITMQ_FAST_LANE_MB", max_size, _FAST_LANE_SHARE):
+        return FAST
+    if cost >= _get_threshold("RABBITMQ_SLOW_LANE_MB", max_size, _SLOW_LANE_SHARE):
+        return SLOW
+    return NORMAL
+
+
+def get_lane_slots(concurrency: int) -> dict[str, int]:
+    # Слоты, закрепленные за полосой (prefetch канала только ее очереди):
+    # WORKER_LANE_SLOTS="fast=1,slow=1". Остальные слоты concurrency общие: общий канал
+    # слушает очереди всех полос, поэтому свободный слот берет задание любой полосы, а не
+    # простаивает, пока ждут задания другой. Хотя бы один слот должен остаться общим.
+    # По умолчанию быстрой полосе закреплена четверть concurrency (хотя бы один слот, если
+    # слотов больше одного), чтобы короткие задания не ждали, пока общие слоты заняты длинными
+    value = os.getenv("WORKER_LANE_SLOTS")
+    if not value:
+        fast = 0 if concurrency < 2 else concurrency // 4 or 1
+        return {FAST: fast, NORMAL: 0, SLOW: 0}
+    slots = dict.fromkeys(LANES, 0)
+    for item in value.split(","):
+        lane, count = item.split("=")
+        lane = lane.strip()
+        if lane not in LANES:
+            raise ValueError(f"Unknown lane: {lane}")
+        slots[lane] = int(count)
+        if slots[lane] < 0:
+            raise ValueError(f"Negative slots for lane: {lane}")
+    if sum(slots.values()) >= concurrency:
+        raise ValueError(
+            f"Lane slots {slots} leave no shared slot of WORKER_CONCURRENCY={concurrency}"
+        )
+    return slots
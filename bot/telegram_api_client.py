@@ -1,12 +1,30 @@
+import asyncio
+import inspect
 import json
 import os
+from collections.abc import AsyncIterator, Callable
 from enum import Enum
+from typing import Any
 from dotenv import load_dotenv
 import aiohttp
+import aiohttp.payload
 import aiofiles
+from bot.rate_limiter import RateLimiter, create_rate_limiter_from_env
 
 load_dotenv()
 
+_session = None
+_rate_limiter = None
+
+
+class TelegramAPIError(Exception):
+    def __init__(self, method: str, response_json: dict):
+        self.method = method
+        self.error_code = response_json.get("error_code")
+        self.description = response_json.get("description", "")
+        self.parameters = response_json.get("parameters", {})
+        super().__init__(f"{method}: {self.error_code} {self.description}")
+
 
 class METHODS(Enum):
     getMe = "getMe"
@@ -15,23 +33,114 @@ class METHODS(Enum):
     deleteMessage = "deleteMessage"
     editMessageText = "editMessageText"
     answerCallbackQuery = "answerCallbackQuery"
+    sendDocument = "sendDocument"
+    setWebhook = "setWebhook"
+    deleteWebhook = "deleteWebhook"
 
 
-async def make_request(method: METHODS, **args) -> dict:
+# Методы, которые отправляют сообщения в чат и подпадают под лимиты Telegram
+# (около 30 сообщений в секунду на бота и около 1 в секунду на чат)
+_RATE_LIMITED_METHODS = {
+    METHODS.sendMessage,
+    METHODS.editMessageText,
+    METHODS.sendDocument,
+}
+
+
+async def get_session() -> aiohttp.ClientSession:
+    # Одна долгоживущая сессия с пулом keep-alive соединений на весь процесс
+    global _session
+    if _session is None or _session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=int(os.getenv("TELEGRAM_CONNECTION_LIMIT", "100")),
+            limit_per_host=int(os.getenv("TELEGRAM_CONNECTION_LIMIT_PER_HOST", "0")),
+            ttl_dns_cache=int(os.getenv("TELEGRAM_DNS_CACHE_TTL", "300")),
+            keepalive_timeout=float(os.getenv("TELEGRAM_KEEPALIVE_TIMEOUT", "60")),
+        )
+        timeout = aiohttp.ClientTimeout(
+            total=float(os.getenv("TELEGRAM_REQUEST_TIMEOUT", "60")),
+            connect=float(os.getenv("TELEGRAM_CONNECT_TIMEOUT", "10")),
+        )
+        _session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+    return _session
+
+
+async def close_session():
+    global _session
+    if _session:
+        await _session.close()
+        _session = None
+
+
+def _get_method_url(method: str) -> str:
+    # TELEGRAM_API_URL позволяет работать с локальным Bot API сервером
+    api_url = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org").rstrip("/")
+    return f"{api_url}/bot{os.getenv('TELEGRAM_TOKEN')}/{method}"
+
+
+def get_rate_limiter() -> RateLimiter:
+    # Один планировщик на процесс: им пользуются и хэндлеры бота, и воркер
+    global _rate_limiter
+    if _rate_limiter is None:
+        _rate_limiter = create_rate_limiter_from_env()
+    return _rate_limiter
+
+
+async def _call_with_rate_limit(
+    method: METHODS, chat_id, send, max_retries: int | None = None
+) -> dict:
+    # Ждет своей очереди в лимитах, отправляет запрос и при ответе 429
+    # ждет parameters.retry_after и повторяет запрос
+    limiter = get_rate_limiter()
+    rate_limited = method in _RATE_LIMITED_METHODS
+    if max_retries is None:
+        max_retries = int(os.getenv("TELEGRAM_MAX_RETRIES", "3"))
+    attempt = 0
+    while True:
+        if rate_limited:
+            await limiter.acquire(chat_id)
+        try:
+            return await send()
+        except TelegramAPIError as e:
+            if e.error_code != 429 or attempt >= max_retries:
+                raise
+            attempt += 1
+            limiter.retries += 1
+            retry_after = float(e.parameters.get("retry_after", 1))
+            print(f"Telegram flood limit на {method.value}, ждем {retry_after} с")
+            if rate_limited:
+                limiter.retry_after(chat_id, retry_after)
+            else:
+                await asyncio.sleep(retry_after)
+
+
+async def _post_json(
+    method: METHODS, args: dict, timeout: aiohttp.ClientTimeout | None = None
+) -> dict:
     json_data = json.dumps(args).encode("utf-8")
-    url = f"https://api.telegram.org/bot{os.getenv('TELEGRAM_TOKEN')}/{method.value}"
-    async with aiohttp.ClientSession() as session:
-        async with session.post(
-            url,
-            data=json_data,
-            headers={
-                "Content-Type": "application/json",
-            },
-        ) as response:
-            response_body = await response.text()
-            response_json = json.loads(response_body)
-            assert response_json["ok"]
-            return response_json["result"]
+    url = _get_method_url(method.value)
+    session = await get_session()
+    # Без явного timeout действует таймаут сессии
+    request_options = {} if timeout is None else {"timeout": timeout}
+    async with session.post(
+        url,
+        data=json_data,
+        headers={
+            "Content-Type": "application/json",
+        },
+        **request_options,
+    ) as response:
+        response_body = await response.text()
+        response_json = json.loads(response_body)
+        if not response_json["ok"]:
+            raise TelegramAPIError(method.value, response_json)
+        return response_json["result"]
+
+
+async def make_request(method: METHODS, **args) -> dict:
+    return await _call_with_rate_limit(
+        method, args.get("chat_id"), lambda: _post_json(method, args)
+    )
 
 
 async def get_me() -> dict:
@@ -40,7 +149,27 @@ async def get_me() -> dict:
 
 async def get_updates(**kwargs) -> dict:
     # https://core.telegram.org/bots/api#getupdates
-    return await make_request(METHODS.getUpdates, **kwargs)
+    # При long polling Telegram держит запрос до timeout секунд,
+    # поэтому HTTP-таймаут должен быть больше серверного
+    http_timeout = aiohttp.ClientTimeout(
+        total=kwargs.get("timeout", 0)
+        + float(os.getenv("TELEGRAM_REQUEST_TIMEOUT", "60"))
+    )
+    return await _call_with_rate_limit(
+        METHODS.getUpdates,
+        None,
+        lambda: _post_json(METHODS.getUpdates, kwargs, timeout=http_timeout),
+    )
+
+
+async def set_webhook(url: str, **kwargs) -> dict:
+    # https://core.telegram.org/bots/api#setwebhook
+    return await make_request(METHODS.setWebhook, url=url, **kwargs)
+
+
+async def delete_webhook(**kwargs) -> dict:
+    # https://core.telegram.org/bots/api#deletewebhook
+    return await make_request(METHODS.deleteWebhook, **kwargs)
 
 
 async def send_message(chat_id: int, text: str, **kwargs) -> dict:
@@ -48,22 +177,111 @@ async def send_message(chat_id: int, text: str, **kwargs) -> dict:
     return await make_request(METHODS.sendMessage, chat_id=chat_id, text=text, **kwargs)
 
 
-async def send_document(chat_id: int, document_path: str, caption: str = "") -> dict:
+class _FileStreamPayload(aiohttp.payload.AsyncIterablePayload):
+    # Асинхронный поток байт с заранее известным размером, чтобы aiohttp
+    # выставил Content-Length вместо chunked-кодирования
+    def __init__(self, value, size: int, **kwargs):
+        super().__init__(value, **kwargs)
+        self._size = size
+
+
+async def _read_file_chunks(
+    document_path: str,
+    total_size: int,
+    chunk_size: int,
+    progress_callback: Callable[[int, int], Any] | None = None,
+) -> AsyncIterator[bytes]:
+    # Читает файл кусками: в памяти одновременно держится не больше chunk_size байт
+    sent = 0
+    async with aiofiles.open(document_path, "rb") as file:
+        while True:
+            chunk = await file.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+            sent += len(chunk)
+            if progress_callback is not None:
+                result = progress_callback(sent, total_size)
+                if inspect.isawaitable(result):
+                    await result
+
+
+def _get_upload_timeout() -> aiohttp.ClientTimeout:
+    # Загрузка файла может идти дольше обычного запроса
+    return aiohttp.ClientTimeout(
+        total=float(os.getenv("TELEGRAM_UPLOAD_TIMEOUT", "600"))
+    )
+
+
+async def _post_document(
+    chat_id: int, document: _FileStreamPayload, filename: str, caption: str
+) -> dict:
+    url = _get_method_url(METHODS.sendDocument.value)
+    form_data = aiohttp.FormData()
+    form_data.add_field("document", document, filename=filename)
+    form_data.add_field("chat_id", str(chat_id))
+    form_data.add_field("caption", caption)
+
+    session = await get_session()
+    async with session.post(
+        url, data=form_data, timeout=_get_upload_timeout()
+    ) as response:
+        response_json = await response.json()
+        if not response_json["ok"]:
+            raise TelegramAPIError(METHODS.sendDocument.value, response_json)
+        return response_json["result"]
+
+
+async def send_document(
+    chat_id: int,
+    document_path: str,
+    caption: str = "",
+    progress_callback: Callable[[int, int], Any] | None = None,
+) -> dict:
     # https://core.telegram.org/bots/api#senddocument
-    url = f"https://api.telegram.org/bot{os.getenv('TELEGRAM_TOKEN')}/sendDocument"
-    async with aiohttp.ClientSession() as session:
-        async with aiofiles.open(document_path, "rb") as file:
-            file_data = await file.read()
-            form_data = aiohttp.FormData()
-            form_data.add_field(
-                "document", file_data, filename=os.path.basename(document_path)
-            )
-            form_data.add_field("chat_id", str(chat_id))
-            form_data.add_field("caption", caption)
-
-            async with session.post(url, data=form_data) as response:
-                response_json = await response.json()
-                return response_json["ok"]
+    # progress_callback(sent_bytes, total_bytes) вызывается после каждого отправленного куска
+    total_size = os.path.getsize(document_path)
+    chunk_size = int(os.getenv("TELEGRAM_UPLOAD_CHUNK_SIZE", str(256 * 1024)))
+
+    async def post_document() -> dict:
+        # Поток из файла одноразовый, поэтому форма собирается заново на каждую попытку
+        document = _FileStreamPayload(
+            _read_file_chunks(document_path, total_size, chunk_size, progress_callback),
+            size=total_size,
+            content_type="application/octet-stream",
+        )
+        return await _post_document(
+            chat_id, document, os.path.basename(document_path), caption
+        )
+
+    return await _call_with_rate_limit(METHODS.sendDocument, chat_id, post_document)
+
+
+async def send_document_stream(
+    chat_id: int,
+    chunks: AsyncIterator[bytes],
+    size: int,
+    filename: str,
+    caption: str = "",
+) -> dict:
+    # Отправка документа из потока байт заранее известного размера (например, из файла,
+    # который еще скачивается). Поток одноразовый, поэтому после 429 запрос не повторяется
+    document = _FileStreamPayload(
+        chunks, size=size, content_type="application/octet-stream"
+    )
+    return await _call_with_rate_limit(
+        METHODS.sendDocument,
+        chat_id,
+        lambda: _post_document(chat_id, document, filename, caption),
+        max_retries=0,
+    )
+
+
+async def send_cached_document(chat_id: int, file_id: str, caption: str = "") -> dict:
+    # Повторная отправка уже загруженного в Telegram файла по его file_id
+    return await make_request(
+        METHODS.sendDocument, chat_id=chat_id, document=file_id, caption=caption
+    )
 
 
 async def delete_message(chat_id: int, message_id: int, **kwargs) -> dict:
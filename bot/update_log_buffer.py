@@ -0,0 +1,111 @@
+import asyncio
+import os
+import time
+import traceback
+from collections import deque
+import bot.database_client
+from bot.metrics import LatencyStats
+
+_buffer = None
+
+
+class UpdateLogBuffer:
+    # Копит updates в памяти и пишет их в telegram_updates пачками в фоне,
+    # чтобы логирование не задерживало ответ пользователю
+    def __init__(self, batch_size: int, flush_interval: float, max_size: int):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_size = max_size
+        self._updates = deque()
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task = None
+        self._closing = False
+        self.flushed = 0
+        self.dropped = 0
+        self.failed_flushes = 0
+        self.flush_time = LatencyStats()
+
+    def put(self, update: dict) -> None:
+        # Буфер полон (например, база недоступна) - выбрасываем самый старый update,
+        # но никогда не блокируем обработку
+        if len(self._updates) >= self.max_size:
+            self._updates.popleft()
+            self.dropped += 1
+        self._updates.append(update)
+        if not self._closing and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._run())
+        if len(self._updates) >= self.batch_size:
+            self._wakeup.set()
+
+    async def _run(self) -> None:
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self) -> None:
+        async with self._flush_lock:
+            while self._updates:
+                batch = [
+                    self._updates.popleft()
+                    for _ in range(min(self.batch_size, len(self._updates)))
+                ]
+                started = time.perf_counter()
+                try:
+                    await bot.database_client.persist_updates_batch(batch)
+                except Exception:
+                    traceback.print_exc()
+                    self.failed_flushes += 1
+                    self._requeue(batch)
+                    return
+                self.flush_time.observe(time.perf_counter() - started)
+                self.flushed += len(batch)
+
+    def _requeue(self, batch: list[dict]) -> None:
+        # Неудачную пачку возвращаем в начало буфера, насколько хватает места
+        free = self.max_size - len(self._updates)
+        if free < len(batch):
+            self.dropped += len(batch) - max(free, 0)
+            batch = batch[len(batch) - max(free, 0) :]
+        self._updates.extendleft(reversed(batch))
+
+    async def close(self) -> None:
+        # При остановке бота дописываем в базу все, что осталось в буфере
+        # Фоновую задачу не отменяем, а будим: так не потеряется пачка, которая пишется прямо сейчас
+        self._closing = True
+        if self._task is not None:
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        await self.flush()
+
+    def get_stats(self) -> dict:
+        return {
+            "buffered": len(self._updates),
+            "flushed": self.flushed,
+            "dropped": self.dropped,
+            "failed_flushes": self.failed_flushes,
+            "flush_time": self.flush_time.snapshot(),
+        }
+
+
+def get_update_log_buffer() -> UpdateLogBuffer:
+    global _buffer
+    if _buffer is None:
+        _buffer = UpdateLogBuffer(
+            batch_size=int(os.getenv("BOT_LOG_BATCH_SIZE", "100")),
+            flush_interval=float(os.getenv("BOT_LOG_FLUSH_INTERVAL", "1")),
+            max_size=int(os.getenv("BOT_LOG_BUFFER_LIMIT", "10000")),
+        )
+    return _buffer
+
+
+async def close_update_log_buffer() -> None:
+    global _buffer
+    if _buffer:
+        await _buffer.close()
+        _buffer = None
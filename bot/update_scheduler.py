@@ -0,0 +1,116 @@
+import asyncio
+import os
+import time
+import traceback
+from collections import deque
+from bot.dispatcher import Dispatcher
+from bot.metrics import LatencyStats
+
+
+class UpdateScheduler:
+    # Обрабатывает updates разных пользователей параллельно, а updates одного
+    # пользователя - строго по очереди, чтобы state в таблице users не ломался
+    def __init__(
+        self,
+        dispatcher: Dispatcher,
+        max_concurrent_users: int,
+        max_pending_updates: int,
+    ):
+        self._dispatcher = dispatcher
+        self._user_slots = asyncio.Semaphore(max_concurrent_users)
+        self._pending_slots = asyncio.Semaphore(max_pending_updates)
+        self._queues: dict[int | str, deque] = {}
+        self._tasks: set[asyncio.Task] = set()
+        self._in_flight: set[int] = set()
+        self._max_seen_update_id = -1
+        self._progress = asyncio.Event()
+        self.dispatch_time = LatencyStats()
+        self.queue_time = LatencyStats()
+
+    @property
+    def committed_offset(self) -> int:
+        # offset для getUpdates: все updates меньше него уже обработаны.
+        # Пока самый старый update в работе, offset дальше него не двигается
+        if self._in_flight:
+            return min(self._in_flight)
+        return self._max_seen_update_id + 1
+
+    @property
+    def pending(self) -> int:
+        return len(self._in_flight)
+
+    def is_known(self, update_id: int) -> bool:
+        # Telegram повторно присылает updates, которые еще не подтверждены offset'ом
+        return update_id <= self._max_seen_update_id
+
+    async def submit(self, update: dict) -> None:
+        # Если в работе уже слишком много updates, ждем (back-pressure на polling)
+        await self._pending_slots.acquire()
+        update_id = update["update_id"]
+        self._in_flight.add(update_id)
+        self._max_seen_update_id = max(self._max_seen_update_id, update_id)
+
+        telegram_id = self._dispatcher._get_telegram_id_from_update(update)
+        key = telegram_id if telegram_id is not None else f"update_{update_id}"
+        queue = self._queues.get(key)
+        if queue is not None:
+            queue.append((update, time.monotonic()))
+            return
+
+        self._queues[key] = deque([(update, time.monotonic())])
+        task = asyncio.create_task(self._process_user_queue(key))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _process_user_queue(self, key: int | str) -> None:
+        queue = self._queues[key]
+        try:
+            while queue:
+                update, submitted_at = queue[0]
+                async with self._user_slots:
+                    started = time.monotonic()
+                    self.queue_time.observe(started - submitted_at)
+                    try:
+                        await self._dispatcher.dispatch(update)
+                    except Exception:
+                        traceback.print_exc()
+                    self.dispatch_time.observe(time.monotonic() - started)
+                queue.popleft()
+                self._finish(update["update_id"])
+        finally:
+            del self._queues[key]
+
+    def _finish(self, update_id: int) -> None:
+        self._in_flight.discard(update_id)
+        self._pending_slots.release()
+        self._progress.set()
+        self._progress = asyncio.Event()
+
+    async def wait_for_progress(self, timeout: float) -> None:
+        # Ждет, пока обработается хотя бы один update (но не дольше timeout)
+        try:
+            await asyncio.wait_for(self._progress.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def join(self, timeout: float | None = None) -> None:
+        # Дожидается обработки всех принятых updates
+        if self._tasks:
+            await asyncio.wait(set(self._tasks), timeout=timeout)
+
+    def get_stats(self) -> dict:
+        return {
+            "pending_updates": len(self._in_flight),
+            "active_users": len(self._queues),
+            "committed_offset": self.committed_offset,
+            "queue_time": self.queue_time.snapshot(),
+            "dispatch_time": self.dispatch_time.snapshot(),
+        }
+
+
+def create_update_scheduler_from_env(dispatcher: Dispatcher) -> UpdateScheduler:
+    return UpdateScheduler(
+        dispatcher,
+        max_concurrent_users=int(os.getenv("BOT_MAX_CONCURRENT_USERS", "32")),
+        max_pending_updates=int(os.getenv("BOT_MAX_PENDING_UPDATES", "1000")),
+    )
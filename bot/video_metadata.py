@@ -0,0 +1,310 @@
+import asyncio
+import copy
+import json
+import os
+import time
+import traceback
+import yt_dlp
+import bot.database_client
+from bot.download_utils import DownloadUtils
+from bot.probe_executor import ProbeExecutor, create_probe_executor_from_env
+from bot.ttl_cache import TTLCache
+
+_memory_cache = None
+_probe_executor = None
+_in_flight: dict[str, asyncio.Future] = {}
+
+# Сколько секунд помнить неудачную проверку, по видам ошибок.
+# Удаленное видео не вернется, а сетевой сбой стоит перепроверить почти сразу.
+# 0 - не кэшировать
+ERROR_TTLS = {
+    "private": 3600,
+    "unavailable": 6 * 3600,
+    "age_restricted": 24 * 3600,
+    "unsupported_url": 7 * 24 * 3600,
+    "download_error": 300,
+    "timeout": 0,
+    "unexpected": 0,
+}
+
+
+# Поля info, которых достаточно воркеру, чтобы скачать видео через process_ie_result
+_DOWNLOAD_INFO_FIELDS = (
+    "id",
+    "title",
+    "ext",
+    "extractor",
+    "extractor_key",
+    "webpage_url",
+    "original_url",
+    "uploader",
+    "duration",
+)
+_MAX_DOWNLOAD_INFO_SIZE = 64 * 1024
+
+
+def get_metadata_cache() -> TTLCache:
+    # Небольшой кэш в памяти перед таблицей video_metadata
+    global _memory_cache
+    if _memory_cache is None:
+        _memory_cache = TTLCache(
+            max_size=int(os.getenv("VIDEO_METADATA_MEMORY_SIZE", "1000")),
+            ttl=float(os.getenv("VIDEO_METADATA_MEMORY_TTL", "60")),
+        )
+    return _memory_cache
+
+
+def _classify_error(error: Exception) -> str:
+    if not isinstance(error, yt_dlp.utils.DownloadError):
+        return "unexpected"
+    error_message = str(error)
+    if "Private video" in error_message:
+        return "private"
+    elif "Video unavailable" in error_message:
+        return "unavailable"
+    elif "Sign in to confirm" in error_message:
+        return "age_restricted"
+    elif "Unsupported URL" in error_message:
+        return "unsupported_url"
+    return "download_error"
+
+
+def _get_available_types(formats: list) -> dict:
+    available_types = {
+        "video_with_audio": False,
+        "video_no_audio": False,
+        "only_audio": False,
+    }
+    for format in formats:
+        vcodec = format.get("vcodec", "none")
+        acodec = format.get("acodec", "none")
+        flag = (vcodec != "none" and acodec != "none") or (
+            vcodec == "none" and acodec == "none"
+        )
+        if flag:
+            available_types["video_with_audio"] = True
+        elif vcodec != "none" and acodec == "none":
+            available_types["video_no_audio"] = True
+        elif vcodec == "none" and acodec != "none":
+            available_types["only_audio"] = True
+    return available_types
+
+
+def _select_format_fast(ydl, info: dict, ydl_format: str) -> dict | None:
+    # Селектор yt_dlp прямо по списку форматов через внутренний _select_formats (миллисекунды)
+    selector = ydl.build_format_selector(ydl_format)
+    selected = ydl._select_formats(info.get("formats") or [], selector)
+    return selected[0] if selected else None
+
+
+def _select_format_public(info: dict, ydl_format: str) -> dict | None:
+    # Публичный process_ie_result без скачивания (около 0.1 с на формат).
+    # requested_formats от выбора при проверке ссылки убираем: при выборе одного
+    # формата yt_dlp оставил бы их в результате
+    info = {key: value for key, value in info.items() if key != "requested_formats"}
+    params = {"quiet": True, "no_warnings": True, "format": ydl_format}
+    try:
+        with yt_dlp.YoutubeDL(params) as ydl:
+            return ydl.process_ie_result(copy.deepcopy(info), download=False)
+    except yt_dlp.utils.YoutubeDLError:
+        return None
+
+
+def _select_format(ydl, info: dict, ydl_format: str) -> dict | None:
+    # Форматы, которые yt_dlp выбрал бы при скачивании (для "видео+аудио" -
+    # с requested_formats). None - подходящих форматов нет. Если в новой версии yt_dlp
+    # внутреннего _select_formats нет или его сигнатура изменилась, выбираем публичным путем
+    try:
+        return _select_format_fast(ydl, info, ydl_format)
+    except (AttributeError, TypeError) as e:
+        print(f"Выбор форматов через process_ie_result: {e!r}")
+        return _select_format_public(info, ydl_format)
+
+
+def _resolve_formats(info: dict, resolutions: list, types: dict) -> tuple[dict, dict]:
+    # Для каждой кнопки заранее выбираем конкретные форматы (например "137+140")
+    # так же, как их выбрал бы yt_dlp при скачивании (с фильтром по лимиту размера:
+    # если лучший формат не помещается, берем меньший), и оцениваем размер файла
+    max_size = DownloadUtils._get_max_file_size()
+    format_ids = {}
+    sizes = {}
+    with yt_dlp.YoutubeDL({"quiet": True, "no_warnings": True}) as ydl:
+        for resolution in resolutions:
+            for video_type, available in types.items():
+                if not available:
+                    continue
+                ydl_format = DownloadUtils._generate_ydl_format(resolution, video_type)
+                if ydl_format in format_ids:
+                    continue
+                selected = _select_format(
+                    ydl, info, DownloadUtils._with_size_filter(ydl_format, max_size)
+                )
+                if selected is None or not selected.get("format_id"):
+                    continue
+                format_ids[ydl_format] = selected["format_id"]
+                size, exact = DownloadUtils._estimate_size(
+                    selected, info.get("duration")
+                )
+                if size is not None:
+                    sizes[ydl_format] = {"size": size, "exact": exact}
+    return format_ids, sizes
+
+
+def _prepare_download(info: dict, resolutions: list, types: dict) -> dict:
+    # Выбранные форматы, оценки размера и урезанный info для воркера. Ссылки на форматы со временем
+    # протухают, поэтому запоминаем время проверки
+    try:
+        format_ids, sizes = _resolve_formats(info, resolutions, types)
+    except yt_dlp.utils.YoutubeDLError as e:
+        # Без заранее выбранных форматов воркер выберет их сам. Остальные ошибки - баги,
+        # их не прячем
+        print(f"Не удалось заранее выбрать форматы: {e!r}")
+        return {}
+    if not format_ids:
+        return {}
+    needed_ids = {
+        format_id
+        for selected in format_ids.values()
+        for format_id in selected.split("+")
+    }
+    sanitized = yt_dlp.YoutubeDL.sanitize_info(info)
+    download_info = {
+        field: sanitized[field]
+        for field in _DOWNLOAD_INFO_FIELDS
+        if sanitized.get(field) is not None
+    }
+    download_info["formats"] = [
+        format
+        for format in sanitized.get("formats") or []
+        if format.get("format_id") in needed_ids
+    ]
+    if len(json.dumps(download_info)) > _MAX_DOWNLOAD_INFO_SIZE:
+        return {"format_ids": format_ids, "sizes": sizes}
+    return {
+        "format_ids": format_ids,
+        "sizes": sizes,
+        "download_info": {"probed_at": time.time(), "info": download_info},
+    }
+
+
+def summarize_info(info: dict) -> dict:
+    # Из info yt_dlp оставляем только то, что нужно хэндлерам и воркеру
+    formats = info.get("formats") or []
+    heights = {format["height"] for format in formats if format.get("height")}
+    resolutions = [f"{height}p" for height in sorted(heights, reverse=True)]
+    types = _get_available_types(formats)
+    summary = {
+        "success": True,
+        "title": info.get("title", "Неизвестное название"),
+        "uploader": info.get("uploader", "Неизвестный автор"),
+        "duration": info.get("duration", 0),
+        "resolutions": resolutions,
+        "types": types,
+    }
+    summary.update(_prepare_download(info, resolutions[:5], types))
+    return summary
+
+
+def _extract_info(url: str) -> dict:
+    ydl_opts = {
+        "quiet": True,
+        "no_warnings": True,
+    }
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        return ydl.extract_info(url, download=False)
+
+
+def _probe_sync(url: str) -> dict:
+    try:
+        info = _extract_info(url)
+    except Exception as e:
+        return {"success": False, "error": _classify_error(e)}
+    return summarize_info(info)
+
+
+def get_probe_executor() -> ProbeExecutor:
+    global _probe_executor
+    if _probe_executor is None:
+        _probe_executor = create_probe_executor_from_env(
+            _probe_sync, worker_module="bot.probe_worker"
+        )
+    return _probe_executor
+
+
+async def close_probe_executor() -> None:
+    global _probe_executor
+    if _probe_executor:
+        await _probe_executor.close()
+        _probe_executor = None
+
+
+async def _probe(url: str) -> dict:
+    try:
+        return await get_probe_executor().run(url)
+    except asyncio.TimeoutError:
+        return {"success": False, "error": "timeout"}
+    except Exception:
+        traceback.print_exc()
+        return {"success": False, "error": "unexpected"}
+
+
+def _get_ttl(metadata: dict) -> float:
+    if metadata["success"]:
+        return float(os.getenv("VIDEO_METADATA_TTL", "3600"))
+    return ERROR_TTLS.get(metadata["error"], 0)
+
+
+async def _load(video_key: str, url: str) -> dict:
+    # Таблица video_metadata общая для всех процессов бота.
+    # Если база недоступна, просто проверяем видео заново
+    try:
+        metadata = await bot.database_client.get_video_metadata(video_key)
+    except Exception:
+        traceback.print_exc()
+        metadata = None
+    if metadata is not None:
+        get_metadata_cache().set(video_key, metadata)
+        return metadata
+
+    metadata = await _probe(url)
+    ttl = _get_ttl(metadata)
+    if ttl > 0:
+        try:
+            await bot.database_client.save_video_metadata(video_key, metadata, ttl)
+        except Exception:
+            traceback.print_exc()
+        cache = get_metadata_cache()
+        cache.set(video_key, metadata, ttl=min(ttl, cache.ttl))
+    return metadata
+
+
+async def get_video_metadata(url: str) -> dict:
+    # Метаданные видео: {"success": True, title, uploader, duration, resolutions, types}
+    # или {"success": False, "error": вид ошибки}.
+    # Одновременные запросы одной ссылки ждут одну и ту же проверку
+    video_key = await DownloadUtils._get_video_key(url)
+    metadata = get_metadata_cache().get(video_key)
+    if metadata is not None:
+        return metadata
+
+    future = _in_flight.get(video_key)
+    if future is not None:
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # Отменили проверку, которую мы ждали, а не нас - проверяем сами
+            if not future.cancelled():
+                raise
+            return await get_video_metadata(url)
+
+    future = asyncio.get_running_loop().create_future()
+    _in_flight[video_key] = future
+    try:
+        metadata = await _load(video_key, url)
+    except BaseException:
+        future.cancel()
+        raise
+    finally:
+        del _in_flight[video_key]
+    future.set_result(metadata)
+    return metadata
@@ -0,0 +1,102 @@
+import asyncio
+import os
+import secrets
+import signal
+from collections import OrderedDict
+from aiohttp import web
+from bot.dispatcher import Dispatcher
+from bot.long_polling import ALLOWED_UPDATES
+from bot.update_scheduler import UpdateScheduler, create_update_scheduler_from_env
+import bot.telegram_api_client
+
+SECRET_TOKEN_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class _RecentUpdateIds:
+    # Telegram повторяет доставку, если не получил ответ вовремя.
+    # Через webhook updates могут приходить не по порядку, поэтому помним id, а не максимум
+    def __init__(self, max_size: int):
+        self._max_size = max_size
+        self._ids = OrderedDict()
+
+    def add(self, update_id: int) -> bool:
+        if update_id in self._ids:
+            return False
+        self._ids[update_id] = None
+        if len(self._ids) > self._max_size:
+            self._ids.popitem(last=False)
+        return True
+
+
+def create_webhook_app(
+    scheduler: UpdateScheduler, secret_token: str | None, path: str
+) -> web.Application:
+    recent_update_ids = _RecentUpdateIds(max_size=10000)
+
+    async def handle_update(request: web.Request) -> web.Response:
+        if secret_token and request.headers.get(SECRET_TOKEN_HEADER) != secret_token:
+            return web.Response(status=403)
+        try:
+            update = await request.json()
+            update_id = update["update_id"]
+        except (ValueError, KeyError, TypeError):
+            return web.Response(status=400)
+
+        # Отвечаем сразу, а обрабатываем в фоне: Telegram не ждет хэндлеры
+        if recent_update_ids.add(update_id):
+            await scheduler.submit(update)
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_post(path, handle_update)
+    return app
+
+
+def _get_secret_token(public_url: str | None) -> str | None:
+    # Без секрета обработчик принимает любой POST. Если webhook регистрируется в Telegram,
+    # а BOT_WEBHOOK_SECRET не задан, генерируем случайный секрет и передаем его в setWebhook
+    secret_token = os.getenv("BOT_WEBHOOK_SECRET")
+    if public_url and not secret_token:
+        print(
+            "BOT_WEBHOOK_SECRET не задан, webhook защищен случайным секретом",
+            flush=True,
+        )
+        secret_token = secrets.token_urlsafe(32)
+    return secret_token or None
+
+
+async def start_webhook(dispatcher: Dispatcher) -> None:
+    host = os.getenv("BOT_WEBHOOK_HOST", "0.0.0.0")
+    port = int(os.getenv("BOT_WEBHOOK_PORT", "8080"))
+    path = os.getenv("BOT_WEBHOOK_PATH", "/webhook")
+    public_url = os.getenv("BOT_WEBHOOK_URL")
+    secret_token = _get_secret_token(public_url)
+
+    scheduler = create_update_scheduler_from_env(dispatcher)
+    runner = web.AppRunner(create_webhook_app(scheduler, secret_token, path))
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    print(f"Webhook слушает http://{host}:{port}{path}", flush=True)
+
+    # Без BOT_WEBHOOK_URL webhook в Telegram не регистрируется:
+    # так сервер можно проверить локально, отправляя в него записанные updates
+    if public_url:
+        await bot.telegram_api_client.set_webhook(
+            public_url, allowed_updates=ALLOWED_UPDATES, secret_token=secret_token
+        )
+
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signal_number in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(signal_number, stop_event.set)
+        except (NotImplementedError, RuntimeError):
+            pass
+    try:
+        await stop_event.wait()
+    finally:
+        # Сначала перестаем принимать запросы, потом дожидаемся принятых updates
+        print("Webhook останавливается...", flush=True)
+        await runner.cleanup()
+        await scheduler.join(timeout=float(os.getenv("BOT_SHUTDOWN_TIMEOUT", "10")))
@@ -1,62 +1,324 @@
 import json
-import yt_dlp
+import shutil
+import threading
+import time
+import uuid
 import os
 import traceback
 import aio_pika
 import asyncio
+from concurrent.futures import ThreadPoolExecutor
 import bot.telegram_api_client
 import bot.database_client
+from bot.download_utils import DownloadUtils
+from bot.media_cache import get_media_cache
+from bot.streaming_upload import GrowingFileStream
+from bot.task_lanes import LANES, NORMAL, get_lane_queue, get_lane_slots
+from bot.download_process import ChildProcesses, DownloadProcess
+from bot.metrics import LatencyStats, LoopLagMonitor
 from bot.types import STATE
+from bot.yt_download import FileTooLarge, run_download
+
+
+class _JobStages:
+    # Слот стадии (скачивание или ffmpeg), который сейчас держит поток одного задания.
+    # Задание держит не больше одного слота: начав склейку, оно отдает слот скачивания
+    def __init__(self, download: threading.Semaphore, merge: threading.Semaphore):
+        self.download = download
+        self.merge = merge
+        self._held = None
+
+    def enter(self, semaphore: threading.Semaphore) -> None:
+        if self._held is semaphore:
+            return
+        self.leave()
+        semaphore.acquire()
+        self._held = semaphore
+
+    def leave(self) -> None:
+        if self._held is not None:
+            self._held.release()
+            self._held = None
+
+    def postprocessor_hook(self, progress: dict) -> None:
+        # Постпроцессоры yt_dlp (Merger, Fixup*) запускают ffmpeg.
+        # Если постпроцессор упал, finished не придет - слот отпустит leave в finally
+        if progress["status"] == "started":
+            self.enter(self.merge)
+        elif progress["status"] == "finished":
+            self.leave()
+
+
+def _too_large_message(size: int | None, max_size: int, approximate: bool) -> str:
+    # Размер может быть неизвестен: yt_dlp отказался от файла по Content-Length
+    if size is None:
+        size_text = f"больше {max_size // (1024 * 1024)}Mb"
+    else:
+        size_text = (
+            f"{'~' if approximate else ''}{size / (1024 * 1024):.1f}Mb > "
+            f"{max_size // (1024 * 1024)}Mb"
+        )
+    return f"Файл слишком большой: {size_text}. \nПожалуйста, выберите разрешение ниже."
+
+
+class _JobEvents:
+    # События скачивания одного задания: слоты стадий и потоковая загрузка в Telegram
+    def __init__(self, stages: _JobStages, stream: GrowingFileStream | None):
+        self.stages = stages
+        self.stream = stream
+
+    def on_selected(self, info: dict) -> None:
+        if self.stream is not None:
+            self.stream.on_selected(info)
+
+    def progress_hook(self, progress: dict) -> None:
+        if self.stream is not None:
+            self.stream.progress_hook(progress)
+
+    def postprocessor_hook(self, progress: dict) -> None:
+        self.stages.postprocessor_hook(progress)
+        if self.stream is not None:
+            self.stream.postprocessor_hook(progress)
 
 
 class DownloadWorker:
+    def __init__(self):
+        # Сколько заданий воркер обрабатывает одновременно (столько же берет из очереди без ack)
+        # и отдельные лимиты на стадии: скачивание из сети, склейка ffmpeg, загрузка в Telegram.
+        # Часть слотов закреплена за полосами (быстрая полоса не ждет длинные задания),
+        # остальные общие и берут задания любой полосы
+        self.concurrency = int(os.getenv("WORKER_CONCURRENCY", "4"))
+        self.lane_slots = get_lane_slots(self.concurrency)
+        self.shared_slots = self.concurrency - sum(self.lane_slots.values())
+        # Как часто запрашивать у брокера число сообщений в очередях полос
+        self.lane_stats_interval = float(os.getenv("WORKER_LANE_STATS_INTERVAL", "10"))
+        self.lane_depth = dict.fromkeys(LANES)
+        # Время от отправки задания ботом до начала его выполнения воркером
+        self.lane_wait = {lane: LatencyStats() for lane in LANES}
+        self._download_slots = threading.BoundedSemaphore(
+            int(os.getenv("WORKER_DOWNLOAD_CONCURRENCY", str(self.concurrency)))
+        )
+        self._merge_slots = threading.BoundedSemaphore(
+            int(os.getenv("WORKER_MERGE_CONCURRENCY", "2"))
+        )
+        self._upload_slots = asyncio.Semaphore(
+            int(os.getenv("WORKER_UPLOAD_CONCURRENCY", "2"))
+        )
+        # process - каждое скачивание в отдельном процессе, thread - в потоке воркера
+        self.download_mode = os.getenv("WORKER_DOWNLOAD_MODE", "process")
+        if self.download_mode not in ("thread", "process"):
+            raise ValueError(f"Unknown download mode: {self.download_mode}")
+        self.download_timeout = float(os.getenv("WORKER_DOWNLOAD_TIMEOUT", "1800"))
+        self._child_processes = ChildProcesses(
+            spare=int(os.getenv("WORKER_SPARE_PROCESSES", "1"))
+        )
+        self.loop_lag = LoopLagMonitor()
+        # Как часто владелец скачивания обновляет свою запись в download_flights и через
+        # сколько секунд без обновлений запись считается брошенной (упавший воркер)
+        self.flight_heartbeat = float(os.getenv("WORKER_FLIGHT_HEARTBEAT", "30"))
+        self.flight_stale_after = float(
+            os.getenv("WORKER_FLIGHT_STALE_AFTER", str(self.flight_heartbeat * 4))
+        )
+        # Сколько секунд при остановке ждать текущие задания
+        self.drain_timeout = float(os.getenv("WORKER_DRAIN_TIMEOUT", "300"))
+        self._stopping = asyncio.Event()
+        # Свой пул потоков: поток задания ждет слоты стадий и не должен занимать общий пул
+        self._executor = ThreadPoolExecutor(
+            self.concurrency, thread_name_prefix="download"
+        )
+        self._jobs: set[asyncio.Task] = set()
+        self.completed = 0
+        # Задания, которые не скачивали сами, а дождались результата другого задания
+        self.coalesced = 0
+        self.waiters_served = 0
+        # Скачивания, прерванные из-за размера до их окончания
+        self.too_large_aborted = 0
+        # Файлы, загруженные в Telegram еще во время скачивания
+        self.streamed_uploads = 0
+        self.download_timeouts = 0
+        self.job_time = LatencyStats()
+
     async def start_consuming(self):
+        self.loop_lag.start()
+        if self.download_mode == "process":
+            self._child_processes.warm_up()
         try:
             connection = await aio_pika.connect_robust(host=os.getenv("RABBITMQ_HOST"))
             async with connection:
+                # Общий канал слушает очереди всех полос, global_ делает его prefetch_count
+                # общим для всех очередей канала: свободный слот берет задание любой полосы.
+                # У полосы с закрепленными слотами еще свой канал с prefetch_count, равным им
                 channel = await connection.channel()
-                await channel.set_qos(prefetch_count=1)
+                await channel.set_qos(prefetch_count=self.shared_slots, global_=True)
+                queues = {
+                    lane: await channel.declare_queue(
+                        get_lane_queue(lane), durable=True
+                    )
+                    for lane in LANES
+                }
+                consumed = list(queues.values())
+                for lane, slots in self.lane_slots.items():
+                    if slots <= 0:
+                        continue
+                    channel = await connection.channel()
+                    await channel.set_qos(prefetch_count=slots)
+                    consumed.append(
+                        await channel.declare_queue(get_lane_queue(lane), durable=True)
+                    )
+                print(
+                    f"Worker запущен и слушает очереди (заданий: {self.concurrency}, "
+                    f"общих: {self.shared_slots}, закрепленных: {self.lane_slots})..."
+                )
 
-                queue = await channel.declare_queue(
-                    os.getenv("RABBITMQ_QUEUE_NAME"), durable=True
+                consumers = [
+                    asyncio.create_task(self._consume(queue)) for queue in consumed
+                ]
+                lane_depth = asyncio.create_task(self._watch_lane_depth(queues))
+                stopping = asyncio.create_task(self._stopping.wait())
+                done, _ = await asyncio.wait(
+                    (*consumers, stopping), return_when=asyncio.FIRST_COMPLETED
+                )
+                # Остановка: отписываемся от очередей и доделываем текущие задания,
+                # пока соединение открыто и их сообщения можно подтвердить
+                for task in (*consumers, lane_depth, stopping):
+                    task.cancel()
+                await asyncio.gather(
+                    *consumers, lane_depth, stopping, return_exceptions=True
                 )
-                print("Worker запущен и слушает очередь...")
-
-                async with queue.iterator() as queue_iter:
-                    async for message in queue_iter:
-                        async with message.process():
-                            try:
-                                download_task = json.loads(message.body.decode())
-                                telegram_id = download_task["telegram_id"]
-                                await self.process_download_task(download_task)
-                            except Exception:
-                                traceback.print_exc()
-                                chat_id = download_task["chat_id"]
-                                if telegram_id:
-                                    await bot.database_client.clear_user_video_and_set_state(
-                                        telegram_id
-                                    )
-                                if chat_id:
-                                    await bot.telegram_api_client.send_message(
-                                        chat_id=chat_id,
-                                        text="Ошибка при скачивании. Попробуйте еще раз.",
-                                    )
+                for consume in consumers:
+                    if consume in done:
+                        consume.result()
+                await self._drain()
         except Exception as e:
             print(f"Ошибка при запуске воркера: {e}")
             traceback.print_exc()
+        finally:
+            for job in self._jobs:
+                job.cancel()
+            await asyncio.gather(*self._jobs, return_exceptions=True)
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._child_processes.close()
+            await self.loop_lag.stop()
+
+    async def _consume(self, queue: aio_pika.abc.AbstractQueue) -> None:
+        # prefetch_count ограничивает число неподтвержденных сообщений канала,
+        # поэтому одновременно выполняется не больше заданий, чем у него слотов
+        async with queue.iterator() as queue_iter:
+            async for message in queue_iter:
+                job = asyncio.create_task(self._handle_message(message))
+                self._jobs.add(job)
+                job.add_done_callback(self._jobs.discard)
+
+    async def _watch_lane_depth(self, queues: dict) -> None:
+        # Число готовых сообщений в очереди полосы (повторное объявление очереди
+        # возвращает message_count)
+        while True:
+            for lane, queue in queues.items():
+                try:
+                    self.lane_depth[lane] = (await queue.declare()).message_count
+                except Exception as e:
+                    print(f"Не удалось узнать длину очереди {lane}: {e}")
+            await asyncio.sleep(self.lane_stats_interval)
+
+    def stop(self) -> None:
+        # Плавная остановка (SIGTERM): новые задания не берутся, текущие доделываются
+        if not self._stopping.is_set():
+            print(f"Воркер останавливается, заданий в работе: {len(self._jobs)}")
+            self._stopping.set()
+
+    async def _drain(self) -> None:
+        # Задания, не закончившиеся за WORKER_DRAIN_TIMEOUT, отменяются в finally
+        # start_consuming, и их сообщения возвращаются в очередь
+        if self._jobs:
+            await asyncio.wait(set(self._jobs), timeout=self.drain_timeout)
 
-    async def process_download_task(self, task: dict):
+    async def _handle_message(self, message: aio_pika.abc.AbstractIncomingMessage):
+        # ack только после завершения задания. Если воркер остановили посреди задания,
+        # сообщение возвращается в очередь и его возьмет другой воркер
+        started = time.monotonic()
+        async with message.process(requeue=True):
+            download_task = {}
+            try:
+                download_task = json.loads(message.body.decode())
+                self._observe_lane_wait(download_task)
+                await self.process_download_task(
+                    download_task, redelivered=message.redelivered
+                )
+            except Exception:
+                traceback.print_exc()
+                telegram_id = download_task.get("telegram_id")
+                chat_id = download_task.get("chat_id")
+                if telegram_id:
+                    await bot.database_client.clear_user_video_and_set_state(
+                        telegram_id
+                    )
+                if chat_id:
+                    await bot.telegram_api_client.send_message(
+                        chat_id=chat_id,
+                        text="Ошибка при скачивании. Попробуйте еще раз.",
+                    )
+        self.completed += 1
+        self.job_time.observe(time.monotonic() - started)
+
+    def _observe_lane_wait(self, task: dict) -> None:
+        # Задания без enqueued_at отправлены до появления полос
+        lane = task.get("lane", NORMAL)
+        if task.get("enqueued_at") and lane in self.lane_wait:
+            self.lane_wait[lane].observe(max(0.0, time.time() - task["enqueued_at"]))
+
+    def get_stats(self) -> dict:
+        return {
+            "concurrency": self.concurrency,
+            "shared_slots": self.shared_slots,
+            "lanes": {
+                lane: {
+                    "slots": self.lane_slots[lane],
+                    "depth": self.lane_depth[lane],
+                    "wait_time": self.lane_wait[lane].snapshot(),
+                }
+                for lane in LANES
+            },
+            "active": len(self._jobs),
+            "completed": self.completed,
+            "coalesced": self.coalesced,
+            "waiters_served": self.waiters_served,
+            "too_large_aborted": self.too_large_aborted,
+            "streamed_uploads": self.streamed_uploads,
+            "download_timeouts": self.download_timeouts,
+            "download_mode": self.download_mode,
+            "child_processes": self._child_processes.get_stats(),
+            "loop_lag": self.loop_lag.lag.snapshot(),
+            "job_time": self.job_time.snapshot(),
+            "media_cache": get_media_cache().get_stats(),
+        }
+
+    async def process_download_task(self, task: dict, redelivered: bool = False):
         telegram_id = task["telegram_id"]
         chat_id = task["chat_id"]
         url = task["url"]
         ydl_format = task["ydl_format"]
+        video_key = task.get("video_key")
+        format_id = task.get("format_id")
+        info = task.get("info")
+        # Ссылки на форматы живут ограниченное время: старый info не используем
+        max_age = float(os.getenv("DOWNLOAD_INFO_MAX_AGE", "1800"))
+        if info is not None and time.time() - task.get("probed_at", 0) > max_age:
+            info = None
 
         try:
             await bot.database_client.update_user_state(
                 telegram_id, STATE.WAIT_FOR_DOWNLOAD
             )
             success, error_message = await self._download_and_send_file(
-                chat_id, telegram_id, url, ydl_format
+                chat_id,
+                telegram_id,
+                url,
+                ydl_format,
+                video_key=video_key,
+                format_id=format_id,
+                info=info,
+                max_filesize=task.get("max_filesize"),
+                redelivered=redelivered,
             )
             await bot.database_client.clear_user_video_and_set_state(telegram_id)
 
@@ -79,56 +341,326 @@ class DownloadWorker:
                 text="Ошибка отправки. Попробуйте начать заново.",
             )
 
-    async def _download_and_send_file(
-        self, chat_id: int, telegram_id: int, url: str, ydl_format: str
-    ) -> bool:
-        loop = asyncio.get_event_loop()
+    async def _join_download(
+        self, chat_id: int, video_key: str, ydl_format: str, redelivered: bool = False
+    ) -> tuple[bool, str | None]:
+        # Одно и то же видео в одном формате скачивает только один воркер.
+        # Возвращает (скачивать ли самому, owner записи о скачивании).
+        # Остальные задания записываются в ожидающие и получат результат от этого воркера.
+        # Повторно доставленное задание (воркер упал посреди него) перехватывает запись:
+        # иначе оно записалось бы ожидающим скачивания, которое уже никто не ведет
+        owner = uuid.uuid4().hex
         try:
-            video_dir = "videos"
-            os.makedirs(video_dir, exist_ok=True)
-
-            def _download():
-                ydl_opts = {
-                    "format": ydl_format,
-                    "outtmpl": os.path.join(video_dir, "%(title)s.%(ext)s"),
-                    "quiet": False,
-                }
+            for _ in range(3):
+                if await bot.database_client.claim_download(
+                    video_key,
+                    ydl_format,
+                    owner,
+                    self.flight_stale_after,
+                    take_over=redelivered,
+                ):
+                    return True, owner
+                if await bot.database_client.add_download_waiter(
+                    video_key, ydl_format, chat_id
+                ):
+                    self.coalesced += 1
+                    return False, None
+                # Скачивание только что закончилось - файл уже может быть в кэше
+                if await DownloadUtils._send_cached_file(
+                    chat_id, video_key, ydl_format
+                ):
+                    self.coalesced += 1
+                    return False, None
+        except Exception as e:
+            print(f"Не удалось согласовать скачивание с другими воркерами: {e}")
+        return True, None
 
-                with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                    info = ydl.extract_info(url, download=True)
-                    file_path = ydl.prepare_filename(info)
-                    return file_path, info.get("title", "video")
+    async def _heartbeat_download(
+        self, video_key: str, ydl_format: str, owner: str
+    ) -> None:
+        # Пока идет скачивание, владелец обновляет started_at своей записи
+        while True:
+            await asyncio.sleep(self.flight_heartbeat)
+            try:
+                if not await bot.database_client.touch_download(
+                    video_key, ydl_format, owner
+                ):
+                    return
+            except Exception as e:
+                print(f"Не удалось обновить запись о скачивании {video_key}: {e}")
 
-            file_path, title = await loop.run_in_executor(None, _download)
-            if not os.path.exists(file_path):
-                print(f"Файл не найден: {file_path}")
-                return False
+    async def _serve_waiters(
+        self,
+        chat_ids: list[int],
+        delivered: dict,
+        error_message: str | None,
+    ) -> None:
+        # Ожидающим отправляем тот же результат: по file_id или тем же локальным файлом
+        for chat_id in chat_ids:
+            try:
+                if delivered.get("file_id"):
+                    await bot.telegram_api_client.send_cached_document(
+                        chat_id, delivered["file_id"], delivered["title"]
+                    )
+                elif delivered.get("sent"):
+                    async with self._upload_slots:
+                        await bot.telegram_api_client.send_document(
+                            chat_id, delivered["file_path"], delivered["title"]
+                        )
+                else:
+                    await bot.telegram_api_client.send_message(
+                        chat_id=chat_id,
+                        text=error_message
+                        or "Ошибка отправки. Попробуйте начать заново.",
+                    )
+                self.waiters_served += 1
+            except Exception as e:
+                print(f"Не удалось отправить видео ожидающему чату {chat_id}: {e}")
 
-            max_size = 50 * 1024 * 1024
-            filesize = os.path.getsize(file_path)
-            if filesize > max_size:
-                size_mb = filesize / (1024 * 1024)
-                error_message = (
-                    f"Файл слишком большой: {size_mb:.1f}Mb > 50Mb. \n"
-                    f"Пожалуйста, выберите разрешение ниже."
+    async def _finish_download(
+        self,
+        video_key: str,
+        ydl_format: str,
+        owner: str,
+        delivered: dict,
+        error_message: str | None,
+        cancelled: bool,
+    ) -> None:
+        # Если задание отменили, ожидающих не трогаем: их заберет воркер,
+        # которому RabbitMQ заново отдаст это задание
+        try:
+            chat_ids = await bot.database_client.finish_download(
+                video_key, ydl_format, owner, take_waiters=not cancelled
+            )
+        except Exception as e:
+            print(f"Не удалось завершить скачивание {video_key}: {e}")
+            return
+        await self._serve_waiters(chat_ids, delivered, error_message)
+
+    async def _download_and_send_file(
+        self,
+        chat_id: int,
+        telegram_id: int,
+        url: str,
+        ydl_format: str,
+        video_key: str | None = None,
+        format_id: str | None = None,
+        info: dict | None = None,
+        max_filesize: int | None = None,
+        redelivered: bool = False,
+    ) -> tuple[bool, str | None]:
+        # У каждого задания своя временная папка: одинаковые названия видео
+        # и промежуточные файлы склейки не пересекаются между заданиями
+        job_dir = os.path.join("videos", f"job-{uuid.uuid4().hex}")
+        delivered = {}
+        try:
+            # Если это видео уже отправлялось, пересылаем его по file_id
+            if video_key is None:
+                video_key = await DownloadUtils._get_video_key(url)
+            if await DownloadUtils._send_cached_file(chat_id, video_key, ydl_format):
+                return True, None
+
+            lead, owner = await self._join_download(
+                chat_id, video_key, ydl_format, redelivered
+            )
+            if not lead:
+                return True, None
+
+            success, error_message = False, None
+            cancelled = False
+            heartbeat = None
+            if owner is not None:
+                heartbeat = asyncio.create_task(
+                    self._heartbeat_download(video_key, ydl_format, owner)
                 )
+            try:
+                success, error_message = await self._download_and_upload(
+                    chat_id,
+                    url,
+                    ydl_format,
+                    video_key,
+                    format_id,
+                    info,
+                    max_filesize,
+                    job_dir,
+                    delivered,
+                )
+                return success, error_message
+            except asyncio.CancelledError:
+                cancelled = True
+                raise
+            finally:
+                if heartbeat is not None:
+                    heartbeat.cancel()
+                if owner is not None:
+                    await self._finish_download(
+                        video_key,
+                        ydl_format,
+                        owner,
+                        delivered,
+                        error_message,
+                        cancelled,
+                    )
 
+        except Exception as e:
+            await bot.database_client.clear_user_video_and_set_state(telegram_id)
+            print(f"Ошибка в _download_and_send_file: {e}")
+            return False, None
+        finally:
+            if delivered.get("file_path"):
                 try:
-                    os.remove(file_path)
+                    os.remove(delivered["file_path"])
                 except Exception:
                     pass
-                return False, error_message
-            success = await bot.telegram_api_client.send_document(
-                chat_id, file_path, title
-            )
-            try:
-                os.remove(file_path)
-            except Exception:
-                pass
+            shutil.rmtree(job_dir, ignore_errors=True)
 
-            return success, None
+    async def _run_download(self, download, job: dict) -> tuple[str, dict]:
+        # В режиме process yt_dlp работает в отдельном процессе, а поток воркера только
+        # передает его события. По истечении WORKER_DOWNLOAD_TIMEOUT или при отмене задания
+        # процесс убивается. В режиме thread yt_dlp работает прямо в потоке воркера
+        loop = asyncio.get_running_loop()
+        if self.download_mode == "thread":
+            return await loop.run_in_executor(self._executor, download, None)
+        process = DownloadProcess(job, self._child_processes)
+        future = loop.run_in_executor(self._executor, download, process)
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), self.download_timeout)
+        except BaseException:
+            process.kill()
+            await asyncio.gather(future, return_exceptions=True)
+            raise
 
+    async def _stream_upload(self, chat_id: int, stream: GrowingFileStream):
+        # Загрузка в Telegram параллельно со скачиванием. None - не получилось,
+        # и готовый файл отправляется обычным способом
+        if not await stream.wait_ready():
+            return None
+        try:
+            async with self._upload_slots:
+                message = await bot.telegram_api_client.send_document_stream(
+                    chat_id,
+                    stream.chunks(),
+                    stream.size,
+                    stream.filename,
+                    stream.title or "",
+                )
         except Exception as e:
-            await bot.database_client.clear_user_video_and_set_state(telegram_id)
-            print(f"Ошибка в _download_and_send_file: {e}")
-            return False
+            print(f"Потоковая загрузка не удалась, отправляем готовый файл: {e}")
+            return None
+        self.streamed_uploads += 1
+        return message
+
+    async def _download_and_upload(
+        self,
+        chat_id: int,
+        url: str,
+        ydl_format: str,
+        video_key: str,
+        format_id: str | None,
+        info: dict | None,
+        max_filesize: int | None,
+        job_dir: str,
+        delivered: dict,
+    ) -> tuple[bool, str | None]:
+        # Скачивает видео и отправляет его в chat_id. В delivered остаются путь к файлу,
+        # название и file_id - по ним результат получат ожидающие чаты
+        loop = asyncio.get_running_loop()
+        os.makedirs(job_dir, exist_ok=True)
+        max_size = max_filesize or DownloadUtils._get_max_file_size()
+
+        job = {
+            "url": url,
+            "ydl_format": ydl_format,
+            "format_id": format_id,
+            "info": info,
+            "job_dir": job_dir,
+            "max_size": max_size,
+        }
+
+        def _download(process: DownloadProcess | None):
+            stages = _JobStages(self._download_slots, self._merge_slots)
+            events = _JobEvents(stages, stream)
+            try:
+                stages.enter(stages.download)
+                if process is None:
+                    return run_download(job, events)
+                return process.run(events)
+            finally:
+                stages.leave()
+
+        stream = None
+        upload = None
+        try:
+            # Файл, скачанный недавно этим или соседним воркером, берем с диска без yt_dlp
+            media_cache = get_media_cache()
+            cached = await loop.run_in_executor(
+                self._executor, media_cache.get, video_key, ydl_format, job_dir
+            )
+            if cached is not None:
+                file_path, title = cached
+                result = {"title": title}
+            else:
+                # Файл из одного куска начинаем загружать в Telegram, пока он еще скачивается
+                if os.getenv("WORKER_STREAM_UPLOAD", "1") == "1":
+                    stream = GrowingFileStream(
+                        loop,
+                        int(os.getenv("TELEGRAM_UPLOAD_CHUNK_SIZE", str(256 * 1024))),
+                    )
+                    upload = asyncio.create_task(self._stream_upload(chat_id, stream))
+                try:
+                    file_path, result = await self._run_download(_download, job)
+                except FileTooLarge as e:
+                    self.too_large_aborted += 1
+                    print(f"Скачивание {video_key} прервано: {e}")
+                    return False, _too_large_message(e.size, max_size, e.approximate)
+                except asyncio.TimeoutError:
+                    self.download_timeouts += 1
+                    print(f"Скачивание {video_key} не уложилось в срок")
+                    return False, (
+                        "Скачивание заняло слишком много времени. \n"
+                        "Пожалуйста, выберите разрешение ниже."
+                    )
+            title = result.get("title", "video")
+            delivered.update(file_path=file_path, title=title)
+            if not os.path.exists(file_path):
+                print(f"Файл не найден: {file_path}")
+                return False, None
+
+            filesize = os.path.getsize(file_path)
+            if filesize > max_size:
+                return False, _too_large_message(filesize, max_size, approximate=False)
+            if stream is not None:
+                stream.complete(file_path)
+            if cached is None:
+                try:
+                    await loop.run_in_executor(
+                        self._executor,
+                        media_cache.put,
+                        video_key,
+                        ydl_format,
+                        file_path,
+                        title,
+                    )
+                except OSError as e:
+                    print(f"Не удалось сохранить файл в кэш: {e}")
+            message = await upload if upload is not None else None
+            if message is None:
+                async with self._upload_slots:
+                    message = await bot.telegram_api_client.send_document(
+                        chat_id, file_path, title
+                    )
+            delivered["sent"] = bool(message)
+
+            file_id = DownloadUtils._get_file_id(message)
+            if file_id:
+                delivered["file_id"] = file_id
+                await bot.database_client.save_cached_file(
+                    video_key, ydl_format, file_id, title
+                )
+
+            return bool(message), None
+        finally:
+            # Задание закончилось раньше загрузки (ошибка, слишком большой файл) - прерываем ее
+            if stream is not None:
+                stream.abort("job finished")
+                await asyncio.gather(upload, return_exceptions=True)
@@ -0,0 +1,120 @@
+import copy
+import os
+import yt_dlp
+from bot.download_utils import DownloadUtils
+
+# Скачивание одного задания через yt_dlp. Выполняется в потоке воркера
+# или в отдельном процессе (download_child.py)
+
+# Сколько байт нужно скачать, прежде чем прерывать скачивание по прогнозу размера
+_MIN_PROJECTION_BYTES = 1024 * 1024
+
+
+class FileTooLarge(yt_dlp.utils.DownloadCancelled):
+    # DownloadCancelled yt_dlp не перехватывает: скачивание сразу прерывается.
+    # size None - размер неизвестен, но больше лимита
+    def __init__(self, size: int | None, approximate: bool):
+        super().__init__(f"File is larger than max-filesize: {size}")
+        self.size = size
+        self.approximate = approximate
+
+
+class SizeGuard:
+    # Прерывает скачивание, как только становится ясно, что файл не поместится в лимит.
+    # match_filter видит выбранные форматы до скачивания, progress hook - скачанные байты
+    # и прогноз размера текущей части; части "137+140" скачиваются по очереди
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._expected: dict[str, int] = {}
+        self._finished: dict[str, int] = {}
+
+    def match_filter(self, info: dict, incomplete: bool = False):
+        if incomplete:
+            return
+        for part in info.get("requested_formats") or [info]:
+            size, _ = DownloadUtils._estimate_size(part, info.get("duration"))
+            if size is not None and part.get("format_id"):
+                self._expected[part["format_id"]] = size
+        size, exact = DownloadUtils._estimate_size(info, info.get("duration"))
+        if size is not None and exact and size > self.max_size:
+            raise FileTooLarge(size, approximate=False)
+
+    def progress_hook(self, progress: dict) -> None:
+        format_id = progress.get("info_dict", {}).get("format_id")
+        downloaded = progress.get("downloaded_bytes") or 0
+        if progress["status"] == "finished":
+            self._finished[format_id] = progress.get("total_bytes") or downloaded
+            return
+        if progress["status"] != "downloading":
+            return
+        total = progress.get("total_bytes")
+        current = max(total or progress.get("total_bytes_estimate") or 0, downloaded)
+        done = sum(self._finished.values())
+        # Остальные части еще не начались - берем их оценку из выбранных форматов
+        remaining = sum(
+            size
+            for part_id, size in self._expected.items()
+            if part_id != format_id and part_id not in self._finished
+        )
+        if done + downloaded > self.max_size:
+            raise FileTooLarge(done + downloaded, approximate=False)
+        # Оценке по первым фрагментам верим, только когда скачано хотя бы немного
+        if done + current + remaining > self.max_size and (
+            total or downloaded >= _MIN_PROJECTION_BYTES
+        ):
+            raise FileTooLarge(
+                done + current + remaining, approximate=not total or remaining > 0
+            )
+
+
+def _get_downloaded_file(ydl, result: dict) -> tuple[str, dict]:
+    # Если Content-Length больше max_filesize, yt_dlp только пишет об этом в лог и
+    # возвращает info без файла, до progress hook дело не доходит
+    file_path = ydl.prepare_filename(result)
+    if not os.path.exists(file_path):
+        size = result.get("filesize") or result.get("filesize_approx")
+        raise FileTooLarge(size, approximate=not result.get("filesize"))
+    return file_path, result
+
+
+def run_download(job: dict, events) -> tuple[str, dict]:
+    # job: url, ydl_format, format_id, info, job_dir, max_size.
+    # events получает выбранный формат (on_selected), прогресс скачивания (progress_hook)
+    # и события постпроцессоров (postprocessor_hook). Возвращает (путь к файлу, info)
+    max_size = job["max_size"]
+    guard = SizeGuard(max_size)
+
+    def match_filter(info: dict, incomplete: bool = False):
+        guard.match_filter(info, incomplete)
+        if not incomplete:
+            events.on_selected(info)
+
+    ydl_opts = {
+        # Из подходящих форматов выбираем помещающиеся в лимит
+        "format": DownloadUtils._with_size_filter(job["ydl_format"], max_size),
+        "outtmpl": os.path.join(job["job_dir"], "%(title)s.%(ext)s"),
+        "quiet": False,
+        # Если размер известен заранее, yt_dlp даже не начнет скачивать слишком большой файл,
+        # а SizeGuard прерывает скачивание, как только прогноз размера превысит лимит
+        "max_filesize": max_size,
+        "match_filter": match_filter,
+        "progress_hooks": [guard.progress_hook, events.progress_hook],
+        "postprocessor_hooks": [events.postprocessor_hook],
+    }
+
+    # Бот уже выбрал форматы при проверке ссылки (с тем же фильтром по размеру) -
+    # скачиваем по ним без extract_info.
+    # Если ссылки на форматы устарели, делаем полную экстракцию
+    info = job.get("info")
+    format_id = job.get("format_id")
+    if info is not None and format_id:
+        try:
+            with yt_dlp.YoutubeDL({**ydl_opts, "format": format_id}) as ydl:
+                result = ydl.process_ie_result(copy.deepcopy(info), download=True)
+                return _get_downloaded_file(ydl, result)
+        except yt_dlp.utils.DownloadError as e:
+            print(f"Сохраненные форматы не подошли, повторяем extract_info: {e}")
+
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        result = ydl.extract_info(job["url"], download=True)
+        return _get_downloaded_file(ydl, result)
@@ -1,14 +1,48 @@
+from bot.supervisor import WorkerSupervisor, get_default_processes
 from bot.worker import DownloadWorker
+import bot.database_client
+import bot.telegram_api_client
 import asyncio
+import os
+import signal
+import sys
 
 
-async def main():
+async def run_worker():
     print("Starting download worker...")
     worker = DownloadWorker()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, worker.stop)
     try:
         await worker.start_consuming()
-    except KeyboardInterrupt:
-        print("\nWorker остановлен")
+    finally:
+        await bot.database_client.close_pool()
+        await bot.telegram_api_client.close_session()
+    print("Worker остановлен")
+
+
+async def run_supervisor(processes: int):
+    # Процессы воркера - этот же скрипт с WORKER_PROCESSES=1
+    supervisor = WorkerSupervisor(
+        [sys.executable, os.path.abspath(__file__)],
+        processes,
+        drain_timeout=float(os.getenv("WORKER_DRAIN_TIMEOUT", "300")),
+    )
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, supervisor.stop)
+    await supervisor.run()
+
+
+async def main():
+    # WORKER_PROCESSES: сколько процессов воркера запускать (по умолчанию - по числу ядер),
+    # 1 - воркер в этом процессе без супервизора
+    processes = int(os.getenv("WORKER_PROCESSES", "0")) or get_default_processes()
+    if processes == 1:
+        await run_worker()
+    else:
+        await run_supervisor(processes)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,8 @@
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def download_in_thread(monkeypatch):
+    # Тесты подменяют yt_dlp в своем процессе, поэтому воркер скачивает в потоке,
+    # а не в дочернем процессе (WORKER_DOWNLOAD_MODE=process по умолчанию)
+    monkeypatch.setenv("WORKER_DOWNLOAD_MODE", "thread")
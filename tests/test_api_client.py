@@ -0,0 +1,137 @@
+from aiohttp import web
+from bot import telegram_api_client
+import pytest
+
+
+async def start_fake_bot_api(handler) -> tuple[web.AppRunner, int]:
+    app = web.Application(client_max_size=16 * 1024 * 1024)
+    app.router.add_post("/{token}/{method}", handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    return runner, site._server.sockets[0].getsockname()[1]
+
+
+@pytest.mark.asyncio
+async def test_make_request_reuses_session(monkeypatch):
+    peers = set()
+
+    async def fake_bot_api(request: web.Request) -> web.Response:
+        assert request.match_info["method"] == "sendMessage"
+        peers.add(request.transport.get_extra_info("peername"))
+        return web.json_response({"ok": True, "result": {"message_id": 1}})
+
+    runner, port = await start_fake_bot_api(fake_bot_api)
+    monkeypatch.setenv("TELEGRAM_API_URL", f"http://127.0.0.1:{port}")
+    monkeypatch.setenv("TELEGRAM_TOKEN", "test")
+    try:
+        session = await telegram_api_client.get_session()
+        for _ in range(3):
+            result = await telegram_api_client.send_message(chat_id=1, text="test")
+            assert result == {"message_id": 1}
+        assert await telegram_api_client.get_session() is session
+        assert len(peers) == 1
+    finally:
+        await telegram_api_client.close_session()
+        await runner.cleanup()
+
+    assert session.closed
+    assert telegram_api_client._session is None
+
+
+@pytest.mark.asyncio
+async def test_send_document_streams_file_in_chunks(monkeypatch, tmp_path):
+    content = bytes(range(256)) * 4096
+    document_path = tmp_path / "video.mp4"
+    document_path.write_bytes(content)
+    received = {}
+
+    async def fake_bot_api(request: web.Request) -> web.Response:
+        assert request.match_info["method"] == "sendDocument"
+        received["content_length"] = request.headers.get("Content-Length")
+        form = await request.post()
+        received["document"] = form["document"].file.read()
+        received["filename"] = form["document"].filename
+        received["chat_id"] = form["chat_id"]
+        return web.json_response({"ok": True, "result": {"message_id": 1}})
+
+    progress = []
+
+    def on_progress(sent: int, total: int) -> None:
+        progress.append((sent, total))
+
+    runner, port = await start_fake_bot_api(fake_bot_api)
+    monkeypatch.setenv("TELEGRAM_API_URL", f"http://127.0.0.1:{port}")
+    monkeypatch.setenv("TELEGRAM_TOKEN", "test")
+    monkeypatch.setenv("TELEGRAM_UPLOAD_CHUNK_SIZE", str(64 * 1024))
+    try:
+        result = await telegram_api_client.send_document(
+            12345, str(document_path), "Test", progress_callback=on_progress
+        )
+    finally:
+        await telegram_api_client.close_session()
+        await runner.cleanup()
+
+    assert result
+    assert received["document"] == content
+    assert received["filename"] == "video.mp4"
+    assert received["chat_id"] == "12345"
+    assert received["content_length"] is not None
+    assert len(progress) == len(content) // (64 * 1024)
+    assert progress[-1] == (len(content), len(content))
+
+
+@pytest.mark.asyncio
+async def test_make_request_retries_after_flood_limit(monkeypatch):
+    calls = 0
+
+    async def fake_bot_api(request: web.Request) -> web.Response:
+        nonlocal calls
+        calls += 1
+        if calls == 1:
+            return web.json_response(
+                {
+                    "ok": False,
+                    "error_code": 429,
+                    "description": "Too Many Requests: retry after 0.1",
+                    "parameters": {"retry_after": 0.1},
+                }
+            )
+        return web.json_response({"ok": True, "result": {"message_id": 2}})
+
+    runner, port = await start_fake_bot_api(fake_bot_api)
+    monkeypatch.setenv("TELEGRAM_API_URL", f"http://127.0.0.1:{port}")
+    monkeypatch.setenv("TELEGRAM_TOKEN", "test")
+    limiter = telegram_api_client.get_rate_limiter()
+    throttled = limiter.throttled
+    try:
+        result = await telegram_api_client.send_message(chat_id=777, text="test")
+    finally:
+        await telegram_api_client.close_session()
+        await runner.cleanup()
+
+    assert result == {"message_id": 2}
+    assert calls == 2
+    assert limiter.throttled == throttled + 1
+    assert limiter.queue_delay.max >= 0.1
+
+
+@pytest.mark.asyncio
+async def test_make_request_raises_telegram_error(monkeypatch):
+    async def fake_bot_api(request: web.Request) -> web.Response:
+        return web.json_response(
+            {"ok": False, "error_code": 400, "description": "Bad Request"}
+        )
+
+    runner, port = await start_fake_bot_api(fake_bot_api)
+    monkeypatch.setenv("TELEGRAM_API_URL", f"http://127.0.0.1:{port}")
+    monkeypatch.setenv("TELEGRAM_TOKEN", "test")
+    try:
+        with pytest.raises(telegram_api_client.TelegramAPIError) as error:
+            await telegram_api_client.send_message(chat_id=778, text="test")
+    finally:
+        await telegram_api_client.close_session()
+        await runner.cleanup()
+
+    assert error.value.error_code == 400
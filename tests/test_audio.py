@@ -44,7 +44,7 @@ async def test_type_handler_can_handle_unsuccess_execution():
         },
     }
 
-    async def get_user(telegram_id: int) -> dict:
+    async def ensure_user(telegram_id: int) -> dict:
         assert telegram_id == 12345
         return {
             "state": STATE.WAIT_FOR_ID.value,
@@ -53,7 +53,7 @@ async def test_type_handler_can_handle_unsuccess_execution():
             "video_type": "",
         }
 
-    bot.database_client = Mock({"get_user": get_user})
+    bot.database_client = Mock({"ensure_user": ensure_user})
 
     type_handler = DownloadHandler()
     result = type_handler.can_handle(test_update, STATE.WAIT_FOR_AUDIO)
@@ -77,42 +77,40 @@ async def test_download_handler_handle_success_execution():
         },
     }
 
-    update_user_video_type_called = False
-    update_user_state_called = False
-    get_user_called = False
+    ensure_user_called = False
+    update_user_called = False
     delete_message_called = False
     answer_callback_query_called = False
     send_message_called = False
 
-    type_set = ""
-    state_set = None
+    fields_set = {}
     chat_id_deleted = 0
     message_id_deleted = 0
     callback_id = ""
     message_text = ""
 
-    async def get_user(telegram_id: int) -> dict:
-        nonlocal get_user_called
-        get_user_called = True
+    async def ensure_user(telegram_id: int) -> dict:
+        nonlocal ensure_user_called
+        ensure_user_called = True
         assert telegram_id == 12345
         return {
             "state": STATE.WAIT_FOR_RESOLUTION.value,
             "url": "https://vkvideo.ru/video837424820_456239073",
             "video_res": "720p",
-            "video_type": "video_with_audio",
+            "video_type": "",
         }
 
-    async def update_user_video_type(telegram_id: int, video_type: str) -> None:
-        nonlocal update_user_video_type_called, type_set
-        update_user_video_type_called = True
-        assert telegram_id == 12345
-        type_set = video_type
-
-    async def update_user_state(telegram_id: int, state: STATE) -> None:
-        nonlocal update_user_state_called, state_set
-        update_user_state_called = True
+    async def update_user(telegram_id: int, **fields) -> dict:
+        nonlocal update_user_called, fields_set
+        update_user_called = True
         assert telegram_id == 12345
-        state_set = state
+        fields_set = fields
+        return {
+            "state": fields["state"].value,
+            "url": "https://vkvideo.ru/video837424820_456239073",
+            "video_res": "720p",
+            "video_type": fields["video_type"],
+        }
 
     async def delete_message(chat_id: int, message_id: int) -> dict:
         nonlocal delete_message_called, chat_id_deleted, message_id_deleted
@@ -136,11 +134,14 @@ async def test_download_handler_handle_success_execution():
     async def send_to_rabbitmq(task):
         return None
 
+    async def get_cached_file(video_key: str, ydl_format: str) -> None:
+        return None
+
     bot.database_client = Mock(
         {
-            "get_user": get_user,
-            "update_user_video_type": update_user_video_type,
-            "update_user_state": update_user_state,
+            "ensure_user": ensure_user,
+            "update_user": update_user,
+            "get_cached_file": get_cached_file,
         }
     )
     bot.telegram_api_client = Mock(
@@ -161,13 +162,13 @@ async def test_download_handler_handle_success_execution():
 
     assert result == STATUS.STOP
 
-    assert update_user_video_type_called
-    assert type_set == "video_with_audio"
-
-    assert update_user_state_called
-    assert state_set == STATE.WAIT_FOR_START_DOWNLOADING
+    assert update_user_called
+    assert fields_set == {
+        "video_type": "video_with_audio",
+        "state": STATE.WAIT_FOR_START_DOWNLOADING,
+    }
 
-    assert get_user_called
+    assert ensure_user_called
     assert delete_message_called
     assert chat_id_deleted == 12345
     assert message_id_deleted == 1
@@ -0,0 +1,110 @@
+from bot.dispatcher import Dispatcher
+from bot.handlers.handler import Handler
+from bot.types import STATE, STATUS
+import bot
+import pytest
+
+from tests.mocks import Mock
+
+
+class RecordingHandler(Handler):
+    def __init__(self, name: str, calls: list, status: STATUS = STATUS.STOP):
+        self.name = name
+        self.calls = calls
+        self.status = status
+
+    def can_handle(self, update: dict, state: STATE) -> bool:
+        self.calls.append(f"can_handle:{self.name}")
+        return True
+
+    async def handle(self, update: dict, state: STATE) -> STATUS:
+        self.calls.append(f"handle:{self.name}")
+        return self.status
+
+
+def make_handler(name, calls, status=STATUS.STOP, **attributes) -> Handler:
+    handler_class = type(name, (RecordingHandler,), attributes)
+    return handler_class(name, calls, status)
+
+
+def callback_update(data: str) -> dict:
+    return {
+        "update_id": 1,
+        "callback_query": {
+            "id": "callback123",
+            "from": {"id": 12345},
+            "data": data,
+            "message": {"chat": {"id": 12345}, "message_id": 1},
+        },
+    }
+
+
+@pytest.mark.asyncio
+async def test_dispatcher_routes_by_kind_state_and_prefix():
+    calls = []
+
+    async def ensure_user(telegram_id: int) -> dict:
+        return {"state": STATE.WAIT_FOR_AUDIO.value}
+
+    bot.database_client = Mock({"ensure_user": ensure_user})
+
+    dispatcher = Dispatcher()
+    dispatcher.add_handlers(
+        make_handler("Logger", calls, STATUS.CONTINUE, middleware=True),
+        make_handler("Start", calls, update_kind="message"),
+        make_handler(
+            "Res",
+            calls,
+            update_kind="callback_query",
+            states=(STATE.WAIT_FOR_RESOLUTION,),
+            callback_prefix="res_",
+        ),
+        make_handler(
+            "Type",
+            calls,
+            update_kind="callback_query",
+            states=(STATE.WAIT_FOR_AUDIO,),
+            callback_prefix="type_",
+        ),
+    )
+
+    await dispatcher.dispatch(callback_update("type_only_audio"))
+
+    # Остальные хэндлеры даже не проверяются через can_handle
+    assert calls == [
+        "can_handle:Logger",
+        "handle:Logger",
+        "can_handle:Type",
+        "handle:Type",
+    ]
+    stats = dispatcher.get_handler_stats()
+    assert stats["Type"]["count"] == 1
+    assert stats["Res"]["count"] == 0
+
+
+@pytest.mark.asyncio
+async def test_dispatcher_keeps_registration_order_for_generic_handlers():
+    calls = []
+
+    async def ensure_user(telegram_id: int) -> dict:
+        return {"state": STATE.WAIT_FOR_ID.value}
+
+    bot.database_client = Mock({"ensure_user": ensure_user})
+
+    dispatcher = Dispatcher()
+    dispatcher.add_handlers(
+        make_handler("First", calls, STATUS.CONTINUE),
+        make_handler("Url", calls, update_kind="message", states=(STATE.WAIT_FOR_ID,)),
+        make_handler("Last", calls),
+    )
+
+    await dispatcher.dispatch(
+        {"update_id": 1, "message": {"from": {"id": 12345}, "text": "text"}}
+    )
+
+    assert calls == [
+        "can_handle:First",
+        "handle:First",
+        "can_handle:Url",
+        "handle:Url",
+    ]
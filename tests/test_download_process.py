@@ -0,0 +1,149 @@
+import subprocess
+import sys
+import threading
+import time
+import pytest
+import yt_dlp
+from bot.download_process import ChildProcesses, DownloadProcess, DownloadProcessError
+from bot.yt_download import FileTooLarge
+
+# Процесс-помощник для тестов: вместо yt_dlp отвечает событиями из задания.
+# После события postprocessor started ждет от воркера строку continue
+FAKE_CHILD_CODE = """\
+import json, sys, time
+job = json.loads(sys.stdin.readline())
+for message in job['events']:
+    if message == 'hang':
+        time.sleep(30)
+    print(json.dumps(message), flush=True)
+    if message.get('progress', {}).get('status') == 'started':
+        assert sys.stdin.readline() == 'continue\\n'
+"""
+FAKE_CHILD = [sys.executable, "-c", FAKE_CHILD_CODE]
+
+
+def _processes(spare: int = 0) -> ChildProcesses:
+    return ChildProcesses(FAKE_CHILD, spare=spare)
+
+
+class RecordingEvents:
+    def __init__(self):
+        self.calls = []
+
+    def on_selected(self, info: dict) -> None:
+        self.calls.append(("selected", info))
+
+    def progress_hook(self, progress: dict) -> None:
+        self.calls.append(("progress", progress["downloaded_bytes"]))
+
+    def postprocessor_hook(self, progress: dict) -> None:
+        self.calls.append((progress["status"], progress["postprocessor"]))
+
+
+def test_download_process_passes_events_and_result():
+    info = {"protocol": "https", "requested_formats": False}
+    events = [
+        {"event": "selected", "info": info},
+        {
+            "event": "progress",
+            "progress": {"status": "downloading", "downloaded_bytes": 10},
+        },
+        {
+            "event": "postprocessor",
+            "progress": {"status": "started", "postprocessor": "Merger"},
+        },
+        {
+            "event": "postprocessor",
+            "progress": {"status": "finished", "postprocessor": "Merger"},
+        },
+        {
+            "event": "result",
+            "file_path": "videos/Test.mp4",
+            "result": {"title": "Test"},
+        },
+    ]
+    recorder = RecordingEvents()
+    process = DownloadProcess({"events": events}, _processes())
+
+    assert process.run(recorder) == ("videos/Test.mp4", {"title": "Test"})
+    assert recorder.calls == [
+        ("selected", info),
+        ("progress", 10),
+        ("started", "Merger"),
+        ("finished", "Merger"),
+    ]
+
+
+def test_download_process_raises_child_errors():
+    too_large = {
+        "event": "error",
+        "kind": "too_large",
+        "size": 100,
+        "approximate": True,
+    }
+    with pytest.raises(FileTooLarge) as error:
+        DownloadProcess({"events": [too_large]}, _processes()).run(RecordingEvents())
+    assert error.value.size == 100
+    assert error.value.approximate
+
+    failed = {"event": "error", "kind": "download_error", "message": "HTTP 403"}
+    with pytest.raises(yt_dlp.utils.DownloadError, match="HTTP 403"):
+        DownloadProcess({"events": [failed]}, _processes()).run(RecordingEvents())
+
+    # Процесс завершился, не сообщив результат
+    with pytest.raises(DownloadProcessError):
+        DownloadProcess({"events": []}, _processes()).run(RecordingEvents())
+
+
+def test_download_process_kill_stops_hung_download():
+    process = DownloadProcess({"events": ["hang"]}, _processes())
+    errors = []
+
+    def run():
+        try:
+            process.run(RecordingEvents())
+        except DownloadProcessError as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    time.sleep(0.2)
+    started = time.monotonic()
+    process.kill()
+    thread.join(5)
+
+    assert not thread.is_alive()
+    assert time.monotonic() - started < 2
+    assert len(errors) == 1
+    # Убитый процесс не запускается заново
+    with pytest.raises(DownloadProcessError):
+        process.run(RecordingEvents())
+
+
+def test_spare_process_is_reused():
+    processes = _processes(spare=1)
+    processes.warm_up()
+    result = {"event": "result", "file_path": "Test.mp4", "result": {}}
+    for _ in range(2):
+        assert DownloadProcess({"events": [result]}, processes).run(
+            RecordingEvents()
+        ) == ("Test.mp4", {})
+
+    # Оба задания взяли заранее запущенный процесс, после каждого запущен новый запасной
+    assert processes.get_stats() == {"started": 3, "spare_hits": 2}
+    processes.close()
+
+
+def test_spare_child_exits_quietly_when_stdin_closes():
+    # Воркер остановился, пока настоящий процесс скачивания ждал задание
+    child = subprocess.run(
+        [sys.executable, "-m", "bot.download_child"],
+        input="",
+        capture_output=True,
+        text=True,
+        timeout=60,
+    )
+
+    assert child.returncode == 0
+    assert "Traceback" not in child.stderr
+    assert child.stdout == ""
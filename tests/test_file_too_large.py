@@ -0,0 +1,50 @@
+import asyncio
+import pytest
+from aiohttp import web
+from bot.worker import _too_large_message
+from bot.yt_download import FileTooLarge, run_download
+
+MB = 1024 * 1024
+
+
+class NoEvents:
+    def on_selected(self, info: dict) -> None:
+        pass
+
+    def progress_hook(self, progress: dict) -> None:
+        pass
+
+    def postprocessor_hook(self, progress: dict) -> None:
+        pass
+
+
+@pytest.mark.asyncio
+async def test_file_skipped_by_content_length_is_too_large(tmp_path):
+    # Прямая ссылка: yt_dlp сам отказывается от файла по Content-Length
+    # еще до первого progress hook
+    async def video(request: web.Request) -> web.Response:
+        return web.Response(body=b"x" * 3 * MB, content_type="video/mp4")
+
+    app = web.Application()
+    app.router.add_get("/video.mp4", video)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    job = {
+        "url": f"http://127.0.0.1:{port}/video.mp4",
+        "ydl_format": "best",
+        "job_dir": str(tmp_path),
+        "max_size": MB,
+    }
+    try:
+        with pytest.raises(FileTooLarge) as error:
+            await asyncio.to_thread(run_download, job, NoEvents())
+    finally:
+        await runner.cleanup()
+
+    assert error.value.size is None
+    assert _too_large_message(None, MB, approximate=True).startswith(
+        "Файл слишком большой: больше 1Mb"
+    )
@@ -0,0 +1,89 @@
+import asyncio
+import os
+import threading
+import time
+import pytest
+from bot.streaming_upload import GrowingFileStream, StreamAborted
+
+SIZE = 100_000
+
+
+def _write_in_thread(stream: GrowingFileStream, path: str, data: bytes, finish):
+    # Имитирует HTTP-загрузчик yt_dlp: пишет .part кусками и вызывает хуки
+    def run():
+        stream.on_selected({"protocol": "https", "title": "Test"})
+        with open(path + ".part", "wb") as file:
+            for start in range(0, len(data), 10_000):
+                file.write(data[start : start + 10_000])
+                file.flush()
+                stream.progress_hook(
+                    {
+                        "status": "downloading",
+                        "downloaded_bytes": start + 10_000,
+                        "total_bytes": len(data),
+                        "tmpfilename": path + ".part",
+                        "filename": path,
+                        "info_dict": {"title": "Test"},
+                    }
+                )
+                time.sleep(0.01)
+        os.rename(path + ".part", path)
+        finish()
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+
+async def _read_all(stream: GrowingFileStream) -> bytes:
+    assert await stream.wait_ready()
+    return b"".join([chunk async for chunk in stream.chunks()])
+
+
+@pytest.mark.asyncio
+async def test_stream_reads_file_while_it_is_written(tmp_path):
+    loop = asyncio.get_running_loop()
+    stream = GrowingFileStream(loop, chunk_size=4096)
+    path = str(tmp_path / "video.mp4")
+    data = os.urandom(SIZE)
+    downloaded = asyncio.Event()
+
+    reader = asyncio.create_task(_read_all(stream))
+    thread = _write_in_thread(
+        stream, path, data, lambda: loop.call_soon_threadsafe(downloaded.set)
+    )
+    await downloaded.wait()
+    thread.join()
+
+    # Последний байт ждет подтверждения, что файл скачан целиком
+    await asyncio.sleep(0.05)
+    assert not reader.done()
+    stream.complete(path)
+
+    assert await reader == data
+    assert stream.size == SIZE
+    assert stream.filename == "video.mp4"
+    assert stream.title == "Test"
+
+
+@pytest.mark.asyncio
+async def test_stream_aborted_by_postprocessor(tmp_path):
+    loop = asyncio.get_running_loop()
+    stream = GrowingFileStream(loop, chunk_size=4096)
+    path = str(tmp_path / "video.m4a")
+
+    def finish():
+        stream.postprocessor_hook({"status": "started", "postprocessor": "FixupM4a"})
+
+    reader = asyncio.create_task(_read_all(stream))
+    _write_in_thread(stream, path, os.urandom(SIZE), finish).join()
+
+    with pytest.raises(StreamAborted):
+        await reader
+
+
+@pytest.mark.asyncio
+async def test_stream_not_used_for_merged_formats():
+    stream = GrowingFileStream(asyncio.get_running_loop(), chunk_size=4096)
+    stream.on_selected({"requested_formats": [{}, {}], "protocol": "https+https"})
+    assert not await stream.wait_ready()
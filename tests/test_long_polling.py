@@ -0,0 +1,57 @@
+from bot.dispatcher import Dispatcher
+from bot.long_polling import start_long_polling, get_polling_stats
+import bot
+import pytest
+
+from tests.mocks import Mock
+
+
+class StopPolling(Exception):
+    pass
+
+
+@pytest.mark.asyncio
+async def test_long_polling_uses_server_timeout(monkeypatch):
+    monkeypatch.setenv("TELEGRAM_POLL_TIMEOUT", "25")
+    monkeypatch.setenv("TELEGRAM_POLL_LIMIT", "50")
+    test_update = {
+        "update_id": 10,
+        "message": {"from": {"id": 12345}, "chat": {"id": 12345}, "text": "/start"},
+    }
+    requests = []
+    dispatched = []
+
+    async def get_updates(**kwargs) -> list:
+        # Как Telegram: отдает все updates, которые еще не подтверждены offset'ом
+        requests.append(kwargs)
+        if len(requests) > 3:
+            raise StopPolling()
+        return [test_update] if kwargs["offset"] <= test_update["update_id"] else []
+
+    class FakeDispatcher(Dispatcher):
+        async def dispatch(self, update: dict) -> None:
+            dispatched.append(update)
+
+    async def delete_webhook() -> bool:
+        return True
+
+    bot.telegram_api_client = Mock(
+        {"get_updates": get_updates, "delete_webhook": delete_webhook}
+    )
+    stats_before = get_polling_stats()
+
+    with pytest.raises(StopPolling):
+        await start_long_polling(FakeDispatcher())
+
+    assert dispatched == [test_update]
+    assert requests[0] == {
+        "offset": 0,
+        "timeout": 25,
+        "limit": 50,
+        "allowed_updates": ["message", "callback_query"],
+    }
+    assert requests[-1]["offset"] == 11
+
+    stats = get_polling_stats()
+    assert stats["polls"] == stats_before["polls"] + 3
+    assert stats["empty_polls"] >= stats_before["empty_polls"] + 1
@@ -0,0 +1,122 @@
+import os
+import aiofiles
+import pytest
+import yt_dlp
+import bot
+import bot.media_cache
+from bot.media_cache import MediaCache
+from bot.worker import DownloadWorker
+from tests.mocks import Mock
+
+
+def _write(path, size: int) -> str:
+    with open(path, "wb") as file:
+        file.write(b"x" * size)
+    return str(path)
+
+
+def test_media_cache_put_and_get(tmp_path):
+    cache = MediaCache(str(tmp_path / "cache"), max_bytes=1024)
+    job_dir = tmp_path / "job"
+    job_dir.mkdir()
+
+    assert cache.get("youtube:abc", "best", str(job_dir)) is None
+
+    source = _write(tmp_path / "Video.mp4", 100)
+    cache.put("youtube:abc", "best", source, "Video")
+    os.remove(source)
+
+    path, title = cache.get("youtube:abc", "best", str(job_dir))
+    assert path == str(job_dir / "Video.mp4")
+    assert title == "Video"
+    assert os.path.getsize(path) == 100
+    # Другой формат того же видео - другой файл
+    assert cache.get("youtube:abc", "worst", str(tmp_path)) is None
+    assert not [name for name in os.listdir(cache.directory) if name.endswith(".tmp")]
+
+    stats = cache.get_stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 2
+    assert stats["bytes_saved"] == 100
+
+
+def test_media_cache_evicts_least_recently_used(tmp_path):
+    cache = MediaCache(str(tmp_path / "cache"), max_bytes=250)
+    job_dir = tmp_path / "job"
+    job_dir.mkdir()
+
+    for number, key in enumerate(("a", "b")):
+        cache.put(key, "best", _write(tmp_path / f"{key}.mp4", 100), key)
+        os.utime(cache._path(key, "best"), (number, number))
+    # "a" старше, но его только что использовали - вытесняется "b"
+    cache.get("a", "best", str(job_dir))
+    cache.put("c", "best", _write(tmp_path / "c.mp4", 100), "c")
+
+    assert cache.get("b", "best", str(tmp_path)) is None
+    assert cache.get("c", "best", str(job_dir)) is not None
+    assert cache.get_stats()["evictions"] == 1
+    # Файл больше всего бюджета в кэш не попадает
+    cache.put("d", "best", _write(tmp_path / "d.mp4", 300), "d")
+    assert cache.get("d", "best", str(tmp_path)) is None
+
+
+@pytest.mark.asyncio
+async def test_worker_media_cache_hit_skips_yt_dlp(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(bot.media_cache, "_media_cache", None)
+    downloads = []
+    sent = []
+
+    class MockYoutubeDL:
+        def __init__(self, opts):
+            self.opts = opts
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, exc_type, exc_val, exc_tb):
+            pass
+
+        def extract_info(self, url, download=True):
+            downloads.append(url)
+            _write(os.path.join(os.path.dirname(self.opts["outtmpl"]), "Test.mp4"), 10)
+            return {"title": "Test", "ext": "mp4"}
+
+        def prepare_filename(self, info):
+            return os.path.join(os.path.dirname(self.opts["outtmpl"]), "Test.mp4")
+
+    async def noop(*args, **kwargs):
+        return None
+
+    async def claim_download(*args) -> bool:
+        return True
+
+    async def finish_download(*args, **kwargs) -> list:
+        return []
+
+    async def send_document(chat_id: int, file_path: str, title: str) -> dict:
+        async with aiofiles.open(file_path, "rb") as file:
+            sent.append((chat_id, len(await file.read()), title))
+        return {}
+
+    bot.database_client = Mock(
+        {
+            "get_cached_file": noop,
+            "claim_download": claim_download,
+            "finish_download": finish_download,
+        }
+    )
+    bot.telegram_api_client = Mock({"send_document": send_document})
+    monkeypatch.setattr(yt_dlp, "YoutubeDL", MockYoutubeDL)
+
+    worker = DownloadWorker()
+    for chat_id in (1, 2):
+        await worker._download_and_send_file(
+            chat_id, chat_id, "https://example.com/video", "best", "key"
+        )
+
+    assert len(downloads) == 1
+    assert sent == [(1, 10, "Test"), (2, 10, "Test")]
+    assert worker.get_stats()["media_cache"]["hits"] == 1
+    # Папки заданий удалены, в videos остался только кэш
+    assert os.listdir("videos") == ["cache"]
@@ -31,7 +31,7 @@ async def test_message_start_handler():
     clear_user_video_and_set_state_called = False
     send_message_called = False
 
-    async def get_user(telegram_id: int) -> dict | None:
+    async def ensure_user(telegram_id: int) -> dict | None:
         assert telegram_id == 12345
         return {"state": None, "url": "", "video_res": "", "video_type": ""}
 
@@ -49,7 +49,7 @@ async def test_message_start_handler():
 
     mock_database_client = Mock(
         {
-            "get_user": get_user,
+            "ensure_user": ensure_user,
             "clear_user_video_and_set_state": clear_user_video_and_set_state,
         }
     )
@@ -0,0 +1,86 @@
+from bot.probe_executor import ProbeExecutor
+import asyncio
+import sys
+import threading
+import time
+import pytest
+
+# Процесс-помощник для тестов: спит столько секунд, сколько пришло в запросе
+SLEEPER_CODE = """\
+import json, sys, time
+for line in sys.stdin:
+    time.sleep(float(json.loads(line)))
+    print(json.dumps({'slept': json.loads(line)}), flush=True)
+"""
+SLEEPER = [sys.executable, "-c", SLEEPER_CODE]
+
+
+@pytest.mark.asyncio
+async def test_thread_executor_limits_concurrency():
+    running = 0
+    max_running = 0
+    lock = threading.Lock()
+
+    def probe(url: str) -> dict:
+        nonlocal running, max_running
+        with lock:
+            running += 1
+            max_running = max(max_running, running)
+        time.sleep(0.05)
+        with lock:
+            running -= 1
+        return {"url": url}
+
+    executor = ProbeExecutor(probe, mode="thread", max_workers=2, timeout=5)
+    tasks = [asyncio.create_task(executor.run(str(number))) for number in range(6)]
+    await asyncio.sleep(0.01)
+    assert executor.get_stats()["queued"] == 4
+
+    results = await asyncio.gather(*tasks)
+    assert [result["url"] for result in results] == [str(n) for n in range(6)]
+    assert max_running == 2
+    assert executor.get_stats()["probe_time"]["count"] == 6
+    await executor.close()
+
+
+@pytest.mark.asyncio
+async def test_thread_executor_times_out():
+    release = threading.Event()
+
+    def probe(url: str) -> dict:
+        release.wait(5)
+        return {}
+
+    executor = ProbeExecutor(probe, mode="thread", max_workers=1, timeout=0.05)
+    with pytest.raises(asyncio.TimeoutError):
+        await executor.run("hung")
+    assert executor.get_stats()["timeouts"] == 1
+
+    # Зависший поток держит слот, пока не закончит работу
+    assert executor.get_stats()["running"] == 1
+    release.set()
+    await asyncio.sleep(0.05)
+    assert executor.get_stats()["running"] == 0
+    await executor.close()
+
+
+@pytest.mark.asyncio
+async def test_process_executor_kills_hung_probe():
+    executor = ProbeExecutor(
+        None, mode="process", max_workers=1, timeout=1, command=SLEEPER
+    )
+    assert await executor.run("0") == {"slept": "0"}
+    process = executor._idle_processes[0]
+
+    started = time.monotonic()
+    with pytest.raises(asyncio.TimeoutError):
+        await executor.run("30")
+    assert time.monotonic() - started < 2
+    await process.wait()
+    stats = executor.get_stats()
+    assert stats["killed"] == 1
+    assert stats["timeouts"] == 1
+
+    # Вместо убитого процесса запускается новый
+    assert await executor.run("0") == {"slept": "0"}
+    await executor.close()
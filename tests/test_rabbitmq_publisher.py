@@ -0,0 +1,129 @@
+import asyncio
+import json
+import aio_pika
+import pytest
+from bot.rabbitmq_publisher import RabbitMQPublisher
+
+
+class FakeExchange:
+    def __init__(self, broker):
+        self.broker = broker
+
+    async def publish(self, message, routing_key, timeout=None):
+        if self.broker.failures:
+            self.broker.failures -= 1
+            raise aio_pika.exceptions.ChannelInvalidStateError("channel closed")
+        # Брокер подтверждает одновременно отправленные сообщения одной пачкой
+        self.broker.in_flight += 1
+        self.broker.max_in_flight = max(
+            self.broker.max_in_flight, self.broker.in_flight
+        )
+        await asyncio.sleep(0.01)
+        self.broker.in_flight -= 1
+        self.broker.queues.setdefault(routing_key, []).append(json.loads(message.body))
+
+
+class FakeChannel:
+    def __init__(self, broker):
+        self.is_closed = False
+        self.default_exchange = FakeExchange(broker)
+        self.broker = broker
+
+    async def declare_queue(self, name, durable=False):
+        self.broker.declared.append((name, durable))
+
+
+class FakeConnection:
+    def __init__(self, broker):
+        self.broker = broker
+        self.is_closed = False
+        self.reconnect_callbacks = set()
+
+    async def channel(self, publisher_confirms=True):
+        assert publisher_confirms
+        channel = FakeChannel(self.broker)
+        self.broker.channels.append(channel)
+        return channel
+
+    async def close(self):
+        self.is_closed = True
+
+
+class FakeBroker:
+    def __init__(self):
+        self.connections = 0
+        self.channels = []
+        self.declared = []
+        self.queues = {}
+        self.failures = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def connect_robust(self, host=None):
+        self.connections += 1
+        return FakeConnection(self)
+
+
+def _publisher(monkeypatch, broker: FakeBroker) -> RabbitMQPublisher:
+    monkeypatch.setattr(aio_pika, "connect_robust", broker.connect_robust)
+    return RabbitMQPublisher(
+        "rabbitmq",
+        ["downloads", "downloads.fast"],
+        channels=2,
+        timeout=5,
+        max_retries=2,
+    )
+
+
+@pytest.mark.asyncio
+async def test_publisher_reuses_connection_and_channels(monkeypatch):
+    broker = FakeBroker()
+    publisher = _publisher(monkeypatch, broker)
+
+    for number in range(5):
+        await publisher.publish({"chat_id": number}, "downloads")
+    await publisher.publish_many(
+        [{"chat_id": number} for number in range(5, 10)], "downloads"
+    )
+    await publisher.publish({"chat_id": 10}, "downloads.fast")
+
+    assert broker.connections == 1
+    assert len(broker.channels) == 2
+    assert (
+        broker.declared
+        == [
+            ("downloads", True),
+            ("downloads.fast", True),
+        ]
+        * 2
+    )
+    assert [task["chat_id"] for task in broker.queues["downloads"]] == list(range(10))
+    # Пачка отправляется, не дожидаясь подтверждения каждого сообщения
+    assert broker.max_in_flight == 5
+    stats = publisher.get_stats()
+    assert broker.queues["downloads.fast"] == [{"chat_id": 10}]
+    assert stats["published"] == 11
+    assert stats["publish_time"]["count"] == 7
+    await publisher.close()
+
+
+@pytest.mark.asyncio
+async def test_publisher_retries_on_closed_channel(monkeypatch):
+    broker = FakeBroker()
+    publisher = _publisher(monkeypatch, broker)
+    await publisher.publish({"chat_id": 1}, "downloads")
+
+    # Брокер закрыл канал: он заменяется новым, а сообщение отправляется повторно
+    broker.channels[1].is_closed = True
+    broker.failures = 1
+    await publisher.publish({"chat_id": 2}, "downloads")
+
+    assert broker.connections == 1
+    assert len(broker.channels) == 3
+    assert [task["chat_id"] for task in broker.queues["downloads"]] == [1, 2]
+    assert publisher.get_stats()["retries"] == 1
+
+    broker.failures = 3
+    with pytest.raises(aio_pika.exceptions.ChannelInvalidStateError):
+        await publisher.publish({"chat_id": 3}, "downloads")
+    assert publisher.get_stats()["failed"] == 1
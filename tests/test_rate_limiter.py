@@ -0,0 +1,62 @@
+from bot.rate_limiter import RateLimiter, TokenBucket
+import asyncio
+import time
+import pytest
+
+
+def test_token_bucket_allows_burst_then_queues():
+    bucket = TokenBucket(rate=10, capacity=2)
+
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == pytest.approx(0.1, abs=0.01)
+    assert bucket.reserve() == pytest.approx(0.2, abs=0.01)
+
+
+def test_token_bucket_pause():
+    bucket = TokenBucket(rate=10, capacity=2)
+    bucket.pause(1)
+
+    assert bucket.reserve() == pytest.approx(1, abs=0.01)
+
+
+@pytest.mark.asyncio
+async def test_rate_limiter_limits_chat_but_not_other_chats():
+    limiter = RateLimiter(global_rate=100, global_burst=100, chat_rate=5, chat_burst=1)
+
+    started = time.monotonic()
+    await asyncio.gather(limiter.acquire(1), limiter.acquire(2), limiter.acquire(3))
+    assert time.monotonic() - started < 0.05
+
+    started = time.monotonic()
+    await asyncio.gather(limiter.acquire(1), limiter.acquire(1))
+    assert time.monotonic() - started >= 0.3
+
+    stats = limiter.get_stats()
+    assert stats["queue_delay"]["count"] == 5
+    assert stats["queue_delay"]["max"] >= 0.3
+    assert stats["chats"] == 3
+
+
+@pytest.mark.asyncio
+async def test_rate_limiter_global_limit():
+    limiter = RateLimiter(global_rate=20, global_burst=1, chat_rate=100, chat_burst=100)
+
+    started = time.monotonic()
+    await asyncio.gather(*(limiter.acquire(chat_id) for chat_id in range(5)))
+    assert time.monotonic() - started >= 0.19
+
+
+@pytest.mark.asyncio
+async def test_rate_limiter_retry_after_pauses_only_that_chat():
+    limiter = RateLimiter(
+        global_rate=100, global_burst=100, chat_rate=100, chat_burst=100
+    )
+    limiter.retry_after(1, 0.2)
+
+    started = time.monotonic()
+    await limiter.acquire(2)
+    assert time.monotonic() - started < 0.05
+    await limiter.acquire(1)
+    assert time.monotonic() - started >= 0.19
+    assert limiter.get_stats()["throttled"] == 1
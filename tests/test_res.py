@@ -74,7 +74,7 @@ async def test_res_handler_handle_success_execution():
         },
     }
 
-    update_user_video_res_called = False
+    update_user_called = False
     update_user_state_called = False
     edit_message_text_called = False
     answer_callback_query_called = False
@@ -83,21 +83,41 @@ async def test_res_handler_handle_success_execution():
     state_set = None
     message_text = ""
     callback_id = ""
+    video_info = {
+        "success": True,
+        "title": "Test",
+        "uploader": "Test",
+        "duration": 100,
+        "resolutions": ["1080p", "720p"],
+        "types": {
+            "video_with_audio": True,
+            "video_no_audio": True,
+            "only_audio": True,
+        },
+    }
 
-    async def get_user(telegram_id: int) -> dict:
+    async def ensure_user(telegram_id: int) -> dict:
         assert telegram_id == 12345
         return {
             "state": STATE.WAIT_FOR_RESOLUTION.value,
             "url": "https://vkvideo.ru/video837424820_456239073",
             "video_res": "",
             "video_type": "",
+            "video_info": video_info,
         }
 
-    async def update_user_video_res(telegram_id: int, resolution: str) -> None:
-        nonlocal update_user_video_res_called, resolution_set
-        update_user_video_res_called = True
+    async def update_user(telegram_id: int, **fields) -> dict:
+        nonlocal update_user_called, resolution_set
+        update_user_called = True
         assert telegram_id == 12345
-        resolution_set = resolution
+        resolution_set = fields.get("video_res", resolution_set)
+        return {
+            "state": STATE.WAIT_FOR_RESOLUTION.value,
+            "url": "https://vkvideo.ru/video837424820_456239073",
+            "video_res": resolution_set,
+            "video_type": fields.get("video_type", ""),
+            "video_info": video_info,
+        }
 
     async def update_user_state(telegram_id: int, state: STATE) -> None:
         nonlocal update_user_state_called, state_set
@@ -122,11 +142,15 @@ async def test_res_handler_handle_success_execution():
         callback_id = callback_query_id
         return {"ok": True}
 
+    async def get_cached_file(video_key: str, ydl_format: str) -> None:
+        return None
+
     bot.database_client = Mock(
         {
-            "get_user": get_user,
-            "update_user_video_res": update_user_video_res,
+            "ensure_user": ensure_user,
+            "update_user": update_user,
             "update_user_state": update_user_state,
+            "get_cached_file": get_cached_file,
         }
     )
     bot.telegram_api_client = Mock(
@@ -141,7 +165,7 @@ async def test_res_handler_handle_success_execution():
     dispatcher.add_handlers(res_handler)
     await dispatcher.dispatch(test_update)
 
-    assert update_user_video_res_called
+    assert update_user_called
     assert resolution_set == "720p"
 
     assert update_user_state_called
@@ -1,6 +1,13 @@
 from bot.worker import DownloadWorker
+from bot.yt_download import FileTooLarge, SizeGuard
+from bot.download_utils import DownloadUtils
 from bot.types import STATE
+from bot.telegram_api_client import TelegramAPIError
 import yt_dlp
+import asyncio
+import contextlib
+import json
+import time
 import bot
 import os
 import pytest
@@ -49,10 +56,14 @@ async def test_process_download_task_success_execution():
         nonlocal send_message_called
         send_message_called = True
 
+    async def get_cached_file(video_key: str, ydl_format: str) -> None:
+        return None
+
     bot.database_client = Mock(
         {
             "update_user_state": update_user_state,
             "clear_user_video_and_set_state": clear_user_video_and_set_state,
+            "get_cached_file": get_cached_file,
         }
     )
     bot.telegram_api_client = Mock(
@@ -129,3 +140,529 @@ async def test_process_download_task_success_execution():
     assert send_document_called
     assert file_path_sent == "/tmp/test.mp4"
     assert title_sent == "Test"
+
+
+@pytest.mark.asyncio
+async def test_download_and_send_file_cached_file_id_execution():
+    sent_file_id = ""
+
+    async def get_cached_file(video_key: str, ydl_format: str) -> dict:
+        assert video_key == "VK:837424820_456239073"
+        assert ydl_format == "bestaudio/best"
+        return {"file_id": "cached-file-id", "title": "Test"}
+
+    async def send_cached_document(chat_id: int, file_id: str, caption: str) -> dict:
+        nonlocal sent_file_id
+        assert chat_id == 12345
+        sent_file_id = file_id
+        return {"document": {"file_id": file_id}}
+
+    class FailingYoutubeDL:
+        def __init__(self, opts):
+            raise AssertionError("cache hit must not download the video")
+
+    bot.database_client = Mock({"get_cached_file": get_cached_file})
+    bot.telegram_api_client = Mock({"send_cached_document": send_cached_document})
+    yt_dlp.YoutubeDL = FailingYoutubeDL
+
+    worker = DownloadWorker()
+    success, error_message = await worker._download_and_send_file(
+        12345,
+        12345,
+        "https://vkvideo.ru/video837424820_456239073",
+        "bestaudio/best",
+        video_key="VK:837424820_456239073",
+    )
+
+    assert success
+    assert error_message is None
+    assert sent_file_id == "cached-file-id"
+
+
+@pytest.mark.asyncio
+async def test_download_and_send_file_stale_file_id_execution():
+    deleted = None
+    saved = None
+
+    async def get_cached_file(video_key: str, ydl_format: str) -> dict:
+        return {"file_id": "stale-file-id", "title": "Test"}
+
+    async def delete_cached_file(video_key: str, ydl_format: str, file_id: str):
+        nonlocal deleted
+        deleted = (video_key, ydl_format, file_id)
+
+    async def save_cached_file(video_key, ydl_format, file_id, title) -> None:
+        nonlocal saved
+        saved = (video_key, ydl_format, file_id, title)
+
+    async def send_cached_document(chat_id: int, file_id: str, caption: str) -> dict:
+        raise TelegramAPIError(
+            "sendDocument",
+            {"ok": False, "error_code": 400, "description": "wrong file identifier"},
+        )
+
+    async def send_document(chat_id: int, file_path: str, title: str) -> dict:
+        return {"document": {"file_id": "new-file-id"}}
+
+    class MockYoutubeDL:
+        def __init__(self, opts):
+            self.opts = opts
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, exc_type, exc_val, exc_tb):
+            pass
+
+        def extract_info(self, url, download=True):
+            return {"title": "Test", "ext": "mp4"}
+
+        def prepare_filename(self, info):
+            return "/tmp/test.mp4"
+
+    bot.database_client = Mock(
+        {
+            "get_cached_file": get_cached_file,
+            "delete_cached_file": delete_cached_file,
+            "save_cached_file": save_cached_file,
+        }
+    )
+    bot.telegram_api_client = Mock(
+        {"send_cached_document": send_cached_document, "send_document": send_document}
+    )
+    yt_dlp.YoutubeDL = MockYoutubeDL
+
+    worker = DownloadWorker()
+    success, error_message = await worker._download_and_send_file(
+        12345, 12345, "https://example.com/video.mp4", "best", video_key="key"
+    )
+
+    assert success
+    assert error_message is None
+    assert deleted == ("key", "best", "stale-file-id")
+    assert saved == ("key", "best", "new-file-id", "Test")
+
+
+@pytest.mark.asyncio
+async def test_download_and_send_file_uses_prepared_formats_execution():
+    used = []
+
+    async def get_cached_file(video_key: str, ydl_format: str) -> None:
+        return None
+
+    async def save_cached_file(video_key, ydl_format, file_id, title) -> None:
+        pass
+
+    async def send_document(chat_id: int, file_path: str, title: str) -> dict:
+        return {"document": {"file_id": "new-file-id"}}
+
+    class MockYoutubeDL:
+        def __init__(self, opts):
+            self.opts = opts
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, exc_type, exc_val, exc_tb):
+            pass
+
+        def process_ie_result(self, info, download=True):
+            used.append(("prepared", self.opts["format"]))
+            if info["formats"][0]["url"] == "https://expired":
+                raise yt_dlp.utils.DownloadError("HTTP Error 403: Forbidden")
+            return info
+
+        def extract_info(self, url, download=True):
+            used.append(("extract", self.opts["format"]))
+            return {"title": "Test", "ext": "mp4"}
+
+        def prepare_filename(self, info):
+            return "/tmp/test.mp4"
+
+    bot.database_client = Mock(
+        {"get_cached_file": get_cached_file, "save_cached_file": save_cached_file}
+    )
+    bot.telegram_api_client = Mock({"send_document": send_document})
+    yt_dlp.YoutubeDL = MockYoutubeDL
+
+    worker = DownloadWorker()
+    info = {
+        "id": "456239073",
+        "title": "Test",
+        "formats": [{"format_id": "hls-360", "url": "https://cdn/360.m3u8"}],
+    }
+    success, _ = await worker._download_and_send_file(
+        12345, 12345, "https://example.com/video", "best", "key", "hls-360", info
+    )
+    assert success
+    assert used == [("prepared", "hls-360")]
+
+    # Ссылки протухли - воркер сам делает extract_info по ydl_format
+    used.clear()
+    info["formats"][0]["url"] = "https://expired"
+    success, _ = await worker._download_and_send_file(
+        12345, 12345, "https://example.com/video", "best", "key", "hls-360", info
+    )
+    assert success
+    # При экстракции формат дополнен фильтром по размеру
+    assert used == [
+        ("prepared", "hls-360"),
+        ("extract", DownloadUtils._with_size_filter("best", 50 * 1024 * 1024)),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_worker_runs_jobs_concurrently_with_stage_limits(monkeypatch):
+    monkeypatch.setenv("WORKER_CONCURRENCY", "3")
+    monkeypatch.setenv("WORKER_UPLOAD_CONCURRENCY", "1")
+    outtmpls = []
+    uploading = 0
+    max_uploading = 0
+    acked = []
+
+    class MockYoutubeDL:
+        def __init__(self, opts):
+            self.opts = opts
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, exc_type, exc_val, exc_tb):
+            pass
+
+        def extract_info(self, url, download=True):
+            outtmpls.append(self.opts["outtmpl"])
+            time.sleep(0.2)
+            return {"title": url, "ext": "mp4"}
+
+        def prepare_filename(self, info):
+            return "/tmp/test.mp4"
+
+    async def send_document(chat_id: int, file_path: str, title: str) -> dict:
+        nonlocal uploading, max_uploading
+        uploading += 1
+        max_uploading = max(max_uploading, uploading)
+        await asyncio.sleep(0.05)
+        uploading -= 1
+        return {"document": {"file_id": title}}
+
+    async def noop(*args, **kwargs):
+        return None
+
+    class Message:
+        def __init__(self, number: int):
+            self.body = json.dumps(
+                {
+                    "telegram_id": number,
+                    "chat_id": number,
+                    "url": f"https://example.com/{number}",
+                    "ydl_format": "best",
+                }
+            ).encode()
+            self.number = number
+            self.redelivered = False
+
+        @contextlib.asynccontextmanager
+        async def process(self, requeue=False):
+            yield self
+            acked.append(self.number)
+
+    bot.database_client = Mock(
+        {
+            "get_cached_file": noop,
+            "save_cached_file": noop,
+            "update_user_state": noop,
+            "clear_user_video_and_set_state": noop,
+        }
+    )
+    bot.telegram_api_client = Mock({"send_document": send_document})
+    yt_dlp.YoutubeDL = MockYoutubeDL
+
+    worker = DownloadWorker()
+    started = time.monotonic()
+    await asyncio.gather(*(worker._handle_message(Message(n)) for n in range(3)))
+
+    # Три скачивания по 0.2 с идут параллельно, загрузки в Telegram - по одной
+    assert time.monotonic() - started < 0.5
+    assert max_uploading == 1
+    assert len(set(outtmpls)) == 3
+    assert sorted(acked) == [0, 1, 2]
+    assert worker.get_stats()["completed"] == 3
+
+
+@pytest.mark.asyncio
+async def test_identical_downloads_are_coalesced():
+    flights = {}
+    waiters = []
+    downloads = []
+    cached_sent = []
+
+    async def claim_download(
+        video_key, ydl_format, owner, stale_after, take_over=False
+    ) -> bool:
+        return flights.setdefault((video_key, ydl_format), owner) == owner
+
+    async def add_download_waiter(video_key, ydl_format, chat_id) -> bool:
+        if (video_key, ydl_format) not in flights:
+            return False
+        waiters.append(chat_id)
+        return True
+
+    async def finish_download(video_key, ydl_format, owner, take_waiters=True):
+        del flights[(video_key, ydl_format)]
+        chat_ids = list(waiters)
+        waiters.clear()
+        return chat_ids
+
+    async def get_cached_file(video_key: str, ydl_format: str) -> None:
+        return None
+
+    async def save_cached_file(video_key, ydl_format, file_id, title) -> None:
+        pass
+
+    async def send_document(chat_id: int, file_path: str, title: str) -> dict:
+        await asyncio.sleep(0.05)
+        return {"document": {"file_id": "file-id"}}
+
+    async def send_cached_document(chat_id: int, file_id: str, title: str) -> dict:
+        cached_sent.append((chat_id, file_id))
+        return {}
+
+    class MockYoutubeDL:
+        def __init__(self, opts):
+            self.opts = opts
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, exc_type, exc_val, exc_tb):
+            pass
+
+        def extract_info(self, url, download=True):
+            downloads.append(url)
+            time.sleep(0.1)
+            return {"title": "Test", "ext": "mp4"}
+
+        def prepare_filename(self, info):
+            return "/tmp/test.mp4"
+
+    bot.database_client = Mock(
+        {
+            "claim_download": claim_download,
+            "add_download_waiter": add_download_waiter,
+            "finish_download": finish_download,
+            "get_cached_file": get_cached_file,
+            "save_cached_file": save_cached_file,
+        }
+    )
+    bot.telegram_api_client = Mock(
+        {"send_document": send_document, "send_cached_document": send_cached_document}
+    )
+    yt_dlp.YoutubeDL = MockYoutubeDL
+
+    worker = DownloadWorker()
+    results = await asyncio.gather(
+        *(
+            worker._download_and_send_file(
+                chat_id, chat_id, "https://example.com/video", "best", "key"
+            )
+            for chat_id in (1, 2, 3)
+        )
+    )
+
+    assert all(success for success, _ in results)
+    assert len(downloads) == 1
+    assert sorted(cached_sent) == [(2, "file-id"), (3, "file-id")]
+    assert worker.get_stats()["coalesced"] == 2
+    assert worker.get_stats()["waiters_served"] == 2
+    assert flights == {}
+
+
+@pytest.mark.asyncio
+async def test_redelivered_download_takes_over_flight(monkeypatch):
+    monkeypatch.setenv("WORKER_FLIGHT_HEARTBEAT", "0.02")
+    # Запись о скачивании осталась от воркера, убитого посреди этого задания
+    flights = {("key", "best"): "dead-worker"}
+    waiters = []
+    downloads = []
+    touched = []
+
+    async def claim_download(
+        video_key, ydl_format, owner, stale_after, take_over=False
+    ) -> bool:
+        if take_over or (video_key, ydl_format) not in flights:
+            flights[(video_key, ydl_format)] = owner
+            return True
+        return False
+
+    async def add_download_waiter(video_key, ydl_format, chat_id) -> bool:
+        waiters.append(chat_id)
+        return True
+
+    async def touch_download(video_key, ydl_format, owner) -> bool:
+        touched.append(owner)
+        return flights.get((video_key, ydl_format)) == owner
+
+    async def finish_download(video_key, ydl_format, owner, take_waiters=True):
+        del flights[(video_key, ydl_format)]
+        chat_ids = list(waiters)
+        waiters.clear()
+        return chat_ids
+
+    async def noop(*args, **kwargs):
+        return None
+
+    async def send_document(chat_id: int, file_path: str, title: str) -> dict:
+        return {"document": {"file_id": "file-id"}}
+
+    class MockYoutubeDL:
+        def __init__(self, opts):
+            self.opts = opts
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, exc_type, exc_val, exc_tb):
+            pass
+
+        def extract_info(self, url, download=True):
+            downloads.append(url)
+            time.sleep(0.1)
+            return {"title": "Test", "ext": "mp4"}
+
+        def prepare_filename(self, info):
+            return "/tmp/test.mp4"
+
+    bot.database_client = Mock(
+        {
+            "claim_download": claim_download,
+            "add_download_waiter": add_download_waiter,
+            "touch_download": touch_download,
+            "finish_download": finish_download,
+            "get_cached_file": noop,
+            "save_cached_file": noop,
+        }
+    )
+    bot.telegram_api_client = Mock(
+        {"send_document": send_document, "send_cached_document": noop}
+    )
+    yt_dlp.YoutubeDL = MockYoutubeDL
+
+    worker = DownloadWorker()
+    url = "https://example.com/video"
+    # Обычное задание ждет чужое скачивание, повторно доставленное - скачивает само
+    assert await worker._download_and_send_file(1, 1, url, "best", "key") == (
+        True,
+        None,
+    )
+    assert downloads == []
+    success, _ = await worker._download_and_send_file(
+        2, 2, url, "best", "key", redelivered=True
+    )
+
+    assert success
+    assert downloads == [url]
+    assert waiters == []
+    assert flights == {}
+    # Во время скачивания владелец обновлял свою запись
+    assert touched
+
+
+def test_size_guard_aborts_by_projection():
+    mb = 1024 * 1024
+    guard = SizeGuard(50 * mb)
+
+    with pytest.raises(FileTooLarge):
+        guard.match_filter({"filesize": 60 * mb})
+
+    # Видео 40Mb уже скачано, аудио по оценке 15Mb - прерываем в начале аудио
+    guard.match_filter(
+        {
+            "duration": 100,
+            "requested_formats": [
+                {"format_id": "137", "filesize_approx": 30 * mb},
+                {"format_id": "140", "filesize_approx": 15 * mb},
+            ],
+        }
+    )
+    guard.progress_hook(
+        {
+            "status": "downloading",
+            "downloaded_bytes": 10 * mb,
+            "total_bytes_estimate": 30 * mb,
+            "info_dict": {"format_id": "137"},
+        }
+    )
+    guard.progress_hook(
+        {
+            "status": "finished",
+            "downloaded_bytes": 40 * mb,
+            "info_dict": {"format_id": "137"},
+        }
+    )
+    # Пока скачано мало, неточной оценке не верим
+    guard.progress_hook(
+        {
+            "status": "downloading",
+            "downloaded_bytes": 1000,
+            "total_bytes_estimate": 15 * mb,
+            "info_dict": {"format_id": "140"},
+        }
+    )
+    with pytest.raises(FileTooLarge) as error:
+        guard.progress_hook(
+            {
+                "status": "downloading",
+                "downloaded_bytes": 2 * mb,
+                "total_bytes_estimate": 15 * mb,
+                "info_dict": {"format_id": "140"},
+            }
+        )
+    assert error.value.size == 55 * mb
+    assert error.value.approximate
+
+
+@pytest.mark.asyncio
+async def test_download_aborted_when_file_grows_too_large():
+    messages = []
+
+    class MockYoutubeDL:
+        def __init__(self, opts):
+            self.opts = opts
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, exc_type, exc_val, exc_tb):
+            pass
+
+        def extract_info(self, url, download=True):
+            self.opts["match_filter"]({"title": "Test"}, incomplete=False)
+            for downloaded in range(0, 100 * 1024 * 1024, 1024 * 1024):
+                messages.append(downloaded)
+                self.opts["progress_hooks"][0](
+                    {
+                        "status": "downloading",
+                        "downloaded_bytes": downloaded,
+                        "total_bytes": 100 * 1024 * 1024,
+                        "info_dict": {"format_id": "18"},
+                    }
+                )
+            return {"title": "Test", "ext": "mp4"}
+
+    async def get_cached_file(video_key: str, ydl_format: str) -> None:
+        return None
+
+    bot.database_client = Mock({"get_cached_file": get_cached_file})
+    yt_dlp.YoutubeDL = MockYoutubeDL
+
+    worker = DownloadWorker()
+    success, error_message = await worker._download_and_send_file(
+        12345, 12345, "https://example.com/video", "best", "key"
+    )
+
+    assert not success
+    assert error_message.startswith("Файл слишком большой: 100.0Mb > 50Mb")
+    # Размер известен из Content-Length - прерываем на первом же вызове
+    assert len(messages) == 1
+    assert worker.get_stats()["too_large_aborted"] == 1
@@ -0,0 +1,188 @@
+import asyncio
+import sys
+from types import SimpleNamespace
+import aio_pika
+import pytest
+import bot.supervisor
+from bot.supervisor import WorkerSupervisor
+from bot.worker import DownloadWorker
+
+
+def _child(code: str) -> list[str]:
+    # Процесс-помощник вместо воркера: пишет события в файл out
+    return [sys.executable, "-c", code]
+
+
+@pytest.mark.asyncio
+async def test_supervisor_restarts_crashed_worker(tmp_path):
+    out = tmp_path / "out"
+    code = (
+        "import os, signal, sys, time\n"
+        f"out = open({str(out)!r}, 'a')\n"
+        "out.write(f\"start {os.environ['WORKER_ID']} {os.environ['WORKER_PROCESSES']}\\n\")\n"
+        "out.flush()\n"
+        f"crashed = {str(tmp_path / 'crashed')!r}\n"
+        "if os.environ['WORKER_ID'] == '0' and not os.path.exists(crashed):\n"
+        "    open(crashed, 'w').close()\n"
+        "    sys.exit(1)\n"
+        "signal.signal(signal.SIGTERM, lambda *_: (out.write('drained\\n'), sys.exit(0)))\n"
+        "time.sleep(30)\n"
+    )
+    supervisor = WorkerSupervisor(_child(code), processes=2, drain_timeout=5)
+    run = asyncio.create_task(supervisor.run())
+    # Воркер 0 падает при первом запуске и перезапускается через секунду
+    for _ in range(100):
+        await asyncio.sleep(0.05)
+        if out.exists() and out.read_text().count("start 0") == 2:
+            break
+    await asyncio.sleep(0.5)
+    assert supervisor.get_stats() == {"processes": 2, "running": 2, "restarts": 1}
+
+    supervisor.stop()
+    await asyncio.wait_for(run, 5)
+    lines = out.read_text().splitlines()
+    assert sorted(lines[:3]) == ["start 0 1", "start 0 1", "start 1 1"]
+    assert lines[3:] == ["drained", "drained"]
+    assert supervisor.get_stats()["running"] == 0
+
+
+@pytest.mark.asyncio
+async def test_supervisor_kills_workers_after_drain_timeout(monkeypatch):
+    monkeypatch.setattr(bot.supervisor, "_KILL_GRACE", 0)
+    code = (
+        "import signal, time\n"
+        "signal.signal(signal.SIGTERM, signal.SIG_IGN)\n"
+        "time.sleep(30)\n"
+    )
+    supervisor = WorkerSupervisor(_child(code), processes=1, drain_timeout=0.5)
+    run = asyncio.create_task(supervisor.run())
+    await asyncio.sleep(0.5)
+    supervisor.stop()
+    await asyncio.wait_for(run, 3)
+    assert supervisor.get_stats()["running"] == 0
+    assert supervisor.restarts == 0
+
+
+class FakeQueue:
+    def __init__(self):
+        self.messages = asyncio.Queue()
+        self.consuming = False
+
+    def iterator(self):
+        return self
+
+    async def __aenter__(self):
+        self.consuming = True
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.consuming = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self.messages.get()
+
+    async def declare(self):
+        return SimpleNamespace(message_count=self.messages.qsize())
+
+
+class FakeConnection:
+    def __init__(self, queue: FakeQueue):
+        self.queue = queue
+        self.declared = []
+        self.qos = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+    async def channel(self):
+        return self
+
+    async def set_qos(self, prefetch_count: int, global_: bool = False):
+        self.qos.append((prefetch_count, global_))
+
+    async def declare_queue(self, name, durable=False):
+        self.declared.append(name)
+        return self.queue
+
+
+@pytest.mark.asyncio
+async def test_worker_drains_jobs_on_stop(monkeypatch):
+    monkeypatch.setenv("WORKER_DRAIN_TIMEOUT", "0.3")
+    monkeypatch.setenv("RABBITMQ_QUEUE_NAME", "downloads")
+    queue = FakeQueue()
+    connection = FakeConnection(queue)
+
+    async def connect_robust(**kwargs):
+        return connection
+
+    monkeypatch.setattr(aio_pika, "connect_robust", connect_robust)
+    finished = []
+    cancelled = []
+
+    worker = DownloadWorker()
+
+    async def handle_message(message):
+        try:
+            await asyncio.sleep(message)
+            finished.append(message)
+        except asyncio.CancelledError:
+            cancelled.append(message)
+            raise
+
+    worker._handle_message = handle_message
+    consuming = asyncio.create_task(worker.start_consuming())
+    for seconds in (0.1, 5):
+        queue.messages.put_nowait(seconds)
+    await asyncio.sleep(0.05)
+
+    worker.stop()
+    await asyncio.sleep(0.05)
+    # Новые сообщения после остановки не берутся
+    queue.messages.put_nowait(0.01)
+    await asyncio.wait_for(consuming, 2)
+
+    assert not queue.consuming
+    # Три общих слота слушают очереди всех полос, и свободный слот берет задание любой
+    # полосы. У быстрой полосы еще один закрепленный слот
+    assert connection.qos == [(3, True), (1, False)]
+    assert connection.declared == [
+        "downloads.fast",
+        "downloads",
+        "downloads.slow",
+        "downloads.fast",
+    ]
+    assert worker.get_stats()["shared_slots"] == 3
+    assert worker.get_stats()["lanes"]["fast"]["depth"] == 0
+    assert finished == [0.1]
+    # Задание длиннее WORKER_DRAIN_TIMEOUT отменяется, его сообщение вернется в очередь
+    assert cancelled == [5]
+    assert queue.messages.qsize() == 1
+
+
+@pytest.mark.asyncio
+async def test_worker_with_one_slot_shares_it_between_lanes(monkeypatch):
+    monkeypatch.setenv("WORKER_CONCURRENCY", "1")
+    monkeypatch.setenv("RABBITMQ_QUEUE_NAME", "downloads")
+    queue = FakeQueue()
+    connection = FakeConnection(queue)
+
+    async def connect_robust(**kwargs):
+        return connection
+
+    monkeypatch.setattr(aio_pika, "connect_robust", connect_robust)
+    worker = DownloadWorker()
+    consuming = asyncio.create_task(worker.start_consuming())
+    await asyncio.sleep(0.05)
+    worker.stop()
+    await asyncio.wait_for(consuming, 2)
+
+    # Один канал с общим prefetch на все очереди: не больше одного задания сразу
+    assert connection.qos == [(1, True)]
+    assert connection.declared == ["downloads.fast", "downloads", "downloads.slow"]
+    assert worker.concurrency == 1
@@ -0,0 +1,66 @@
+import time
+import pytest
+from bot.download_utils import DownloadUtils
+from bot.task_lanes import choose_lane, get_lane_queue, get_lane_slots
+from bot.worker import DownloadWorker
+
+MB = 1024 * 1024
+
+
+def test_choose_lane_by_estimated_cost(monkeypatch):
+    monkeypatch.setenv("RABBITMQ_QUEUE_NAME", "downloads")
+    video_info = {"duration": 600, "sizes": {"best": {"size": 20 * MB}}}
+    task = {
+        "type": "video_with_audio",
+        "max_filesize": 50 * MB,
+        **DownloadUtils._get_cost_hints(video_info, "best"),
+    }
+
+    # Пороги - доли лимита размера файла, склейка видео со звуком дороже
+    assert choose_lane({"type": "only_video", "estimated_size": 10 * MB}) == "fast"
+    assert choose_lane({"type": "only_video", "estimated_size": 20 * MB}) == "normal"
+    assert choose_lane(task) == "slow"
+    # С локальным Bot API лимит больше, и тот же файл уже не медленный
+    assert choose_lane({**task, "max_filesize": 2000 * MB}) == "fast"
+    # Без размера - по длительности: 30 секунд звука и минута видео
+    assert choose_lane({"video_type": "only_audio", "duration": 30}) == "fast"
+    assert choose_lane({"video_type": "only_video", "duration": 60}) == "normal"
+    assert choose_lane({"type": "only_video"}) == "normal"
+    monkeypatch.setenv("RABBITMQ_SLOW_LANE_MB", "100")
+    assert choose_lane(task) == "normal"
+
+    assert get_lane_queue("normal") == "downloads"
+    assert get_lane_queue("fast") == "downloads.fast"
+
+
+def test_lane_slots(monkeypatch):
+    # Закрепленные за полосой слоты, остальные общие для всех полос
+    assert get_lane_slots(4) == {"fast": 1, "normal": 0, "slow": 0}
+    assert get_lane_slots(8) == {"fast": 2, "normal": 0, "slow": 0}
+    assert get_lane_slots(2) == {"fast": 1, "normal": 0, "slow": 0}
+    # Единственный слот общий
+    assert get_lane_slots(1) == {"fast": 0, "normal": 0, "slow": 0}
+
+    monkeypatch.setenv("WORKER_LANE_SLOTS", "fast=2, slow=1")
+    assert get_lane_slots(5) == {"fast": 2, "normal": 0, "slow": 1}
+    # Общих слотов не осталось, отрицательные слоты, неизвестная полоса
+    for value in ("fast=2, normal=2", "fast=-1", "huge=1"):
+        monkeypatch.setenv("WORKER_LANE_SLOTS", value)
+        with pytest.raises(ValueError):
+            get_lane_slots(4)
+
+
+def test_worker_lane_wait_time(monkeypatch):
+    monkeypatch.setenv("WORKER_LANE_SLOTS", "fast=1,slow=1")
+    worker = DownloadWorker()
+    worker._observe_lane_wait({"lane": "fast", "enqueued_at": time.time() - 2})
+    # Задание, отправленное до появления полос
+    worker._observe_lane_wait({"chat_id": 1})
+
+    lanes = worker.get_stats()["lanes"]
+    assert worker.concurrency == 4
+    assert lanes["fast"]["slots"] == 1
+    assert worker.get_stats()["shared_slots"] == 2
+    assert lanes["fast"]["wait_time"]["count"] == 1
+    assert lanes["fast"]["wait_time"]["max"] >= 2
+    assert lanes["normal"]["wait_time"]["count"] == 0
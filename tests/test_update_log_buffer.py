@@ -0,0 +1,77 @@
+from bot.update_log_buffer import UpdateLogBuffer
+import bot
+import asyncio
+import pytest
+
+from tests.mocks import Mock
+
+
+def make_update(update_id: int) -> dict:
+    return {"update_id": update_id, "message": {"from": {"id": 12345}}}
+
+
+@pytest.mark.asyncio
+async def test_buffer_flushes_on_batch_size():
+    batches = []
+
+    async def persist_updates_batch(updates: list[dict]) -> None:
+        batches.append([update["update_id"] for update in updates])
+
+    bot.database_client = Mock({"persist_updates_batch": persist_updates_batch})
+    buffer = UpdateLogBuffer(batch_size=2, flush_interval=10, max_size=100)
+
+    buffer.put(make_update(1))
+    await asyncio.sleep(0.01)
+    assert batches == []
+
+    buffer.put(make_update(2))
+    await asyncio.sleep(0.01)
+    assert batches == [[1, 2]]
+
+    buffer.put(make_update(3))
+    await buffer.close()
+    assert batches == [[1, 2], [3]]
+    assert buffer.get_stats()["flushed"] == 3
+
+
+@pytest.mark.asyncio
+async def test_buffer_flushes_on_interval():
+    batches = []
+
+    async def persist_updates_batch(updates: list[dict]) -> None:
+        batches.append([update["update_id"] for update in updates])
+
+    bot.database_client = Mock({"persist_updates_batch": persist_updates_batch})
+    buffer = UpdateLogBuffer(batch_size=100, flush_interval=0.05, max_size=100)
+
+    buffer.put(make_update(1))
+    await asyncio.sleep(0.1)
+    assert batches == [[1]]
+    await buffer.close()
+
+
+@pytest.mark.asyncio
+async def test_buffer_drops_oldest_when_full_and_keeps_failed_batch():
+    batches = []
+    database_available = False
+
+    async def persist_updates_batch(updates: list[dict]) -> None:
+        if not database_available:
+            raise ConnectionError("database is down")
+        batches.append([update["update_id"] for update in updates])
+
+    bot.database_client = Mock({"persist_updates_batch": persist_updates_batch})
+    buffer = UpdateLogBuffer(batch_size=10, flush_interval=10, max_size=3)
+
+    for update_id in range(1, 6):
+        buffer.put(make_update(update_id))
+    await buffer.flush()
+
+    stats = buffer.get_stats()
+    assert stats["buffered"] == 3
+    assert stats["dropped"] == 2
+    assert stats["failed_flushes"] == 1
+
+    database_available = True
+    await buffer.close()
+    assert batches == [[3, 4, 5]]
@@ -1,5 +1,6 @@
 from bot.dispatcher import Dispatcher
 from bot.handlers.update_database_logger import UpdateDatabaseLogger
+from bot.update_log_buffer import close_update_log_buffer
 import bot
 from tests.mocks import Mock
 import pytest
@@ -30,19 +31,19 @@ async def test_update_database_logger_execution():
 
     persist_updates_called = False
 
-    async def persist_updates(update: dict) -> None:
+    async def persist_updates_batch(updates: list[dict]) -> None:
         nonlocal persist_updates_called
         persist_updates_called = True
-        assert update == test_update
+        assert updates == [test_update]
 
-    async def get_user(telegram_id: int) -> dict | None:
+    async def ensure_user(telegram_id: int) -> dict | None:
         assert telegram_id == 12345
         return None
 
     mock_database_client = Mock(
         {
-            "persist_updates": persist_updates,
-            "get_user": get_user,
+            "persist_updates_batch": persist_updates_batch,
+            "ensure_user": ensure_user,
         }
     )
 
@@ -53,4 +54,6 @@ async def test_update_database_logger_execution():
     dispatcher.add_handlers(update_logger)
     await dispatcher.dispatch(test_update)
 
+    # Запись идет в фоне, при остановке буфер дописывается в базу
+    await close_update_log_buffer()
     assert persist_updates_called
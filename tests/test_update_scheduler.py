@@ -0,0 +1,83 @@
+from bot.dispatcher import Dispatcher
+from bot.update_scheduler import UpdateScheduler
+import asyncio
+import pytest
+
+
+def make_update(update_id: int, telegram_id: int) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {"from": {"id": telegram_id}, "chat": {"id": telegram_id}},
+    }
+
+
+class SlowDispatcher(Dispatcher):
+    def __init__(self, delays: dict):
+        super().__init__()
+        self.delays = delays
+        self.started = []
+        self.finished = []
+
+    async def dispatch(self, update: dict) -> None:
+        self.started.append(update["update_id"])
+        await asyncio.sleep(self.delays.get(update["update_id"], 0))
+        self.finished.append(update["update_id"])
+
+
+@pytest.mark.asyncio
+async def test_scheduler_keeps_order_per_user_and_runs_users_concurrently():
+    dispatcher = SlowDispatcher({1: 0.2, 2: 0.0})
+    scheduler = UpdateScheduler(
+        dispatcher, max_concurrent_users=4, max_pending_updates=100
+    )
+
+    await scheduler.submit(make_update(1, telegram_id=100))
+    await scheduler.submit(make_update(2, telegram_id=100))
+    await scheduler.submit(make_update(3, telegram_id=200))
+    await asyncio.sleep(0.05)
+
+    # Медленный update пользователя 100 не блокирует пользователя 200,
+    # но следующий update пользователя 100 ждет своей очереди
+    assert dispatcher.finished == [3]
+    assert 2 not in dispatcher.started
+    assert scheduler.committed_offset == 1
+    assert scheduler.is_known(3)
+
+    await scheduler.join()
+
+    assert dispatcher.finished == [3, 1, 2]
+    assert scheduler.committed_offset == 4
+    assert scheduler.get_stats()["dispatch_time"]["count"] == 3
+
+
+@pytest.mark.asyncio
+async def test_scheduler_limits_concurrent_users():
+    dispatcher = SlowDispatcher({1: 0.1, 2: 0.1, 3: 0.1})
+    scheduler = UpdateScheduler(
+        dispatcher, max_concurrent_users=2, max_pending_updates=100
+    )
+
+    for update_id in (1, 2, 3):
+        await scheduler.submit(make_update(update_id, telegram_id=update_id))
+    await asyncio.sleep(0.05)
+
+    assert dispatcher.started == [1, 2]
+    await scheduler.join()
+    assert sorted(dispatcher.finished) == [1, 2, 3]
+
+
+@pytest.mark.asyncio
+async def test_scheduler_back_pressure():
+    dispatcher = SlowDispatcher({1: 0.1})
+    scheduler = UpdateScheduler(
+        dispatcher, max_concurrent_users=4, max_pending_updates=1
+    )
+
+    await scheduler.submit(make_update(1, telegram_id=100))
+    second = asyncio.create_task(scheduler.submit(make_update(2, telegram_id=200)))
+    await asyncio.sleep(0.05)
+    assert not second.done()
+
+    await asyncio.wait_for(second, timeout=1)
+    await scheduler.join()
+    assert dispatcher.finished == [1, 2]
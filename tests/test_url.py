@@ -88,7 +88,7 @@ async def test_url_handler_cyrillic_text_execution():
     send_message_called = False
     message_text = ""
 
-    async def get_user(telegram_id: int) -> dict:
+    async def ensure_user(telegram_id: int) -> dict:
         assert telegram_id == 12345
         return {
             "state": STATE.WAIT_FOR_ID.value,
@@ -103,7 +103,7 @@ async def test_url_handler_cyrillic_text_execution():
         message_text = text
         return {"ok": True}
 
-    bot.database_client = Mock({"get_user": get_user})
+    bot.database_client = Mock({"ensure_user": ensure_user})
     bot.telegram_api_client = Mock({"send_message": send_message})
 
     dispatcher = Dispatcher()
@@ -143,7 +143,7 @@ async def test_url_handler_invalid_url_execution():
     send_message_called = False
     message_text = ""
 
-    async def get_user(telegram_id: int) -> dict:
+    async def ensure_user(telegram_id: int) -> dict:
         assert telegram_id == 12345
         return {"state": STATE.WAIT_FOR_ID.value}
 
@@ -153,7 +153,7 @@ async def test_url_handler_invalid_url_execution():
         message_text = text
         return {"ok": True}
 
-    bot.database_client = Mock({"get_user": get_user})
+    bot.database_client = Mock({"ensure_user": ensure_user})
     bot.telegram_api_client = Mock({"send_message": send_message})
 
     url_handler = UrlHandler()
@@ -190,7 +190,7 @@ async def test_url_handler_video_unavailable_execution():
     send_message_called = False
     message_text = ""
 
-    async def get_user(telegram_id: int) -> dict:
+    async def ensure_user(telegram_id: int) -> dict:
         assert telegram_id == 12345
         return {"state": STATE.WAIT_FOR_ID.value}
 
@@ -200,20 +200,16 @@ async def test_url_handler_video_unavailable_execution():
         message_text = text
         return {"ok": True}
 
-    async def validate_video(url: str) -> dict:
+    async def probe_video(url: str) -> dict:
         return {"success": False, "error": "unavailable"}
 
-    async def get_avaliable_res(url: str) -> dict:
-        return []
-
-    bot.database_client = Mock({"get_user": get_user})
+    bot.database_client = Mock({"ensure_user": ensure_user})
     bot.telegram_api_client = Mock({"send_message": send_message})
 
     dispatcher = Dispatcher()
     url_handler = UrlHandler()
 
-    url_handler._validate_video = validate_video
-    url_handler._get_avaliable_resolutions = get_avaliable_res
+    url_handler._probe_video = probe_video
 
     dispatcher.add_handlers(url_handler)
     await dispatcher.dispatch(test_update)
@@ -245,47 +241,50 @@ async def test_url_handler_video_success_validation_execution():
         },
     }
 
-    update_user_video_called = False
-    update_user_state_called = False
+    update_user_called = False
     send_message_called = False
+    reply_markup_sent = None
+    video_info = {
+        "success": True,
+        "title": "Test",
+        "uploader": "Test",
+        "duration": 100,
+        "resolutions": ["1080p", "720p"],
+        "types": {
+            "video_with_audio": True,
+            "video_no_audio": False,
+            "only_audio": False,
+        },
+    }
 
-    async def get_user(telegram_id: int) -> dict:
+    async def ensure_user(telegram_id: int) -> dict:
         assert telegram_id == 12345
         return {"state": STATE.WAIT_FOR_ID.value}
 
-    async def update_user_video(telegram_id: int, url: str) -> None:
-        nonlocal update_user_video_called
-        update_user_video_called = True
+    async def update_user(telegram_id: int, **fields) -> dict:
+        nonlocal update_user_called
+        update_user_called = True
         assert telegram_id == 12345
-        assert url == "https://vkvideo.ru/video123456789"
-
-    async def update_user_state(telegram_id: int, state: STATE) -> None:
-        nonlocal update_user_state_called
-        update_user_state_called = True
-        assert telegram_id == 12345
-        assert state == STATE.WAIT_FOR_RESOLUTION
+        assert fields == {
+            "url": "https://vkvideo.ru/video123456789",
+            "state": STATE.WAIT_FOR_RESOLUTION,
+            "video_info": video_info,
+        }
+        return {"state": STATE.WAIT_FOR_RESOLUTION.value, **fields}
 
     async def send_message(chat_id: int, text: str, **kwargs) -> dict:
-        nonlocal send_message_called
+        nonlocal send_message_called, reply_markup_sent
         send_message_called = True
+        reply_markup_sent = kwargs.get("reply_markup")
         return {"ok": True}
 
-    async def validate_video(url: str) -> dict:
-        return {
-            "success": True,
-            "title": "Test",
-            "uploader": "Test",
-            "duration": 100,
-        }
-
-    async def get_avaliable_res(url: str) -> dict:
-        return ["1080p", "720p"]
+    async def probe_video(url: str) -> dict:
+        return video_info
 
     bot.database_client = Mock(
         {
-            "get_user": get_user,
-            "update_user_video": update_user_video,
-            "update_user_state": update_user_state,
+            "ensure_user": ensure_user,
+            "update_user": update_user,
         }
     )
     bot.telegram_api_client = Mock({"send_message": send_message})
@@ -293,12 +292,52 @@ async def test_url_handler_video_success_validation_execution():
     dispatcher = Dispatcher()
     url_handler = UrlHandler()
 
-    url_handler._validate_video = validate_video
-    url_handler._get_avaliable_resolutions = get_avaliable_res
+    url_handler._probe_video = probe_video
 
     dispatcher.add_handlers(url_handler)
     await dispatcher.dispatch(test_update)
 
-    assert update_user_video_called
-    assert update_user_state_called
+    assert update_user_called
     assert send_message_called
+    assert reply_markup_sent == {
+        "inline_keyboard": [
+            [{"text": "1080p", "callback_data": "res_1080p"}],
+            [{"text": "720p", "callback_data": "res_720p"}],
+        ]
+    }
+
+
+def test_url_handler_resolution_keyboard_shows_sizes():
+    megabyte = 1024 * 1024
+    video_info = {
+        "resolutions": ["1080p", "720p", "360p"],
+        "types": {
+            "video_with_audio": True,
+            "video_no_audio": False,
+            "only_audio": False,
+        },
+        "sizes": {
+            "bestvideo[height<=1080]+bestaudio/best[height<=1080]": {
+                "size": 120 * megabyte,
+                "exact": True,
+            },
+            "bestvideo[height<=720]+bestaudio/best[height<=720]": {
+                "size": 60 * megabyte,
+                "exact": False,
+            },
+            "bestvideo[height<=360]+bestaudio/best[height<=360]": {
+                "size": 20 * megabyte,
+                "exact": True,
+            },
+        },
+    }
+
+    keyboard = UrlHandler()._get_resolution_keyboard(
+        video_info, video_info["resolutions"]
+    )
+
+    # 1080p точно больше 50Mb и скрыт, 720p по оценке больше - с пометкой
+    assert keyboard == [
+        [{"text": "720p ~60 Mb ⚠️", "callback_data": "res_720p"}],
+        [{"text": "360p 20 Mb", "callback_data": "res_360p"}],
+    ]
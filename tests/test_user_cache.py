@@ -0,0 +1,131 @@
+from bot.types import STATE
+import importlib
+import pytest
+
+# Тесты подменяют bot.database_client на Mock, поэтому берем настоящий модуль напрямую
+database_client = importlib.import_module("bot.database_client")
+
+
+class FakeConnection:
+    def __init__(self, users: dict):
+        self.users = users
+        self.queries = 0
+        # Пользователи, которых одновременно вставляет другой запрос
+        self.racing = set()
+
+    async def fetchrow(self, query: str, *args):
+        self.queries += 1
+        if "INSERT INTO users" in query:
+            telegram_id = args[0]
+            self.users.setdefault(
+                telegram_id, [1, telegram_id, None, None, None, None, None]
+            )
+            if telegram_id in self.racing:
+                return None
+            return list(self.users[telegram_id])
+        if query.startswith("SELECT"):
+            row = self.users.get(args[0])
+            return list(row) if row else None
+        if "UPDATE users" in query:
+            assert "pg_notify" in query
+            telegram_id = args[-3]
+            row = self.users.get(telegram_id)
+            if row is None:
+                return None
+            if len(args) == 4:
+                row[2] = args[0]
+            return list(row)
+        raise AssertionError(query)
+
+
+class FakePool:
+    def __init__(self, connection: FakeConnection):
+        self.connection = connection
+
+    def acquire(self):
+        pool = self
+
+        class Acquire:
+            async def __aenter__(self):
+                return pool.connection
+
+            async def __aexit__(self, *exc):
+                return False
+
+        return Acquire()
+
+
+@pytest.fixture
+def connection(monkeypatch):
+    connection = FakeConnection({})
+
+    async def get_pool():
+        return FakePool(connection)
+
+    monkeypatch.setattr(database_client, "get_pool", get_pool)
+    monkeypatch.setattr(database_client, "_user_cache", None)
+    monkeypatch.setattr(database_client, "_user_cache_synced", True)
+    return connection
+
+
+@pytest.mark.asyncio
+async def test_ensure_user_is_served_from_cache(connection):
+    first = await database_client.ensure_user(12345)
+    first["state"] = "changed by handler"
+    second = await database_client.ensure_user(12345)
+
+    assert connection.queries == 1
+    assert second["state"] is None
+    stats = database_client.get_user_cache().get_stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+
+
+@pytest.mark.asyncio
+async def test_ensure_user_rereads_row_inserted_concurrently(connection):
+    connection.racing.add(12345)
+
+    user = await database_client.ensure_user(12345)
+
+    assert connection.queries == 2
+    assert user["telegram_id"] == 12345
+
+
+@pytest.mark.asyncio
+async def test_writes_go_through_cache(connection):
+    await database_client.ensure_user(12345)
+    await database_client.update_user_state(12345, STATE.WAIT_FOR_ID)
+    user = await database_client.ensure_user(12345)
+
+    assert connection.queries == 2
+    assert user["state"] == STATE.WAIT_FOR_ID.value
+
+
+@pytest.mark.asyncio
+async def test_notification_from_other_process_invalidates_user(connection):
+    await database_client.ensure_user(12345)
+
+    # Свои уведомления пропускаются, чужие - сбрасывают строку в кэше
+    database_client._on_user_changed(
+        None,
+        0,
+        database_client.USER_CHANGES_CHANNEL,
+        f"{database_client._PROCESS_ID}:12345",
+    )
+    await database_client.ensure_user(12345)
+    assert connection.queries == 1
+
+    database_client._on_user_changed(
+        None, 0, database_client.USER_CHANGES_CHANNEL, "worker:12345"
+    )
+    await database_client.ensure_user(12345)
+    assert connection.queries == 2
+
+
+@pytest.mark.asyncio
+async def test_cache_is_bypassed_without_listener(connection, monkeypatch):
+    monkeypatch.setattr(database_client, "_user_cache_synced", False)
+    await database_client.ensure_user(12345)
+    await database_client.ensure_user(12345)
+
+    assert connection.queries == 2
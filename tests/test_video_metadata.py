@@ -0,0 +1,238 @@
+from bot import video_metadata
+from bot.download_utils import DownloadUtils
+import bot
+import asyncio
+import sys
+import pytest
+import yt_dlp
+
+from tests.mocks import Mock
+
+URL = "https://vkvideo.ru/video837424820_456239073"
+
+
+@pytest.fixture
+def storage(monkeypatch):
+    saved = {}
+
+    async def get_video_metadata(video_key: str) -> dict | None:
+        return saved.get(video_key, (None,))[0]
+
+    async def save_video_metadata(video_key: str, metadata: dict, ttl: float) -> None:
+        saved[video_key] = (metadata, ttl)
+
+    monkeypatch.setattr(
+        bot,
+        "database_client",
+        Mock(
+            {
+                "get_video_metadata": get_video_metadata,
+                "save_video_metadata": save_video_metadata,
+            }
+        ),
+    )
+    monkeypatch.setattr(video_metadata, "_memory_cache", None)
+    # test_send подменяет yt_dlp.YoutubeDL, а форматы выбирает настоящий
+    monkeypatch.setattr(yt_dlp, "YoutubeDL", sys.modules["yt_dlp.YoutubeDL"].YoutubeDL)
+    return saved
+
+
+def fake_extract_info(monkeypatch, result) -> list:
+    calls = []
+
+    def extract_info(url: str) -> dict:
+        calls.append(url)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    monkeypatch.setattr(video_metadata, "_extract_info", extract_info)
+    return calls
+
+
+@pytest.mark.asyncio
+async def test_metadata_is_probed_once(storage, monkeypatch):
+    calls = fake_extract_info(
+        monkeypatch,
+        {
+            "title": "Test video",
+            "uploader": "Test author",
+            "duration": 60,
+            "formats": [
+                {"height": 360, "vcodec": "avc1", "acodec": "none"},
+                {"height": 720, "vcodec": "avc1", "acodec": "none"},
+                {"vcodec": "none", "acodec": "mp4a"},
+            ],
+        },
+    )
+
+    results = await asyncio.gather(
+        *(video_metadata.get_video_metadata(URL) for _ in range(5))
+    )
+    assert calls == [URL]
+    assert results[0] == {
+        "success": True,
+        "title": "Test video",
+        "uploader": "Test author",
+        "duration": 60,
+        "resolutions": ["720p", "360p"],
+        "types": {
+            "video_with_audio": False,
+            "video_no_audio": True,
+            "only_audio": True,
+        },
+    }
+
+    # Другой процесс: кэша в памяти нет, но метаданные есть в базе
+    video_metadata._memory_cache = None
+    assert await video_metadata.get_video_metadata(URL) == results[0]
+    assert calls == [URL]
+
+
+@pytest.mark.asyncio
+async def test_errors_are_cached_with_own_ttl(storage, monkeypatch):
+    calls = fake_extract_info(
+        monkeypatch, yt_dlp.utils.DownloadError("ERROR: Private video")
+    )
+
+    assert await video_metadata.get_video_metadata(URL) == {
+        "success": False,
+        "error": "private",
+    }
+    await video_metadata.get_video_metadata(URL)
+
+    assert len(calls) == 1
+    ((_, ttl),) = storage.values()
+    assert ttl == video_metadata.ERROR_TTLS["private"]
+
+
+@pytest.mark.asyncio
+async def test_unexpected_errors_are_not_cached(storage, monkeypatch):
+    calls = fake_extract_info(monkeypatch, RuntimeError("boom"))
+
+    assert await video_metadata.get_video_metadata(URL) == {
+        "success": False,
+        "error": "unexpected",
+    }
+    await video_metadata.get_video_metadata(URL)
+
+    assert len(calls) == 2
+    assert storage == {}
+
+
+def test_summary_carries_resolved_formats(monkeypatch):
+    # Другие тесты подменяют yt_dlp.YoutubeDL, здесь нужен настоящий
+    monkeypatch.setattr(yt_dlp, "YoutubeDL", sys.modules["yt_dlp.YoutubeDL"].YoutubeDL)
+    formats = [
+        {
+            "format_id": "audio",
+            "url": "https://cdn/a",
+            "ext": "m4a",
+            "vcodec": "none",
+            "acodec": "mp4a",
+            "filesize": 1024 * 1024,
+        },
+        {
+            "format_id": "v360",
+            "url": "https://cdn/360",
+            "ext": "mp4",
+            "height": 360,
+            "vcodec": "avc1",
+            "acodec": "none",
+            "tbr": 800,
+        },
+        {
+            "format_id": "v720",
+            "url": "https://cdn/720",
+            "ext": "mp4",
+            "height": 720,
+            "vcodec": "avc1",
+            "acodec": "none",
+        },
+    ]
+    with yt_dlp.YoutubeDL({"quiet": True}) as ydl:
+        info = ydl.process_ie_result(
+            {
+                "id": "abc",
+                "title": "Test",
+                "extractor": "generic",
+                "extractor_key": "Generic",
+                "webpage_url": URL,
+                "duration": 100,
+                "formats": formats,
+            },
+            download=False,
+        )
+
+    summary = video_metadata.summarize_info(info)
+
+    no_audio = DownloadUtils._generate_ydl_format("360p", "video_no_audio")
+    assert summary["format_ids"] == {
+        "bestvideo[height<=720]": "v720",
+        no_audio: "v360",
+        "bestaudio/best": "audio",
+    }
+
+    # Точный размер из filesize, примерный - из битрейта и длительности, без данных - нет оценки
+    assert summary["sizes"] == {
+        "bestaudio/best": {"size": 1024 * 1024, "exact": True},
+        no_audio: {"size": 10_000_000, "exact": False},
+    }
+
+    # Если внутренний _select_formats yt_dlp изменился, форматы выбираются так же
+    def changed_api(ydl, info, ydl_format):
+        raise AttributeError("_select_formats")
+
+    monkeypatch.setattr(video_metadata, "_select_format_fast", changed_api)
+    fallback = video_metadata.summarize_info(info)
+    assert fallback["format_ids"] == summary["format_ids"]
+    assert fallback["sizes"] == summary["sizes"]
+
+    prepared = DownloadUtils._get_prepared_download(summary, no_audio)
+    assert prepared["format_id"] == "v360"
+    assert prepared["info"]["title"] == "Test"
+    assert [f["format_id"] for f in prepared["info"]["formats"]] == ["v360"]
+    assert DownloadUtils._get_prepared_download(summary, "unknown") == {}
+
+
+def test_resolved_formats_fit_size_limit(monkeypatch):
+    monkeypatch.setattr(yt_dlp, "YoutubeDL", sys.modules["yt_dlp.YoutubeDL"].YoutubeDL)
+    monkeypatch.setenv("TELEGRAM_MAX_FILE_SIZE_MB", "50")
+    formats = [
+        {
+            "format_id": f"v{height}",
+            "url": f"https://cdn/{height}",
+            "ext": "mp4",
+            "height": height,
+            "vcodec": "avc1",
+            "acodec": "none",
+            "filesize": size * 1024 * 1024,
+        }
+        for height, size in ((480, 20), (720, 80))
+    ]
+    info = {"id": "abc", "title": "Test", "duration": 100, "formats": formats}
+
+    format_ids, sizes = video_metadata._resolve_formats(
+        info, ["720p"], {"video_no_audio": True}
+    )
+
+    # 720p больше лимита - заранее выбираем помещающийся 480p, как при скачивании
+    ydl_format = DownloadUtils._generate_ydl_format("720p", "video_no_audio")
+    assert format_ids == {ydl_format: "v480"}
+    assert sizes == {ydl_format: {"size": 20 * 1024 * 1024, "exact": True}}
+
+
+def test_prepare_download_hides_only_yt_dlp_errors(monkeypatch):
+    def selector_error(info, resolutions, types):
+        raise yt_dlp.utils.ExtractorError("no formats")
+
+    monkeypatch.setattr(video_metadata, "_resolve_formats", selector_error)
+    assert video_metadata._prepare_download({}, ["720p"], {"only_audio": True}) == {}
+
+    # Остальные ошибки - баги, их не прячем
+    def bug(info, resolutions, types):
+        raise KeyError("ext")
+
+    monkeypatch.setattr(video_metadata, "_resolve_formats", bug)
+    with pytest.raises(KeyError):
+        video_metadata._prepare_download({}, ["720p"], {"only_audio": True})
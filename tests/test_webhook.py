@@ -0,0 +1,86 @@
+from aiohttp.test_utils import TestClient, TestServer
+from bot.dispatcher import Dispatcher
+from bot.update_scheduler import UpdateScheduler
+from bot.webhook import _get_secret_token, create_webhook_app, SECRET_TOKEN_HEADER
+import pytest
+
+
+class RecordingDispatcher(Dispatcher):
+    def __init__(self):
+        super().__init__()
+        self.dispatched = []
+
+    async def dispatch(self, update: dict) -> None:
+        self.dispatched.append(update["update_id"])
+
+
+test_update = {
+    "update_id": 123456789,
+    "message": {
+        "message_id": 1,
+        "from": {"id": 12345, "is_bot": False, "first_name": "Test"},
+        "chat": {"id": 12345, "type": "private"},
+        "date": 1640995200,
+        "text": "/start",
+    },
+}
+
+
+@pytest.mark.asyncio
+async def test_webhook_dispatches_update_with_valid_secret():
+    dispatcher = RecordingDispatcher()
+    scheduler = UpdateScheduler(
+        dispatcher, max_concurrent_users=4, max_pending_updates=100
+    )
+    app = create_webhook_app(scheduler, "secret", "/webhook")
+
+    async with TestClient(TestServer(app)) as client:
+        response = await client.post(
+            "/webhook", json=test_update, headers={SECRET_TOKEN_HEADER: "secret"}
+        )
+        assert response.status == 200
+        # Повторная доставка того же update не обрабатывается второй раз
+        response = await client.post(
+            "/webhook", json=test_update, headers={SECRET_TOKEN_HEADER: "secret"}
+        )
+        assert response.status == 200
+        await scheduler.join()
+
+    assert dispatcher.dispatched == [123456789]
+
+
+@pytest.mark.asyncio
+async def test_webhook_rejects_wrong_secret():
+    dispatcher = RecordingDispatcher()
+    scheduler = UpdateScheduler(
+        dispatcher, max_concurrent_users=4, max_pending_updates=100
+    )
+    app = create_webhook_app(scheduler, "secret", "/webhook")
+
+    async with TestClient(TestServer(app)) as client:
+        response = await client.post(
+            "/webhook", json=test_update, headers={SECRET_TOKEN_HEADER: "wrong"}
+        )
+        assert response.status == 403
+        response = await client.post("/webhook", json=test_update)
+        assert response.status == 403
+        response = await client.post(
+            "/webhook", data=b"not json", headers={SECRET_TOKEN_HEADER: "secret"}
+        )
+        assert response.status == 400
+        await scheduler.join()
+
+    assert dispatcher.dispatched == []
+
+
+def test_public_webhook_always_has_secret(monkeypatch):
+    monkeypatch.setenv("BOT_WEBHOOK_SECRET", "")
+    generated = _get_secret_token("https://example.com/webhook")
+    assert generated
+    assert generated != _get_secret_token("https://example.com/webhook")
+
+    # Локальная проверка без регистрации в Telegram обходится без секрета
+    assert _get_secret_token(None) is None
+
+    monkeypatch.setenv("BOT_WEBHOOK_SECRET", "secret")
+    assert _get_secret_token("https://example.com/webhook") == "secret"